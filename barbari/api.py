@@ -0,0 +1,269 @@
+"""Generate g-code from Python without going through the command line.
+
+For example::
+
+    from barbari import api
+
+    result = api.build(
+        "/path/to/gerber/exports",
+        ["simple"],
+        flatcam_path="/path/to/FlatCAM.py",
+    )
+    for path in result.gcode_files:
+        ...
+
+Nothing here writes to the console or asks questions; problems are
+raised as exceptions (`BarbariError` and `BarbariFlatcamError`
+subclasses).  Each call only uses objects it creates itself, so calls
+may run concurrently -- e.g. from a thread pool in a long-lived service
+-- as long as they don't write to the same directory.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import os
+import tempfile
+from typing import Callable, List, Mapping, Optional, Sequence, Union
+
+from . import clearance, gcode, optimizer
+from .config import Config, get_environment_config, get_merged_config
+from .exceptions import BarbariUserError
+from .flatcam import (
+    FlatcamProcess,
+    FlatcamProjectGenerator,
+    FlatcamWriteGcode,
+    ToolAssignment,
+    UnassignedTool,
+    add_step_markers,
+)
+from .gerbers import GerberProject
+from .metrics import Metrics
+from .runner import FlatcamRunner, StepTiming
+
+ConfigStack = Union[Config, Sequence[str]]
+
+SCRIPT_FILENAME = "generate_gcode.FlatScript"
+
+
+@dataclass
+class Plan:
+    """The flatcam steps needed to generate g-code for a project."""
+
+    directory: str
+    output_path: str
+    processes: List[FlatcamProcess]
+    tool_assignments: List[ToolAssignment]
+    unassigned_tools: List[UnassignedTool]
+    metrics: Metrics
+
+    @property
+    def gcode_writes(self) -> List[FlatcamWriteGcode]:
+        """Steps writing g-code, in the order the files should be run."""
+        return sorted(
+            (
+                process
+                for process in self.processes
+                if isinstance(process, FlatcamWriteGcode)
+            ),
+            key=lambda write: write.counter,
+        )
+
+    def get_script(self, markers: bool = False) -> str:
+        processes = add_step_markers(self.processes) if markers else self.processes
+
+        return "".join(f"{process}\n" for process in processes)
+
+    def write_script(self, markers: bool = False) -> str:
+        path = os.path.join(self.output_path, SCRIPT_FILENAME)
+        with open(path, "w") as outf:
+            outf.write(self.get_script(markers=markers))
+
+        return path
+
+
+@dataclass
+class BuildResult:
+    plan: Plan
+    script_path: str
+    gcode_files: List[str]
+    timings: List[StepTiming] = field(default_factory=list)
+
+
+def load_config(configs: ConfigStack) -> Config:
+    """Merge a stack of configuration names; an already-loaded config is used as-is.
+
+    Services building many jobs with the same configuration can load it
+    once and pass the resulting `Config` to every call.
+    """
+    if isinstance(configs, Config):
+        return configs
+
+    return get_merged_config(list(configs))
+
+
+def write_layers(layers: Mapping[str, Union[str, bytes]], directory: str) -> None:
+    """Write in-memory layer files (keyed by file name) into `directory`.
+
+    Layers are identified by file name as they are for a directory of
+    exports, so names should follow KiCad's conventions (e.g.
+    `board-F_Cu.gtl`, `board.drl`).
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    for filename, content in layers.items():
+        if os.path.basename(filename) != filename or filename in ("", ".", ".."):
+            raise BarbariUserError(f"Invalid layer file name: {filename!r}")
+
+        mode = "wb" if isinstance(content, bytes) else "w"
+        with open(os.path.join(directory, filename), mode) as outf:
+            outf.write(content)
+
+
+def _prepare_directory(
+    directory: Optional[str], layers: Optional[Mapping[str, Union[str, bytes]]]
+) -> str:
+    if directory is None:
+        if layers is None:
+            raise BarbariUserError("Either a directory or layers are required.")
+        directory = tempfile.mkdtemp(prefix="barbari-")
+    directory = os.path.abspath(os.path.expanduser(directory))
+    if layers is not None:
+        write_layers(layers, directory)
+
+    return directory
+
+
+def plan(
+    directory: Optional[str],
+    configs: ConfigStack,
+    layers: Optional[Mapping[str, Union[str, bytes]]] = None,
+    output_path: Optional[str] = None,
+    optimize: bool = True,
+    metrics: Optional[Metrics] = None,
+    project: Optional[GerberProject] = None,
+    preflight: bool = True,
+) -> Plan:
+    """Work out the flatcam steps for a project without running flatcam.
+
+    The project is read from `directory`; if `layers` are given, they
+    are written into `directory` first -- or into a new temporary
+    directory (which the caller is responsible for removing) if
+    `directory` is `None`.  G-code will be written to `output_path`,
+    which defaults to `directory`.
+
+    Pass a `project` for `directory` to reuse the layers it has already
+    read rather than reading them again.
+
+    Unless `preflight` is false, `clearance.ClearanceError` is raised if
+    the isolation routing tool won't fit between copper features.
+    """
+    directory = _prepare_directory(directory, layers)
+    metrics = metrics or Metrics(project=directory)
+    output_path = os.path.abspath(os.path.expanduser(output_path or directory))
+    os.makedirs(output_path, exist_ok=True)
+
+    generator = FlatcamProjectGenerator(
+        project or GerberProject(directory, metrics=metrics),
+        load_config(configs),
+        output_path=output_path,
+        metrics=metrics,
+    )
+    if preflight:
+        problems = clearance.check_project(
+            generator.gerbers, generator.config, metrics=metrics
+        )
+        if problems:
+            raise clearance.ClearanceError(problems)
+    with metrics.timer("generate_seconds_total"):
+        processes = list(generator.get_cnc_processes())
+        if optimize:
+            processes = optimizer.optimize(processes)
+    metrics.set("steps", len(processes))
+
+    return Plan(
+        directory=directory,
+        output_path=output_path,
+        processes=processes,
+        tool_assignments=generator.tool_assignments,
+        unassigned_tools=generator.unassigned_tools,
+        metrics=metrics,
+    )
+
+
+def build(
+    directory: Optional[str],
+    configs: ConfigStack,
+    layers: Optional[Mapping[str, Union[str, bytes]]] = None,
+    output_path: Optional[str] = None,
+    flatcam_path: Optional[str] = None,
+    python_bin: Optional[str] = None,
+    step_timeout: Optional[float] = 600,
+    optimize: bool = True,
+    compact: bool = True,
+    precision: int = 3,
+    metrics: Optional[Metrics] = None,
+    on_step: Optional[Callable[[int, FlatcamProcess], None]] = None,
+    project: Optional[GerberProject] = None,
+    preflight: bool = True,
+) -> BuildResult:
+    """Plan a project's flatcam steps, then run flatcam to write its g-code.
+
+    See `plan` for how the project is found.  If `flatcam_path` or
+    `python_bin` aren't given, barbari's environment configuration (as
+    written by `barbari setup-flatcam`) is read to find them.  Existing
+    g-code in `output_path` is overwritten, but files this build does not
+    write are left alone; only files written are listed in the result.
+    """
+    if flatcam_path is None or python_bin is None:
+        environment = get_environment_config()
+        flatcam_path = flatcam_path or environment.flatcam_path
+        python_bin = python_bin or environment.python_bin
+    if not flatcam_path:
+        raise BarbariUserError(
+            "No flatcam path given, and none is configured; "
+            "run `barbari setup-flatcam` or pass `flatcam_path`."
+        )
+
+    directory = _prepare_directory(directory, layers)
+    metrics = metrics or Metrics(project=directory)
+    with metrics.record_build():
+        build_plan = plan(
+            directory,
+            configs,
+            output_path=output_path,
+            optimize=optimize,
+            metrics=metrics,
+            project=project,
+            preflight=preflight,
+        )
+        script_path = build_plan.write_script(markers=True)
+
+        runner = FlatcamRunner(
+            [python_bin or "python", flatcam_path, f"--shellfile={script_path}"],
+            build_plan.processes,
+            step_timeout=step_timeout or None,
+            metrics=metrics,
+        )
+        runner.run(on_step=on_step)
+
+        gcode_files: List[str] = []
+        for write in build_plan.gcode_writes:
+            if not os.path.exists(write.filename):
+                continue
+            if compact:
+                gcode.compact_file(write.filename, decimals=precision)
+            metrics.set(
+                "gcode_bytes",
+                os.path.getsize(write.filename),
+                file=os.path.basename(write.filename),
+            )
+            gcode_files.append(write.filename)
+        metrics.set("gcode_files", len(gcode_files))
+
+    return BuildResult(
+        plan=build_plan,
+        script_path=script_path,
+        gcode_files=gcode_files,
+        timings=runner.timings,
+    )
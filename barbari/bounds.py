@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import math
+import re
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+Bounds = Tuple[Tuple[float, float], Tuple[float, float]]
+
+FORMAT_PATTERN = re.compile(r"^FS([LTD]?)([AI])X(\d)(\d)Y(\d)(\d)")
+APERTURE_PATTERN = re.compile(r"^ADD(\d+)([^,]+)(?:,(.*))?$")
+WORD_PATTERN = re.compile(r"([GDXYIJ])([-+]?\d+)")
+
+READ_SIZE = 65536
+
+
+class UnsupportedGerber(ValueError):
+    pass
+
+
+@dataclass
+class LayerBounds:
+    units: str
+    bounds: Bounds
+    bounding_box: Bounds
+
+    @property
+    def width(self) -> float:
+        return self.bounds[0][1] - self.bounds[0][0]
+
+    @property
+    def height(self) -> float:
+        return self.bounds[1][1] - self.bounds[1][0]
+
+
+class _Extent(object):
+    def __init__(self):
+        self.min_x = self.min_y = math.inf
+        self.max_x = self.max_y = -math.inf
+
+    def add(self, x: float, y: float, half_x: float = 0, half_y: float = 0):
+        self.min_x = min(self.min_x, x - half_x)
+        self.max_x = max(self.max_x, x + half_x)
+        self.min_y = min(self.min_y, y - half_y)
+        self.max_y = max(self.max_y, y + half_y)
+
+    @property
+    def empty(self) -> bool:
+        return self.min_x == math.inf
+
+    @property
+    def bounds(self) -> Bounds:
+        return (self.min_x, self.max_x), (self.min_y, self.max_y)
+
+
+def _iter_statements(chunks: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+    """Yield `(extended, statement)` pairs from a stream of gerber data.
+
+    Only the first statement of each extended (`%...%`) block is yielded;
+    the rest are aperture macro bodies, which we don't need.
+    """
+    extended = False
+    first_in_block = False
+    buffer = ""
+
+    for chunk in chunks:
+        buffer += chunk
+        parts = buffer.split("*")
+        buffer = parts.pop()
+
+        for part in parts:
+            for idx, segment in enumerate(part.split("%")):
+                if idx:
+                    extended = not extended
+                    first_in_block = extended
+
+                segment = "".join(segment.split())
+                if not segment:
+                    continue
+
+                if not extended:
+                    yield False, segment
+                elif first_in_block:
+                    first_in_block = False
+                    yield True, segment
+
+
+def _get_aperture_size(template: str, modifiers: str) -> Tuple[float, float]:
+    values = [float(value) for value in modifiers.split("X") if value]
+
+    if template == "C" or template == "P":
+        return values[0] / 2, values[0] / 2
+    elif template in ("R", "O"):
+        return values[0] / 2, values[1] / 2
+
+    raise UnsupportedGerber(f"Cannot determine the size of aperture macro {template}")
+
+
+def _get_arc_extent(
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    center: Tuple[float, float],
+    clockwise: bool,
+) -> Iterator[Tuple[float, float]]:
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    start_angle = math.atan2(start[1] - center[1], start[0] - center[0])
+    end_angle = math.atan2(end[1] - center[1], end[0] - center[0])
+
+    if clockwise:
+        start_angle, end_angle = end_angle, start_angle
+    sweep = (end_angle - start_angle) % (2 * math.pi)
+    if sweep == 0:
+        sweep = 2 * math.pi
+
+    yield start
+    yield end
+    for quadrant in range(4):
+        angle = quadrant * math.pi / 2
+        if (angle - start_angle) % (2 * math.pi) <= sweep:
+            yield (
+                center[0] + radius * math.cos(angle),
+                center[1] + radius * math.sin(angle),
+            )
+
+
+def scan_bounds(chunks: Iterable[str]) -> LayerBounds:
+    """Find the extent of a gerber layer without building any primitives.
+
+    `bounds` covers the path drawn by the layer (i.e. for an outline, the
+    center of the drawn line), and `bounding_box` additionally includes
+    the size of the apertures used to draw or flash each feature.
+    """
+    units = "metric"
+    decimals: Optional[int] = None
+    digits = 0
+    omit_trailing = False
+    apertures: Dict[int, Tuple[float, float]] = {}
+    aperture: Tuple[float, float] = (0, 0)
+    interpolation = 1
+    operation = 2
+    region = False
+    x = y = 0.0
+
+    path = _Extent()
+    box = _Extent()
+
+    def parse(value: str) -> float:
+        if decimals is None:
+            raise UnsupportedGerber("Coordinate found before format specification.")
+        sign = -1 if value.startswith("-") else 1
+        value = value.lstrip("+-")
+        if omit_trailing:
+            value = value.ljust(digits, "0")
+
+        return sign * int(value) / (10**decimals)
+
+    for extended, statement in _iter_statements(chunks):
+        if extended:
+            if statement.startswith("FS"):
+                match = FORMAT_PATTERN.match(statement)
+                if not match or match.group(2) == "I":
+                    raise UnsupportedGerber(f"Unsupported format: {statement}")
+                omit_trailing = match.group(1) == "T"
+                decimals = int(match.group(4))
+                digits = int(match.group(3)) + decimals
+            elif statement.startswith("MO"):
+                units = "inch" if statement[2:4] == "IN" else "metric"
+            elif statement.startswith("AD"):
+                match = APERTURE_PATTERN.match(statement)
+                if not match:
+                    raise UnsupportedGerber(f"Unexpected aperture: {statement}")
+                try:
+                    apertures[int(match.group(1))] = _get_aperture_size(
+                        match.group(2), match.group(3) or ""
+                    )
+                except UnsupportedGerber:
+                    apertures[int(match.group(1))] = (math.nan, math.nan)
+            elif statement.startswith("SR") and statement != "SR":
+                raise UnsupportedGerber("Step and repeat is not supported.")
+            continue
+
+        if statement.startswith("G04") or statement.startswith("M"):
+            continue
+
+        words = WORD_PATTERN.findall(statement)
+        new_x, new_y = x, y
+        offset_i = offset_j = 0.0
+        has_coordinates = False
+        for letter, value in words:
+            if letter == "G":
+                code = int(value)
+                if code in (1, 2, 3):
+                    interpolation = code
+                elif code == 36:
+                    region = True
+                elif code == 37:
+                    region = False
+                elif code == 74:
+                    raise UnsupportedGerber("Single quadrant arcs are not supported.")
+                elif code == 91:
+                    raise UnsupportedGerber(
+                        "Incremental coordinates are not supported."
+                    )
+            elif letter == "D":
+                code = int(value)
+                if code >= 10:
+                    if code not in apertures:
+                        raise UnsupportedGerber(f"Aperture D{code} is not defined.")
+                    aperture = apertures[code]
+                else:
+                    operation = code
+            else:
+                has_coordinates = True
+                if letter == "X":
+                    new_x = parse(value)
+                elif letter == "Y":
+                    new_y = parse(value)
+                elif letter == "I":
+                    offset_i = parse(value)
+                elif letter == "J":
+                    offset_j = parse(value)
+
+        if not has_coordinates:
+            continue
+
+        half_x, half_y = (0.0, 0.0) if region else aperture
+        if operation in (1, 3) and math.isnan(half_x):
+            raise UnsupportedGerber("Cannot determine the size of an aperture macro.")
+
+        if operation == 1:
+            if interpolation == 1:
+                points: Iterable[Tuple[float, float]] = ((x, y), (new_x, new_y))
+            else:
+                points = _get_arc_extent(
+                    (x, y),
+                    (new_x, new_y),
+                    (x + offset_i, y + offset_j),
+                    clockwise=interpolation == 2,
+                )
+            for point in points:
+                path.add(*point)
+                box.add(*point, half_x, half_y)
+        elif operation == 3:
+            path.add(new_x, new_y)
+            box.add(new_x, new_y, half_x, half_y)
+
+        x, y = new_x, new_y
+
+    if path.empty:
+        raise UnsupportedGerber("No features found.")
+
+    return LayerBounds(units=units, bounds=path.bounds, bounding_box=box.bounds)
+
+
+def read_bounds(filename: str) -> LayerBounds:
+    """Find the extent of a gerber file, falling back to pcb-tools."""
+    try:
+        with open(filename, "r") as inf:
+            return scan_bounds(iter(lambda: inf.read(READ_SIZE), ""))
+    except (UnsupportedGerber, ValueError, IndexError) as e:
+        logger.debug("Unable to scan %s for bounds (%s); using pcb-tools.", filename, e)
+
+    import gerber
+
+    layer = gerber.read(filename)
+    return LayerBounds(
+        units=layer.units, bounds=layer.bounds, bounding_box=layer.bounding_box
+    )
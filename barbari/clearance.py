@@ -0,0 +1,628 @@
+"""Check that the isolation routing tool fits between copper features.
+
+FlatCAM will happily generate isolation routing for a board whose
+copper is closer together than the tool is wide; the tool then either
+leaves the features connected or cuts into them, and we only find out
+after the board has been milled.  These checks find such problems from
+the layers alone -- without running FlatCAM -- so they can be reported
+before a build starts.
+
+Copper primitives are reduced to line segments having a radius (a
+straight trace drawn with a round aperture is exactly that; pads and
+regions are represented by their outlines) and placed in a uniform grid
+so that only nearby segments are ever compared.  Segments that touch are
+joined into islands of connected copper, and any two islands closer
+together than the tool is wide are reported.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .config import Config
+from .constants import LayerType
+from .excellon import ExcellonLayer
+from .exceptions import BarbariUserError
+from .geometry import Flattener
+from .gerbers import GerberProject
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+COPPER_LAYERS = (LayerType.F_CU, LayerType.B_CU)
+
+MM_PER_INCH = 25.4
+
+# Distances within this many millimeters of each other are treated as
+# equal; gerber coordinates are rarely more precise than this.
+EPSILON = 1e-6
+
+# Arcs are flattened into chords no longer than this (in millimeters).
+ARC_CHORD_LENGTH = 0.25
+
+# Segment start X/Y, end X/Y, radius and the index of the copper feature
+# (i.e. gerber primitive) it belongs to.
+Segment = Tuple[float, float, float, float, float, int]
+
+Point = Tuple[float, float]
+
+
+class ClearanceError(BarbariUserError):
+    def __init__(self, problems: List[ClearanceProblem]):
+        self.problems = problems
+
+        narrowest = min(problems, key=lambda problem: problem.clearance)
+        super().__init__(
+            f"Found {len(problems)} place{'s' if len(problems) != 1 else ''} "
+            f"where the {narrowest.tool_size}mm "
+            "isolation routing tool will not fit between copper features; "
+            f"the narrowest is a {narrowest}."
+        )
+
+
+@dataclass
+class ClearanceProblem:
+    """A gap narrower than the isolation routing tool.
+
+    `kind` is `copper` for a gap between two copper features, and
+    `drill` for a drill hit or slot too close to copper it doesn't
+    belong to.  Positions and distances are in millimeters.
+    """
+
+    layer: LayerType
+    kind: str
+    position: Point
+    clearance: float
+    tool_size: float
+
+    def __str__(self):
+        return (
+            f"{self.kind} clearance of {self.clearance:.3f}mm on {self.layer.value} "
+            f"at ({self.position[0]:.3f}, {self.position[1]:.3f})"
+        )
+
+
+class _Islands(object):
+    """Union-find over copper features."""
+
+    def __init__(self, count: int):
+        self._parents = list(range(count))
+
+        super().__init__()
+
+    def find(self, feature: int) -> int:
+        parents = self._parents
+        while parents[feature] != feature:
+            parents[feature] = parents[parents[feature]]
+            feature = parents[feature]
+
+        return feature
+
+    def join(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self._parents[max(a, b)] = min(a, b)
+
+
+class SegmentGrid(object):
+    """Buckets items by the square cells their bounding boxes overlap."""
+
+    def __init__(self, cell_size: float):
+        self._cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+
+        super().__init__()
+
+    def _get_cells(
+        self, min_x: float, min_y: float, max_x: float, max_y: float
+    ) -> Iterator[Tuple[int, int]]:
+        size = self._cell_size
+        for cell_x in range(math.floor(min_x / size), math.floor(max_x / size) + 1):
+            for cell_y in range(math.floor(min_y / size), math.floor(max_y / size) + 1):
+                yield cell_x, cell_y
+
+    def add(
+        self, item: int, min_x: float, min_y: float, max_x: float, max_y: float
+    ) -> None:
+        for cell in self._get_cells(min_x, min_y, max_x, max_y):
+            self._cells.setdefault(cell, []).append(item)
+
+    def query(self, min_x: float, min_y: float, max_x: float, max_y: float) -> Set[int]:
+        found: Set[int] = set()
+        for cell in self._get_cells(min_x, min_y, max_x, max_y):
+            found.update(self._cells.get(cell, ()))
+
+        return found
+
+
+class _Polygon(object):
+    """A closed outline that can quickly test whether points lie within it.
+
+    Edges are bucketed into horizontal bands so that casting a ray from
+    a point only needs to consider edges in the point's band.
+    """
+
+    def __init__(self, points: List[Point], band_height: float):
+        self._band_height = band_height
+        self._bands: Dict[int, List[Tuple[Point, Point]]] = {}
+        self.min_x = min(x for x, _ in points)
+        self.max_x = max(x for x, _ in points)
+        self.min_y = min(y for _, y in points)
+        self.max_y = max(y for _, y in points)
+
+        for start, end in zip(points, points[1:] + points[:1]):
+            if start[1] == end[1]:
+                continue
+            low, high = sorted((start[1], end[1]))
+            for band in range(
+                math.floor(low / band_height), math.floor(high / band_height) + 1
+            ):
+                self._bands.setdefault(band, []).append((start, end))
+
+        super().__init__()
+
+    def contains(self, x: float, y: float) -> bool:
+        if not (self.min_x <= x <= self.max_x and self.min_y <= y <= self.max_y):
+            return False
+
+        inside = False
+        for (x1, y1), (x2, y2) in self._bands.get(
+            math.floor(y / self._band_height), ()
+        ):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+
+        return inside
+
+
+def _get_arc_points(
+    start: Point, end: Point, center: Point, clockwise: bool
+) -> List[Point]:
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    start_angle = math.atan2(start[1] - center[1], start[0] - center[0])
+    end_angle = math.atan2(end[1] - center[1], end[0] - center[0])
+
+    sweep = (start_angle - end_angle) if clockwise else (end_angle - start_angle)
+    sweep %= 2 * math.pi
+    if sweep < EPSILON:
+        sweep = 2 * math.pi
+    if clockwise:
+        sweep = -sweep
+
+    count = min(max(math.ceil(abs(sweep) * radius / ARC_CHORD_LENGTH), 2), 360)
+    return [
+        (
+            center[0] + radius * math.cos(start_angle + sweep * step / count),
+            center[1] + radius * math.sin(start_angle + sweep * step / count),
+        )
+        for step in range(count + 1)
+    ]
+
+
+def _get_aperture_radius(aperture) -> float:
+    if hasattr(aperture, "diameter"):
+        return aperture.diameter / 2
+    if hasattr(aperture, "width"):
+        return max(aperture.width, aperture.height) / 2
+
+    (min_x, max_x), (min_y, max_y) = aperture.bounding_box
+    return max(max_x - min_x, max_y - min_y) / 2
+
+
+class CopperLayer(object):
+    """A copper layer's primitives, as radiused segments in millimeters.
+
+    Primitives are approximated where exact geometry isn't needed to
+    find narrow gaps: lines drawn with a rectangular aperture are
+    treated as if drawn with a round one as wide as the rectangle's
+    longest side.  Other flashes (rectangles, aperture macros) are
+    outlined by `flattener`, once per shape.  Clear-polarity primitives,
+    and the clear parts of aperture macros, are ignored.
+    """
+
+    def __init__(
+        self, layer_type: LayerType, layer, flattener: Optional[Flattener] = None
+    ):
+        self.layer_type = layer_type
+        self.segments: List[Segment] = []
+        # Each feature's outlines, if it has any; a region has one, but an
+        # aperture macro may have several.
+        self.outlines: List[Tuple[int, List[Point]]] = []
+        self.feature_count = 0
+        self._scale = MM_PER_INCH if layer.units == "inch" else 1.0
+        self._flattener = flattener or Flattener()
+
+        for primitive in layer.primitives:
+            if getattr(primitive, "level_polarity", "dark") == "clear":
+                continue
+            self._add_primitive(primitive, self.feature_count)
+            self.feature_count += 1
+
+        super().__init__()
+
+    def _point(self, point) -> Point:
+        return point[0] * self._scale, point[1] * self._scale
+
+    def _add_path(self, points: List[Point], radius: float, feature: int) -> None:
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            self.segments.append((x1, y1, x2, y2, radius, feature))
+
+    def _add_outline(self, points: List[Point], feature: int) -> None:
+        self._add_path(points + points[:1], 0.0, feature)
+        self.outlines.append((feature, points))
+
+    def _add_primitive(self, primitive, feature: int) -> None:
+        from gerber import primitives
+
+        if isinstance(primitive, primitives.Line):
+            self._add_path(
+                [self._point(primitive.start), self._point(primitive.end)],
+                _get_aperture_radius(primitive.aperture) * self._scale,
+                feature,
+            )
+        elif isinstance(primitive, primitives.Arc):
+            self._add_path(
+                _get_arc_points(
+                    self._point(primitive.start),
+                    self._point(primitive.end),
+                    self._point(primitive.center),
+                    clockwise=primitive.direction == "clockwise",
+                ),
+                _get_aperture_radius(primitive.aperture) * self._scale,
+                feature,
+            )
+        elif isinstance(primitive, (primitives.Circle, primitives.Polygon)):
+            x, y = self._point(primitive.position)
+            self._add_path([(x, y), (x, y)], primitive.radius * self._scale, feature)
+        elif isinstance(primitive, primitives.Obround):
+            x, y = self._point(primitive.position)
+            width = primitive.width * self._scale
+            height = primitive.height * self._scale
+            offset_x = max(width - height, 0) / 2
+            offset_y = max(height - width, 0) / 2
+            self._add_path(
+                [(x - offset_x, y - offset_y), (x + offset_x, y + offset_y)],
+                min(width, height) / 2,
+                feature,
+            )
+        elif isinstance(primitive, primitives.Region):
+            points: List[Point] = []
+            for part in primitive.primitives:
+                if isinstance(part, primitives.Arc):
+                    points.extend(
+                        _get_arc_points(
+                            self._point(part.start),
+                            self._point(part.end),
+                            self._point(part.center),
+                            clockwise=part.direction == "clockwise",
+                        )[:-1]
+                    )
+                else:
+                    points.append(self._point(part.start))
+            if len(points) >= 3:
+                self._add_outline(points, feature)
+        else:
+            for points, dark in self._flattener.get_flash(primitive, self._scale):
+                if dark:
+                    self._add_outline([(x, y) for x, y in points.tolist()], feature)
+
+
+def _get_point_distance(
+    px: float, py: float, x1: float, y1: float, x2: float, y2: float
+) -> Tuple[float, Point]:
+    """Return the distance from a point to a segment, and the nearest point on it."""
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = 0.0
+    if length:
+        t = min(max(((px - x1) * dx + (py - y1) * dy) / length, 0.0), 1.0)
+    nearest = (x1 + t * dx, y1 + t * dy)
+
+    return math.hypot(px - nearest[0], py - nearest[1]), nearest
+
+
+def _segments_cross(a: Segment, b: Segment) -> bool:
+    def side(x1, y1, x2, y2, px, py):
+        return (x2 - x1) * (py - y1) - (y2 - y1) * (px - x1)
+
+    d1 = side(b[0], b[1], b[2], b[3], a[0], a[1])
+    d2 = side(b[0], b[1], b[2], b[3], a[2], a[3])
+    d3 = side(a[0], a[1], a[2], a[3], b[0], b[1])
+    d4 = side(a[0], a[1], a[2], a[3], b[2], b[3])
+
+    return ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0)) and d1 * d2 * d3 * d4 != 0
+
+
+def get_gap(a: Segment, b: Segment) -> Tuple[float, Point]:
+    """Return the gap between two radiused segments, and where it is narrowest.
+
+    Overlapping segments have a gap of zero or less.
+    """
+    radii = a[4] + b[4]
+    if _segments_cross(a, b):
+        return -radii, (a[0], a[1])
+
+    best = math.inf
+    position = (a[0], a[1])
+    for point, segment in (
+        ((a[0], a[1]), b),
+        ((a[2], a[3]), b),
+        ((b[0], b[1]), a),
+        ((b[2], b[3]), a),
+    ):
+        distance, nearest = _get_point_distance(*point, *segment[:4])
+        if distance < best:
+            best = distance
+            position = ((point[0] + nearest[0]) / 2, (point[1] + nearest[1]) / 2)
+
+    return best - radii, position
+
+
+def _split_segments(segments: Iterable[Segment], max_length: float) -> List[Segment]:
+    """Split long segments so each only occupies a few grid cells."""
+    split: List[Segment] = []
+    for segment in segments:
+        x1, y1, x2, y2, radius, feature = segment
+        count = math.ceil(math.hypot(x2 - x1, y2 - y1) / max_length)
+        if count <= 1:
+            split.append(segment)
+            continue
+        for step in range(count):
+            split.append(
+                (
+                    x1 + (x2 - x1) * step / count,
+                    y1 + (y2 - y1) * step / count,
+                    x1 + (x2 - x1) * (step + 1) / count,
+                    y1 + (y2 - y1) * (step + 1) / count,
+                    radius,
+                    feature,
+                )
+            )
+
+    return split
+
+
+def _get_box(
+    segment: Segment, margin: float = 0.0
+) -> Tuple[float, float, float, float]:
+    x1, y1, x2, y2, radius, _ = segment
+    margin += radius
+
+    return (
+        min(x1, x2) - margin,
+        min(y1, y2) - margin,
+        max(x1, x2) + margin,
+        max(y1, y2) + margin,
+    )
+
+
+class ClearanceChecker(object):
+    """Finds gaps narrower than `tool_size` on one copper layer."""
+
+    def __init__(self, copper: CopperLayer, tool_size: float):
+        self._copper = copper
+        self._tool_size = tool_size
+        self._cell_size = max(tool_size * 4, 0.5)
+        self._segments = _split_segments(copper.segments, self._cell_size)
+        self._grid = SegmentGrid(self._cell_size)
+        self._islands = _Islands(copper.feature_count)
+        self._outlines = [
+            (feature, _Polygon(points, self._cell_size))
+            for feature, points in copper.outlines
+        ]
+        self._outline_grid = SegmentGrid(self._cell_size)
+
+        for index, segment in enumerate(self._segments):
+            self._grid.add(index, *_get_box(segment))
+        for index, (_, outline) in enumerate(self._outlines):
+            self._outline_grid.add(
+                index, outline.min_x, outline.min_y, outline.max_x, outline.max_y
+            )
+
+        super().__init__()
+
+    def _join_contained_features(self) -> None:
+        """Join features lying entirely within a region (e.g. a pour) to it."""
+        starts: Dict[int, Point] = {}
+        for segment in self._segments:
+            starts.setdefault(segment[5], (segment[0], segment[1]))
+
+        for feature, outline in self._outlines:
+            for index in self._grid.query(
+                outline.min_x, outline.min_y, outline.max_x, outline.max_y
+            ):
+                other = self._segments[index][5]
+                if other == feature or self._islands.find(other) == self._islands.find(
+                    feature
+                ):
+                    continue
+                if outline.contains(*starts[other]):
+                    self._islands.join(feature, other)
+
+    def _get_owners(
+        self, hole: Segment
+    ) -> Tuple[Set[int], List[Tuple[int, float, Point]]]:
+        """Find the islands a drill hit or slot is in, and those near it."""
+        owners: Set[int] = set()
+        nearby: List[Tuple[int, float, Point]] = []
+
+        for index in self._grid.query(*_get_box(hole, self._tool_size)):
+            segment = self._segments[index]
+            island = self._islands.find(segment[5])
+            gap, position = get_gap(hole, segment)
+            if gap <= EPSILON:
+                owners.add(island)
+            elif gap < self._tool_size - EPSILON:
+                nearby.append((island, gap, position))
+
+        for index in self._outline_grid.query(hole[0], hole[1], hole[0], hole[1]):
+            feature, outline = self._outlines[index]
+            if outline.contains(hole[0], hole[1]):
+                owners.add(self._islands.find(feature))
+
+        return owners, nearby
+
+    def check_copper(self) -> List[ClearanceProblem]:
+        """Find gaps between copper features that the tool won't fit into."""
+        narrow: List[Tuple[int, int, float, Point]] = []
+
+        find = self._islands.find
+        boxes = [_get_box(segment) for segment in self._segments]
+
+        for index, segment in enumerate(self._segments):
+            min_x, min_y, max_x, max_y = _get_box(segment, self._tool_size)
+            for other_index in self._grid.query(min_x, min_y, max_x, max_y):
+                if other_index <= index:
+                    continue
+                other_box = boxes[other_index]
+                if (
+                    other_box[0] > max_x
+                    or other_box[1] > max_y
+                    or other_box[2] < min_x
+                    or other_box[3] < min_y
+                ):
+                    continue
+                # Once connected, features can't become unconnected; we
+                # no longer care how close together they are.
+                other = self._segments[other_index]
+                if find(other[5]) == find(segment[5]):
+                    continue
+
+                gap, position = get_gap(segment, other)
+                if gap <= EPSILON:
+                    self._islands.join(segment[5], other[5])
+                elif gap < self._tool_size - EPSILON:
+                    narrow.append((segment[5], other[5], gap, position))
+
+        self._join_contained_features()
+
+        # Only report the narrowest gap between each pair of islands;
+        # gaps within an island don't need isolating.
+        narrowest: Dict[Tuple[int, int], Tuple[float, Point]] = {}
+        for feature, other, gap, position in narrow:
+            a, b = self._islands.find(feature), self._islands.find(other)
+            if a == b:
+                continue
+            key = (min(a, b), max(a, b))
+            if key not in narrowest or gap < narrowest[key][0]:
+                narrowest[key] = (gap, position)
+
+        return [
+            ClearanceProblem(
+                layer=self._copper.layer_type,
+                kind="copper",
+                position=position,
+                clearance=gap,
+                tool_size=self._tool_size,
+            )
+            for gap, position in sorted(narrowest.values())
+        ]
+
+    def check_drills(self, drills: ExcellonLayer) -> List[ClearanceProblem]:
+        """Find drill hits and slots too close to copper they aren't part of.
+
+        Must be called after `check_copper`, which finds which copper
+        features are connected.
+        """
+        scale = MM_PER_INCH if drills.units == "inch" else 1.0
+        holes: List[Segment] = []
+        for number, hits in drills.hits.items():
+            radius = drills.tools[number].diameter * scale / 2
+            for x, y in hits:
+                holes.append((x * scale, y * scale, x * scale, y * scale, radius, -1))
+        for number, slots in drills.slots.items():
+            radius = drills.tools[number].diameter * scale / 2
+            for x1, y1, x2, y2 in slots:
+                holes.append(
+                    (x1 * scale, y1 * scale, x2 * scale, y2 * scale, radius, -1)
+                )
+
+        problems: List[ClearanceProblem] = []
+        for hole in holes:
+            owners, nearby = self._get_owners(hole)
+            if len(owners) > 1:
+                problems.append(
+                    ClearanceProblem(
+                        layer=self._copper.layer_type,
+                        kind="drill",
+                        position=(hole[0], hole[1]),
+                        clearance=0.0,
+                        tool_size=self._tool_size,
+                    )
+                )
+                continue
+
+            foreign = [item for item in nearby if item[0] not in owners]
+            if foreign:
+                _, gap, position = min(foreign, key=lambda item: item[1])
+                problems.append(
+                    ClearanceProblem(
+                        layer=self._copper.layer_type,
+                        kind="drill",
+                        position=position,
+                        clearance=gap,
+                        tool_size=self._tool_size,
+                    )
+                )
+
+        return sorted(problems, key=lambda problem: problem.clearance)
+
+
+def check_project(
+    project: GerberProject,
+    config: Config,
+    tool_size: Optional[float] = None,
+    metrics: Optional[Metrics] = None,
+) -> List[ClearanceProblem]:
+    """Check each copper layer (and the drill layer) against the isolation tool.
+
+    `tool_size` defaults to the smallest isolation routing tool in
+    `config`; if there is none, there is nothing to check.
+    """
+    metrics = metrics or project.metrics
+    if tool_size is None:
+        if config.isolation_routing is None:
+            return []
+        tool_size = config.isolation_routing.tool_size
+
+    layer_paths = project.get_layer_paths()
+    drills = project.get_drill_layer() if LayerType.DRILL in layer_paths else None
+
+    problems: List[ClearanceProblem] = []
+    for layer_type in COPPER_LAYERS:
+        if layer_type not in layer_paths:
+            continue
+
+        with metrics.timer("preflight_seconds_total", layer=layer_type.value):
+            checker = ClearanceChecker(
+                CopperLayer(
+                    layer_type, project.get_layer(layer_type), project.flattener
+                ),
+                tool_size,
+            )
+            problems.extend(checker.check_copper())
+            if drills is not None:
+                problems.extend(checker.check_drills(drills))
+
+    for kind in ("copper", "drill"):
+        metrics.set(
+            "clearance_problems",
+            sum(problem.kind == kind for problem in problems),
+            kind=kind,
+        )
+    for problem in problems:
+        metrics.event(
+            "clearance_problem",
+            layer=problem.layer.value,
+            kind=problem.kind,
+            x=problem.position[0],
+            y=problem.position[1],
+            clearance=problem.clearance,
+            tool_size=problem.tool_size,
+        )
+
+    return problems
@@ -2,21 +2,84 @@ from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod
 import argparse
+from dataclasses import asdict, dataclass
+import hashlib
+import importlib
+import json
 import logging
-import pkg_resources
-from typing import Dict, Type
+import os
+import sys
+from typing import Any, Dict, Iterable, Optional, Type, TYPE_CHECKING
 
-from rich.console import Console
+import appdirs
 
+from .. import __version__
 from ..config import EnvironmentConfig, get_environment_config
 
+if TYPE_CHECKING:
+    from importlib.metadata import EntryPoint
+
+    from rich.console import Console
+
 
 logger = logging.getLogger(__name__)
 
 
-def get_installed_commands():
-    possible_commands: Dict[str, Type[BaseCommand]] = {}
-    for entry_point in pkg_resources.iter_entry_points(group="barbari.commands"):
+COMMAND_ENTRY_POINT_GROUP = "barbari.commands"
+
+
+@dataclass
+class CommandEntry:
+    name: str
+    value: str
+    help: str = ""
+
+    def load(self) -> Type[BaseCommand]:
+        module_name, _, attrs = self.value.partition(":")
+
+        loaded: Any = importlib.import_module(module_name.strip())
+        for attr in filter(None, attrs.strip().split(".")):
+            loaded = getattr(loaded, attr)
+
+        return loaded
+
+
+def get_command_cache_path() -> str:
+    return os.path.join(
+        appdirs.user_cache_dir("barbari", "coddingtonbear"), "commands.json"
+    )
+
+
+def _get_command_cache_key() -> str:
+    # Installing, upgrading or removing a distribution adds or removes
+    # a metadata directory somewhere on `sys.path`, which bumps the
+    # mtime of that path entry; that's a lot cheaper to check than
+    # re-scanning every distribution's metadata.  The first entry is
+    # the running script's directory (or the working directory), which
+    # changes between invocations without affecting installed commands.
+    parts = [sys.executable, __version__]
+    for path in sys.path[1:]:
+        try:
+            parts.append(f"{path}:{os.stat(path).st_mtime_ns}")
+        except OSError:
+            continue
+
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _iter_entry_points() -> Iterable[EntryPoint]:
+    from importlib import metadata
+
+    try:
+        return metadata.entry_points(group=COMMAND_ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        return metadata.entry_points().get(COMMAND_ENTRY_POINT_GROUP, [])
+
+
+def _build_command_index() -> Dict[str, CommandEntry]:
+    possible_commands: Dict[str, CommandEntry] = {}
+    for entry_point in _iter_entry_points():
         try:
             loaded_class = entry_point.load()
         except ImportError:
@@ -25,24 +88,106 @@ def get_installed_commands():
                 entry_point,
             )
             continue
-        if not issubclass(loaded_class, BaseCommand):
+        if not isinstance(loaded_class, type) or not issubclass(
+            loaded_class, BaseCommand
+        ):
             logger.warning(
                 "Loaded entrypoint %s, but loaded class is "
                 "not a subclass of `barbari.commands.BaseCommand`.",
                 entry_point,
             )
             continue
-        possible_commands[entry_point.name] = loaded_class
+        possible_commands[entry_point.name] = CommandEntry(
+            name=entry_point.name,
+            value=entry_point.value,
+            help=loaded_class.get_help(),
+        )
 
     return possible_commands
 
 
+def _read_command_index(key: str) -> Optional[Dict[str, CommandEntry]]:
+    try:
+        with open(get_command_cache_path(), "r") as inf:
+            cached = json.load(inf)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
+
+    try:
+        return {
+            name: CommandEntry(**entry) for name, entry in cached["commands"].items()
+        }
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def _write_command_index(key: str, commands: Dict[str, CommandEntry]) -> None:
+    cache_path = get_command_cache_path()
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, "w") as outf:
+            json.dump(
+                {
+                    "key": key,
+                    "commands": {
+                        name: asdict(entry) for name, entry in commands.items()
+                    },
+                },
+                outf,
+            )
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.debug("Unable to write command index to %s: %s", cache_path, e)
+
+
+def get_installed_commands(refresh: bool = False) -> Dict[str, CommandEntry]:
+    """Return the installed commands without importing any of them.
+
+    Discovering commands means scanning every installed distribution's
+    entry points, and reading each command's help means importing it; we
+    do that once and cache the result until the installed distributions
+    change.  Some changes (e.g. adding a command to a distribution
+    installed in development mode) can't be noticed cheaply; callers
+    looking for a command that isn't listed should pass `refresh`.
+    """
+    key = _get_command_cache_key()
+
+    if not refresh:
+        cached = _read_command_index(key)
+        if cached is not None:
+            return cached
+
+    commands = _build_command_index()
+    _write_command_index(key, commands)
+
+    return commands
+
+
+def load_command(entry: CommandEntry) -> Type[BaseCommand]:
+    try:
+        return entry.load()
+    except (ImportError, AttributeError):
+        # The cached index is stale -- e.g. a plugin was removed
+        # without touching anything we check for changes.
+        refreshed = get_installed_commands(refresh=True)
+        if entry.name not in refreshed:
+            raise
+        return refreshed[entry.name].load()
+
+
 class BaseCommand(metaclass=ABCMeta):
     _options: argparse.Namespace
     _console: Console
     _config: EnvironmentConfig
 
     def __init__(self, options: argparse.Namespace):
+        from rich.console import Console
+
         self._options: argparse.Namespace = options
         self._console = Console()
         self._config = get_environment_config()
@@ -1,7 +1,13 @@
 import argparse
-import subprocess
+import os
+from typing import Iterable, List
 
-from ..exceptions import BarbariFlatcamError
+from rich.progress import BarColumn, Progress, TextColumn, TimeElapsedColumn
+from rich.table import Table
+
+from ..flatcam import FlatcamProcess, FlatcamWriteGcode
+from ..gcode import compact_file
+from ..runner import FlatcamRunner, StepTiming
 from .build_script import Command as BuildScriptCommand
 
 
@@ -21,25 +27,131 @@ class Command(BuildScriptCommand):
                 "using one."
             ),
         )
+        parser.add_argument(
+            "--step-timeout",
+            type=float,
+            default=600,
+            help=(
+                "Number of seconds flatcam may take to start, or to run a "
+                "single command, before it is assumed to have hung and is "
+                "killed; set to 0 to disable."
+            ),
+        )
+        parser.add_argument(
+            "--slowest",
+            type=int,
+            default=5,
+            help="Number of slowest flatcam commands to display once finished.",
+        )
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help=(
+                "Number of decimal places to keep in g-code coordinates "
+                "(when in millimeters; one more is kept for inches)."
+            ),
+        )
+        parser.add_argument(
+            "--no-compact",
+            dest="compact",
+            action="store_false",
+            help=(
+                "Leave g-code exactly as flatcam wrote it instead of "
+                "removing comments and redundant words."
+            ),
+        )
         return super().add_arguments(parser)
 
-    def handle(self) -> None:
-        output_file = self.build_script()
+    def get_flatcam_args(self, output_file: str) -> List[str]:
+        return [
+            self.options.python_bin or self.config.python_bin or "python",
+            self.options.flatcam or self.config.flatcam_path or "./FlatCam.py",
+            f"--shellfile={output_file}",
+        ]
 
-        self.console.print(f"Wrote g-code generation script to {output_file}.")
+    def display_timings(self, timings: List[StepTiming]) -> None:
+        if not timings:
+            return
 
-        proc = subprocess.Popen(
-            [
-                self.options.python_bin or self.config.python_bin or "python",
-                self.options.flatcam or self.config.flatcam_path or "./FlatCam.py",
-                f"--shellfile={output_file}",
-            ],
-        )
-        result = proc.wait()
+        table = Table(title="Slowest flatcam commands")
+        table.add_column("Step", justify="right")
+        table.add_column("Seconds", justify="right")
+        table.add_column("Command")
+
+        for timing in timings:
+            table.add_row(str(timing.index), f"{timing.duration:.2f}", timing.command)
+
+        self.console.print(table)
+
+    def compact_output(self, filenames: Iterable[str]) -> None:
+        if not self.options.compact:
+            return
 
-        if result != 0:
-            raise BarbariFlatcamError(
-                "Failed to execute flatcam script; see output above."
+        total_before = total_after = 0
+        for filename in filenames:
+            if not os.path.exists(filename):
+                continue
+            before, after = compact_file(filename, decimals=self.options.precision)
+            total_before += before
+            total_after += after
+
+        if total_before:
+            self.console.print(
+                f"Compacted g-code from {total_before / 1024:.1f}KB "
+                f"to {total_after / 1024:.1f}KB."
             )
 
-        self.console.print("Flatcam executed successfully.")
+    def run_flatcam(
+        self, output_file: str, processes: List[FlatcamProcess]
+    ) -> FlatcamRunner:
+        runner = FlatcamRunner(
+            self.get_flatcam_args(output_file),
+            processes,
+            step_timeout=self.options.step_timeout or None,
+            metrics=self.metrics,
+        )
+
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+            console=self.console,
+        ) as progress:
+            task = progress.add_task("Starting flatcam", total=len(processes))
+
+            def on_step(index, process):
+                progress.update(
+                    task,
+                    completed=index,
+                    description=str(process).split(" ", 1)[0],
+                )
+
+            runner.run(on_step=on_step)
+            progress.update(task, completed=len(processes), description="Done")
+
+        return runner
+
+    def handle(self) -> None:
+        try:
+            with self.metrics.record_build():
+                processes = self.get_processes()
+                output_file = self.build_script(processes, markers=True)
+
+                self.console.print(f"Wrote g-code generation script to {output_file}.")
+
+                runner = self.run_flatcam(output_file, processes)
+
+                self.console.print("Flatcam executed successfully.")
+                filenames = [
+                    process.filename
+                    for process in processes
+                    if isinstance(process, FlatcamWriteGcode)
+                ]
+                self.compact_output(filenames)
+                self.record_output(filenames)
+        finally:
+            self.write_metrics()
+
+        self.display_timings(runner.get_slowest(self.options.slowest))
@@ -0,0 +1,81 @@
+import argparse
+import collections
+from typing import Tuple
+
+from .. import config, gerbers, panel
+from ..exceptions import BarbariUserError
+from .build_panel import Command as BuildPanelCommand
+
+
+class Command(BuildPanelCommand):
+    @classmethod
+    def add_panel_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--stock",
+            required=True,
+            help="Size (in mm) of your copper blank; e.g. '100x70'.",
+        )
+        parser.add_argument(
+            "--margin",
+            type=float,
+            help=(
+                "Distance (in mm) to keep boards from the edges of the blank; "
+                "defaults to leaving just enough room for alignment holes."
+            ),
+        )
+        parser.add_argument(
+            "--spacing",
+            type=float,
+            help=(
+                "Distance (in mm) between adjacent boards; defaults to "
+                "leaving just enough room for each board's edge cut."
+            ),
+        )
+        parser.add_argument(
+            "--no-rotate",
+            dest="rotate",
+            action="store_false",
+            help="Do not rotate boards to fit more of them onto the blank.",
+        )
+
+    def get_stock_size(self) -> Tuple[float, float]:
+        try:
+            width, height = (float(v) for v in self.options.stock.lower().split("x"))
+        except ValueError:
+            raise BarbariUserError(
+                f"Unable to read stock size '{self.options.stock}'; "
+                "expected WIDTHxHEIGHT."
+            )
+
+        return width, height
+
+    def get_panel(self, conf: config.Config) -> panel.Panel:
+        width, height = self.get_stock_size()
+
+        margin = self.options.margin
+        if margin is None:
+            margin = 0.0
+            if conf.alignment_holes:
+                margin = (
+                    conf.alignment_holes.hole_offset
+                    + conf.alignment_holes.hole_size
+                    + conf.alignment_holes.tool_size
+                )
+
+        spacing = self.options.spacing
+        if spacing is None:
+            spacing = 0.0
+            if conf.edge_cuts:
+                spacing = 2 * (conf.edge_cuts.margin + conf.edge_cuts.tool_size)
+
+        copies = collections.Counter(self.get_board_paths())
+
+        return panel.NestedPanel(
+            [gerbers.GerberProject(path, metrics=self.metrics) for path in copies],
+            copies=list(copies.values()),
+            stock_width=width,
+            stock_height=height,
+            margin=margin,
+            spacing=spacing,
+            rotation=self.options.rotate,
+        )
@@ -0,0 +1,132 @@
+import argparse
+import os
+from typing import Dict, List, Tuple
+
+from .. import config, gerbers, panel
+from ..runner import StepTiming
+from .build import Command as BuildCommand
+
+
+class Command(BuildCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--board",
+            action="append",
+            help=(
+                "Path to a directory holding gerber/drl exports for a board "
+                "to place in the panel; specify more than once to mix boards. "
+                "Boards fill the panel's positions in turn.  Defaults to "
+                "the output directory."
+            ),
+        )
+        cls.add_panel_arguments(parser)
+        return super().add_arguments(parser)
+
+    @classmethod
+    def add_panel_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--columns", type=int, default=1, help="Number of boards across."
+        )
+        parser.add_argument("--rows", type=int, default=1, help="Number of boards up.")
+        parser.add_argument(
+            "--spacing",
+            type=float,
+            default=0,
+            help="Distance (in mm) between adjacent boards.",
+        )
+
+    def get_work_path(self, name: str) -> str:
+        path = os.path.join(
+            os.path.abspath(os.path.expanduser(self.options.directory)),
+            "panel",
+            name,
+        )
+        os.makedirs(path, exist_ok=True)
+
+        for filename in panel.find_gcode_files(path):
+            os.unlink(os.path.join(path, filename))
+
+        return path
+
+    def get_board_paths(self) -> List[str]:
+        return [
+            os.path.abspath(os.path.expanduser(path))
+            for path in (self.options.board or [self.options.directory])
+        ]
+
+    def get_panel(self, conf: config.Config) -> panel.Panel:
+        return panel.Panel(
+            [
+                gerbers.GerberProject(path, metrics=self.metrics)
+                for path in self.get_board_paths()
+            ],
+            columns=self.options.columns,
+            rows=self.options.rows,
+            spacing=self.options.spacing,
+        )
+
+    def build_panel(self) -> Tuple[panel.Panel, List[str], List[StepTiming]]:
+        directory = os.path.abspath(os.path.expanduser(self.options.directory))
+        conf = config.get_merged_config(self.options.config)
+        board_panel = self.get_panel(conf)
+
+        self.clear_existing_output()
+
+        timings: List[StepTiming] = []
+        board_paths: Dict[int, str] = {}
+        for idx, board in enumerate(board_panel.boards):
+            path = self.get_work_path(f"board_{idx}")
+            processes = self.get_processes(
+                board_panel.get_board_generator(idx, conf, path)
+            )
+            output_file = self.write_script(processes, path, markers=True)
+
+            self.console.print(f"Generating toolpaths for {board.path}.")
+            timings.extend(self.run_flatcam(output_file, processes).timings)
+            board_paths[idx] = path
+
+        frame_path = self.get_work_path("frame")
+        processes = self.get_processes(
+            board_panel.get_frame_generator(conf, frame_path)
+        )
+        output_file = self.write_script(processes, frame_path, markers=True)
+
+        self.console.print("Generating alignment holes and cutout for panel.")
+        timings.extend(self.run_flatcam(output_file, processes).timings)
+
+        written = panel.assemble_panel_gcode(
+            board_panel,
+            frame_path,
+            board_paths,
+            directory,
+            mirror_axis=(
+                conf.alignment_holes.mirror_axis if conf.alignment_holes else ""
+            ),
+        )
+
+        self.compact_output(written)
+        self.record_output(written)
+
+        return board_panel, written, timings
+
+    def handle(self) -> None:
+        try:
+            with self.metrics.record_build():
+                board_panel, written, timings = self.build_panel()
+        finally:
+            self.write_metrics()
+
+        (min_x, max_x), (min_y, max_y) = board_panel.bounds
+        self.console.print(
+            f"Wrote {len(written)} g-code files for a "
+            f"{max_x - min_x:.2f}x{max_y - min_y:.2f}mm panel:"
+        )
+        for filename in written:
+            self.console.print(f"- {os.path.basename(filename)}")
+
+        self.display_timings(
+            sorted(timings, key=lambda timing: timing.duration, reverse=True)[
+                : self.options.slowest
+            ]
+        )
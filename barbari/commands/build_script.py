@@ -1,11 +1,13 @@
 import argparse
 import os
 import re
-from typing import List
+from typing import Iterable, List, Optional
 
 from rich.prompt import Confirm
+from rich.table import Table
 
-from .. import config, gerbers, flatcam
+from .. import clearance, config, gerbers, flatcam, optimizer
+from ..metrics import Metrics, write_event_log, write_textfile
 from . import BaseCommand
 
 
@@ -22,8 +24,73 @@ class Command(BaseCommand):
             nargs="+",
             help="Configuration file to use; later configs override earlier configs -- you can use this to layer your configuration.",
         )
+        parser.add_argument(
+            "--no-optimize",
+            dest="optimize",
+            action="store_false",
+            help=(
+                "Do not merge drilling and milling steps sharing a tool, "
+                "or skip loading layers that are unused."
+            ),
+        )
+        parser.add_argument(
+            "--no-preflight",
+            dest="preflight",
+            action="store_false",
+            help=(
+                "Do not check that the isolation routing tool fits between "
+                "copper features before generating toolpaths."
+            ),
+        )
+        parser.add_argument(
+            "--metrics-log",
+            help=(
+                "Path to a file to append a JSON-lines log of build events "
+                "(layers read, profiles assigned, flatcam steps run, etc.) to."
+            ),
+        )
+        parser.add_argument(
+            "--metrics-textfile",
+            help=(
+                "Path to write build metrics to in Prometheus' text format; "
+                "point this into node_exporter's textfile collector directory."
+            ),
+        )
         return super().add_arguments(parser)
 
+    def __init__(self, options: argparse.Namespace):
+        super().__init__(options)
+        self._metrics = Metrics(
+            project=os.path.abspath(os.path.expanduser(options.directory))
+        )
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    def write_metrics(self, recorders: Optional[List[Metrics]] = None) -> None:
+        recorders = recorders or [self.metrics]
+
+        event_log = self.options.metrics_log or self.config.metrics_log
+        if event_log:
+            write_event_log(event_log, recorders)
+
+        textfile = self.options.metrics_textfile or self.config.metrics_textfile
+        if textfile:
+            write_textfile(textfile, recorders)
+
+    def record_output(self, filenames: Iterable[str]) -> None:
+        files = 0
+        for filename in filenames:
+            if not os.path.exists(filename):
+                continue
+            size = os.path.getsize(filename)
+            self.metrics.set("gcode_bytes", size, file=os.path.basename(filename))
+            self.metrics.event("gcode_written", file=filename, size=size)
+            files += 1
+
+        self.metrics.set("gcode_files", files)
+
     def get_existing_output(self) -> List[str]:
         existing_files = []
 
@@ -35,14 +102,64 @@ class Command(BaseCommand):
 
         return existing_files
 
-    def build_script(self) -> str:
-        project = gerbers.GerberProject(
-            os.path.abspath(os.path.expanduser(self.options.directory))
-        )
-        generator = flatcam.FlatcamProjectGenerator(
-            project, config.get_merged_config(self.options.config)
+    def display_clearance_problems(
+        self, problems: List[clearance.ClearanceProblem], count: int = 20
+    ) -> None:
+        table = Table(title="Isolation routing clearance problems")
+        table.add_column("Layer")
+        table.add_column("Between")
+        table.add_column("X (mm)", justify="right")
+        table.add_column("Y (mm)", justify="right")
+        table.add_column("Clearance (mm)", justify="right")
+
+        for problem in sorted(problems, key=lambda problem: problem.clearance)[:count]:
+            table.add_row(
+                problem.layer.value,
+                "copper and drill" if problem.kind == "drill" else "copper",
+                f"{problem.position[0]:.3f}",
+                f"{problem.position[1]:.3f}",
+                f"{problem.clearance:.3f}",
+            )
+
+        self.console.print(table)
+        if len(problems) > count:
+            self.console.print(f"... and {len(problems) - count} more.")
+
+    def check_clearance(self, generator: flatcam.FlatcamProjectGenerator) -> None:
+        """Stop before running flatcam if the isolation tool won't fit."""
+        if not self.options.preflight:
+            return
+
+        problems = clearance.check_project(
+            generator.gerbers, generator.config, metrics=generator.metrics
         )
+        if problems:
+            self.display_clearance_problems(problems)
+            raise clearance.ClearanceError(problems)
 
+    def get_processes(
+        self, generator: Optional[flatcam.FlatcamProjectGenerator] = None
+    ) -> List[flatcam.FlatcamProcess]:
+        if generator is None:
+            project = gerbers.GerberProject(
+                os.path.abspath(os.path.expanduser(self.options.directory)),
+                metrics=self.metrics,
+            )
+            generator = flatcam.FlatcamProjectGenerator(
+                project, config.get_merged_config(self.options.config)
+            )
+
+        self.check_clearance(generator)
+
+        with generator.metrics.timer("generate_seconds_total"):
+            processes = list(generator.get_cnc_processes())
+            if self.options.optimize:
+                processes = optimizer.optimize(processes)
+        generator.metrics.set("steps", len(processes))
+
+        return processes
+
+    def clear_existing_output(self) -> None:
         existing_files = self.get_existing_output()
         if existing_files:
             self.console.print("The following existing flatcam output was found: ")
@@ -58,11 +175,18 @@ class Command(BaseCommand):
                         )
                     )
 
+    def write_script(
+        self,
+        processes: Iterable[flatcam.FlatcamProcess],
+        directory: str,
+        markers: bool = False,
+    ) -> str:
         output_file = os.path.join(
-            self.options.directory,
+            directory,
             "generate_gcode.FlatScript",
         )
-        processes = generator.get_cnc_processes()
+        if markers:
+            processes = flatcam.add_step_markers(processes)
         with open(output_file, "w") as outf:
             for process in processes:
                 outf.write(str(process))
@@ -70,7 +194,23 @@ class Command(BaseCommand):
 
         return output_file
 
+    def build_script(
+        self,
+        processes: Optional[Iterable[flatcam.FlatcamProcess]] = None,
+        markers: bool = False,
+    ) -> str:
+        if processes is None:
+            processes = self.get_processes()
+
+        self.clear_existing_output()
+
+        return self.write_script(processes, self.options.directory, markers=markers)
+
     def handle(self) -> None:
-        output_file = self.build_script()
+        try:
+            with self.metrics.record_build():
+                output_file = self.build_script()
+        finally:
+            self.write_metrics()
 
         self.console.print(f"Wrote g-code generation script to {output_file}.")
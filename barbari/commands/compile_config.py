@@ -0,0 +1,39 @@
+import argparse
+import time
+
+from .. import config, exceptions
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "config",
+            nargs="+",
+            help=(
+                "Configuration file to compile; later configs override "
+                "earlier configs.  Pass the same configs to 'build' to "
+                "use the compiled bundle."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        path = config.compile_config(self.options.config)
+
+        started = time.perf_counter()
+        conf = config.load_bundle(self.options.config)
+        elapsed = time.perf_counter() - started
+        if conf is None:
+            # Only if a source changed between compiling and loading.
+            raise exceptions.ConfigNotFound(
+                f"Unable to load the configuration just written to {path}; "
+                "re-run compile-config."
+            )
+
+        self.console.print(f"Wrote precompiled configuration to {path}.")
+        self.console.print(
+            f"{len(conf.drill)} drill and {len(conf.slot)} slot profiles; "
+            f"loads in {elapsed * 1000000:.0f}µs."
+        )
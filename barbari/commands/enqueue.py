@@ -0,0 +1,65 @@
+import argparse
+import json
+
+from .. import config
+from ..exceptions import BarbariUserError
+from ..server import JobStatus
+from ..spool import Spool
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "spool",
+            help="Path to the spool directory `barbari worker` takes jobs from.",
+        )
+        parser.add_argument(
+            "directory",
+            help=(
+                "Path to a directory holding your gerber/drl exports; it "
+                "must be reachable at the same path from every worker."
+            ),
+        )
+        parser.add_argument(
+            "config",
+            nargs="+",
+            help="Configuration file to use; later configs override earlier configs.",
+        )
+        parser.add_argument(
+            "--output",
+            help=(
+                "Directory to write g-code into; defaults to a directory "
+                "named for the job within the spool."
+            ),
+        )
+        parser.add_argument(
+            "--wait",
+            type=float,
+            default=0,
+            help="Number of seconds to wait for the job to finish.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        # Fail fast on configs that don't exist rather than queueing;
+        # each worker reads them again from its own configuration.
+        config.get_merged_config(self.options.config)
+
+        spool = Spool(self.options.spool)
+        job = spool.submit(
+            self.options.directory, self.options.config, output_path=self.options.output
+        )
+        self.console.print(
+            f"Queued job {job.id}; g-code will be written to {job.output_path}."
+        )
+        if not self.options.wait:
+            return
+
+        status = spool.wait(job.id, self.options.wait)
+        self.console.print_json(json.dumps(status))
+        if status is None or status["status"] == JobStatus.FAILED.value:
+            raise BarbariUserError(
+                f"Job {job.id} failed: {(status or {}).get('error') or 'it was removed'}."
+            )
@@ -0,0 +1,116 @@
+import argparse
+import os
+
+from rich.table import Table
+
+from .. import bounds, config, excellon, flatcam, gerbers
+from ..constants import LayerType
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "directory", help="Path to a directory holding your gerber/drl exports."
+        )
+        parser.add_argument(
+            "config",
+            nargs="*",
+            help=(
+                "Configuration file to use when showing alignment hole "
+                "positions; later configs override earlier configs."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def display_layers(self, project: gerbers.GerberProject) -> None:
+        table = Table(title="Layers")
+        table.add_column("Layer")
+        table.add_column("File")
+        table.add_column("Units")
+        table.add_column("Extent")
+        table.add_column("Bounding Box")
+
+        def format_bounds(value: bounds.Bounds) -> str:
+            (min_x, max_x), (min_y, max_y) = value
+            return f"({min_x:.3f}, {min_y:.3f}) - ({max_x:.3f}, {max_y:.3f})"
+
+        for layer_type, path in project.get_layer_paths().items():
+            try:
+                layer_bounds = project.get_bounds(layer_type)
+            except Exception as e:
+                table.add_row(
+                    layer_type.value, os.path.basename(path), "", f"[red]{e}[/red]", ""
+                )
+                continue
+
+            if layer_bounds.bounds is None:
+                table.add_row(
+                    layer_type.value,
+                    os.path.basename(path),
+                    layer_bounds.units,
+                    "(empty)",
+                    "",
+                )
+                continue
+
+            table.add_row(
+                layer_type.value,
+                os.path.basename(path),
+                layer_bounds.units,
+                format_bounds(layer_bounds.bounds),
+                format_bounds(layer_bounds.bounding_box),
+            )
+
+        self.console.print(table)
+
+    def display_tools(self, layer: excellon.ExcellonLayer) -> None:
+        table = Table(title=f"Drill Tools ({layer.units})")
+        table.add_column("Tool")
+        table.add_column("Diameter", justify="right")
+        table.add_column("Hits", justify="right")
+        table.add_column("Slots", justify="right")
+
+        for number, tool in sorted(layer.tools.items()):
+            table.add_row(
+                f"T{number}",
+                f"{tool.diameter:.3f}",
+                str(layer.get_hit_count(number)),
+                str(layer.get_hit_count(number, slot=True)),
+            )
+
+        self.console.print(table)
+
+    def handle(self) -> None:
+        project = gerbers.GerberProject(
+            os.path.abspath(os.path.expanduser(self.options.directory))
+        )
+        layer_paths = project.get_layer_paths()
+        if not layer_paths:
+            self.console.print("No gerber or drill files were found.", style="red")
+            return
+
+        if LayerType.EDGE_CUTS in layer_paths:
+            edge_cuts = project.get_bounds(LayerType.EDGE_CUTS)
+            self.console.print(
+                f"Board size: [b]{edge_cuts.width:.2f}x{edge_cuts.height:.2f}"
+                f"{'mm' if edge_cuts.units == 'metric' else 'in'}[/b]"
+            )
+        else:
+            self.console.print("No Edge.Cuts layer was found.", style="red")
+
+        self.display_layers(project)
+
+        if LayerType.DRILL in layer_paths:
+            self.display_tools(project.get_drill_layer())
+
+        if self.options.config and LayerType.EDGE_CUTS in layer_paths:
+            generator = flatcam.FlatcamProjectGenerator(
+                project, config.get_merged_config(self.options.config)
+            )
+            holes = generator.get_alignment_holes()
+            if holes:
+                self.console.print("Alignment holes:")
+                for x, y in holes:
+                    self.console.print(f"- ({x:.3f}, {y:.3f})")
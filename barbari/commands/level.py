@@ -0,0 +1,102 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from rich.table import Table
+
+from .. import panel
+from ..exceptions import BarbariUserError
+from ..leveling import HeightMap, ProbeGrid, is_leveled, level_file
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "directory", help="Path to a directory holding generated g-code."
+        )
+        parser.add_argument(
+            "height_map",
+            help=(
+                "Path to your controller's output from running the probe "
+                "program written by `barbari probe-grid` (or to a file of "
+                "`x,y,z` points, in mm)."
+            ),
+        )
+        parser.add_argument(
+            "--layer",
+            action="append",
+            dest="layers",
+            help=(
+                "Name of a layer (e.g. `b_cu`) to level; may be given "
+                "more than once.  By default, every file is leveled."
+            ),
+        )
+        parser.add_argument(
+            "--segment-length",
+            type=float,
+            default=1.0,
+            help="Longest distance (in mm) to cut without correcting depth.",
+        )
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help=(
+                "Number of decimal places to write coordinates with "
+                "(when in millimeters; one more is kept for inches)."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        directory = os.path.abspath(os.path.expanduser(self.options.directory))
+
+        grid_path = os.path.join(directory, "probe_grid.json")
+        grid = ProbeGrid.load(grid_path) if os.path.exists(grid_path) else None
+        height_map = HeightMap.read(
+            os.path.abspath(os.path.expanduser(self.options.height_map)), grid
+        )
+        self.console.print(
+            f"Surface height varies by {np.ptp(height_map.heights):.3f}mm "
+            f"across {len(height_map.xs)}x{len(height_map.ys)} points."
+        )
+
+        filenames = []
+        for filename in panel.find_gcode_files(directory):
+            match = panel.GCODE_FILENAME_PATTERN.match(filename)
+            if self.options.layers and match.group("name") not in self.options.layers:
+                continue
+            filenames.append(filename)
+        if not filenames:
+            raise BarbariUserError(f"No numbered g-code files found in {directory}.")
+
+        table = Table(title="Leveled g-code")
+        table.add_column("File")
+        table.add_column("Lines before", justify="right")
+        table.add_column("Lines after", justify="right")
+        table.add_column("Seconds", justify="right")
+
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if is_leveled(path):
+                table.add_row(filename, "", "(already leveled)", "")
+                continue
+
+            started = time.monotonic()
+            before, after = level_file(
+                path,
+                height_map,
+                segment_length=self.options.segment_length,
+                decimals=self.options.precision,
+            )
+            table.add_row(
+                filename,
+                str(before),
+                str(after),
+                f"{time.monotonic() - started:.1f}",
+            )
+
+        self.console.print(table)
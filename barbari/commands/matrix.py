@@ -0,0 +1,233 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import os
+import re
+import time
+from typing import List, Optional
+
+from rich.progress import BarColumn, Progress, TextColumn, TimeElapsedColumn
+from rich.table import Table
+
+from .. import config, flatcam, gcode, gerbers, optimizer, panel, program
+from ..exceptions import BarbariError, BarbariFlatcamError
+from ..metrics import Metrics
+from ..runner import FlatcamRunner
+from .build import Command as BuildCommand
+
+
+@dataclass
+class VariantResult:
+    name: str
+    configs: List[str]
+    path: str
+    metrics: Metrics
+    files: int = 0
+    duration: float = 0.0
+    tool_changes: int = 0
+    flips: int = 0
+    size: int = 0
+    unassigned_hits: int = 0
+    unassigned_tools: List[flatcam.UnassignedTool] = field(default_factory=list)
+    build_time: float = 0.0
+    error: Optional[str] = None
+
+
+class Command(BuildCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--variant",
+            action="append",
+            required=True,
+            help=(
+                "Comma-separated list of configuration files to add on top "
+                "of the base configuration; specify more than once to "
+                "compare several variants, e.g. "
+                "'--variant drilled_04_10 --variant milled_10'."
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of variants to build at once.",
+        )
+        parser.add_argument(
+            "--rapid-rate",
+            type=float,
+            default=1000,
+            help=(
+                "Speed (in mm/min) of your mill's rapid moves; used when "
+                "estimating how long each variant will take to mill."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(os.path.expanduser(self.options.directory))
+
+    def get_work_path(self, idx: int, name: str) -> str:
+        path = os.path.join(
+            self.directory,
+            "matrix",
+            f"{idx:02}.{re.sub(r'[^A-Za-z0-9_+.-]+', '_', name)}",
+        )
+        os.makedirs(path, exist_ok=True)
+
+        for filename in panel.find_gcode_files(path):
+            os.unlink(os.path.join(path, filename))
+
+        return path
+
+    def get_variants(self) -> List[VariantResult]:
+        variants: List[VariantResult] = []
+
+        for idx, variant in enumerate(self.options.variant, start=1):
+            configs = [name.strip() for name in variant.split(",") if name.strip()]
+            variants.append(
+                VariantResult(
+                    name=variant,
+                    configs=self.options.config + configs,
+                    path=self.get_work_path(idx, variant),
+                    metrics=Metrics(**self.metrics.labels, variant=variant),
+                )
+            )
+
+        return variants
+
+    def build_variant(
+        self,
+        project: gerbers.GerberProject,
+        result: VariantResult,
+        progress: Progress,
+    ) -> VariantResult:
+        task = progress.add_task(result.name, total=None)
+        started = time.monotonic()
+
+        try:
+            with result.metrics.record_build():
+                generator = flatcam.FlatcamProjectGenerator(
+                    project,
+                    config.get_merged_config(result.configs),
+                    result.path,
+                    metrics=result.metrics,
+                )
+                processes = self.get_processes(generator)
+                output_file = self.write_script(processes, result.path, markers=True)
+
+                progress.update(task, total=len(processes))
+                FlatcamRunner(
+                    self.get_flatcam_args(output_file),
+                    processes,
+                    step_timeout=self.options.step_timeout or None,
+                    metrics=result.metrics,
+                ).run(on_step=lambda index, _: progress.update(task, completed=index))
+        except (BarbariError, BarbariFlatcamError) as e:
+            result.error = str(e)
+            progress.update(task, description=f"{result.name} (failed)")
+            return result
+
+        writes = sorted(
+            (
+                process
+                for process in processes
+                if isinstance(process, flatcam.FlatcamWriteGcode)
+            ),
+            key=lambda write: write.counter,
+        )
+        for write in writes:
+            if not os.path.exists(write.filename):
+                continue
+            if self.options.compact:
+                gcode.compact_file(write.filename, decimals=self.options.precision)
+            result.duration += program.Program.read(write.filename).estimate_duration(
+                self.options.rapid_rate
+            )
+            result.size += os.path.getsize(write.filename)
+            result.files += 1
+
+        result.tool_changes, result.flips = optimizer.count_setup_changes(writes)
+        result.metrics.set("gcode_bytes_total", result.size)
+        result.metrics.set("estimated_machining_seconds", result.duration)
+        result.metrics.set("tool_changes", result.tool_changes)
+        result.metrics.set("board_flips", result.flips)
+        result.unassigned_tools = generator.unassigned_tools
+        result.unassigned_hits = sum(tool.hits for tool in generator.unassigned_tools)
+        result.build_time = time.monotonic() - started
+        progress.update(task, completed=len(processes))
+
+        return result
+
+    def display_results(self, results: List[VariantResult]) -> None:
+        table = Table(title="Variants")
+        table.add_column("Variant", no_wrap=True)
+        table.add_column("Files", justify="right")
+        table.add_column("Est. Time", justify="right")
+        table.add_column("Tool Changes", justify="right")
+        table.add_column("Flips", justify="right")
+        table.add_column("G-code Size", justify="right")
+        table.add_column("Unassigned Holes", justify="right")
+        table.add_column("Build Time", justify="right")
+
+        for result in results:
+            if result.error:
+                table.add_row(result.name, "[red]failed[/red]")
+                continue
+
+            minutes, seconds = divmod(int(result.duration), 60)
+            unassigned = str(result.unassigned_hits)
+            if result.unassigned_hits:
+                unassigned = f"[red]{unassigned}[/red]"
+            table.add_row(
+                result.name,
+                str(result.files),
+                f"{minutes}m{seconds:02}s",
+                str(result.tool_changes),
+                str(result.flips),
+                f"{result.size / 1024:.1f}KB",
+                unassigned,
+                f"{result.build_time:.1f}s",
+            )
+
+        self.console.print(table)
+
+        for result in results:
+            if result.error:
+                self.console.print(f"{result.name}: {result.error}", style="red")
+            for tool in result.unassigned_tools:
+                self.console.print(
+                    f"{result.name}: no {'slot' if tool.slot else 'drill'} "
+                    f"profile for tool #{tool.number} ({tool.diameter} dia, "
+                    f"{tool.hits} hits)."
+                )
+
+    def handle(self) -> None:
+        project = gerbers.GerberProject(self.directory, metrics=self.metrics)
+        # Read every layer once up-front so that variants share the
+        # results instead of each parsing them again.
+        for layer_type in project.get_layer_paths():
+            project.get_bounds(layer_type)
+
+        variants = self.get_variants()
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TimeElapsedColumn(),
+            console=self.console,
+        ) as progress:
+            with ThreadPoolExecutor(max_workers=max(self.options.jobs, 1)) as pool:
+                results = list(
+                    pool.map(
+                        lambda variant: self.build_variant(project, variant, progress),
+                        variants,
+                    )
+                )
+
+        self.write_metrics([self.metrics] + [result.metrics for result in results])
+        self.display_results(results)
+        self.console.print(
+            f"G-code for each variant was written to {os.path.join(self.directory, 'matrix')}."
+        )
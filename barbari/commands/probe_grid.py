@@ -0,0 +1,82 @@
+import argparse
+import os
+
+from .. import gerbers
+from ..constants import LayerType
+from ..exceptions import BarbariUserError
+from ..gcode import MM_PER_INCH
+from ..leveling import ProbeGrid
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "directory", help="Path to a directory holding your gerber/drl exports."
+        )
+        parser.add_argument(
+            "--spacing",
+            type=float,
+            default=10.0,
+            help="Largest distance (in mm) between probed points.",
+        )
+        parser.add_argument(
+            "--margin",
+            type=float,
+            default=0.0,
+            help="Distance (in mm) to extend the grid past the board's edges.",
+        )
+        parser.add_argument(
+            "--probe-depth",
+            type=float,
+            default=2.0,
+            help="Distance (in mm) below Z0 to probe before giving up.",
+        )
+        parser.add_argument(
+            "--travel-z",
+            type=float,
+            default=2.0,
+            help="Height (in mm) to move between points at.",
+        )
+        parser.add_argument(
+            "--feed-rate",
+            type=float,
+            default=50.0,
+            help="Speed (in mm/min) to probe at.",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        directory = os.path.abspath(os.path.expanduser(self.options.directory))
+        project = gerbers.GerberProject(directory)
+        if LayerType.EDGE_CUTS not in project.get_layer_paths():
+            raise BarbariUserError("No Edge.Cuts layer was found.")
+
+        edge_cuts = project.get_bounds(LayerType.EDGE_CUTS)
+        if edge_cuts.bounds is None:
+            raise BarbariUserError("The Edge.Cuts layer is empty.")
+        scale = MM_PER_INCH if edge_cuts.units == "inch" else 1.0
+        bounds = tuple((low * scale, high * scale) for low, high in edge_cuts.bounds)
+
+        grid = ProbeGrid.from_bounds(bounds, self.options.spacing, self.options.margin)
+        grid.save(os.path.join(directory, "probe_grid.json"))
+        program_path = os.path.join(directory, "probe.gcode")
+        with open(program_path, "w") as outf:
+            outf.writelines(
+                grid.get_program(
+                    self.options.travel_z,
+                    self.options.probe_depth,
+                    self.options.feed_rate,
+                )
+            )
+
+        self.console.print(
+            f"Wrote a program probing {len(grid.xs)}x{len(grid.ys)} points "
+            f"to {program_path}."
+        )
+        self.console.print(
+            "Zero Z on the blank at the first point "
+            f"({grid.xs[0]:.3f}, {grid.ys[0]:.3f}) before running it, and save "
+            "your controller's output; then pass that to `barbari level`."
+        )
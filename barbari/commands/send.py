@@ -0,0 +1,152 @@
+import argparse
+import os
+from typing import List, Optional, Tuple
+
+from rich.progress import BarColumn, Progress, TextColumn, TimeElapsedColumn
+from rich.prompt import Prompt
+
+from .. import panel, sender
+from ..exceptions import BarbariUserError
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "directory", help="Path to a directory holding generated g-code."
+        )
+        parser.add_argument(
+            "--port",
+            help="Serial port your GRBL controller is connected to.",
+        )
+        parser.add_argument(
+            "--baud-rate",
+            type=int,
+            help="Baud rate of your GRBL controller (default: 115200).",
+        )
+        parser.add_argument(
+            "--start-at",
+            type=int,
+            default=1,
+            help="Number of the first g-code file to send.",
+        )
+        parser.add_argument(
+            "--no-pause",
+            dest="pause",
+            action="store_false",
+            help="Do not pause for tool changes.",
+        )
+        parser.add_argument(
+            "--simulate",
+            action="store_true",
+            help=(
+                "Send to a simulated controller rather than a real one; "
+                "useful for checking files and measuring throughput."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def get_gcode_files(self) -> List[Tuple[str, str]]:
+        """Return the path and tool description of each file to send."""
+        directory = os.path.abspath(os.path.expanduser(self.options.directory))
+
+        files: List[Tuple[str, str]] = []
+        for filename in panel.find_gcode_files(directory):
+            match = panel.GCODE_FILENAME_PATTERN.match(filename)
+            if int(match.group("counter")) < self.options.start_at:
+                continue
+
+            files.append(
+                (
+                    os.path.join(directory, filename),
+                    f"{match.group('tool_size')} {match.group('tool_name')}",
+                )
+            )
+
+        if not files:
+            raise BarbariUserError(f"No numbered g-code files found in {directory}.")
+
+        return files
+
+    def handle(self) -> None:
+        import serial
+
+        files = self.get_gcode_files()
+
+        simulator: Optional[sender.SimulatedGrbl] = None
+        port = self.options.port or self.config.serial_port
+        if self.options.simulate:
+            simulator = sender.SimulatedGrbl().start()
+            port = simulator.port
+        elif not port:
+            raise BarbariUserError("No serial port specified; use --port.")
+
+        connection = serial.Serial(
+            port,
+            self.options.baud_rate or self.config.baud_rate or 115200,
+            timeout=1,
+        )
+        total = sender.StreamStats()
+        try:
+            with Progress(
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TextColumn("{task.completed}/{task.total}"),
+                TimeElapsedColumn(),
+                console=self.console,
+            ) as progress:
+
+                def pause(message: str) -> None:
+                    if not self.options.pause:
+                        return
+                    progress.stop()
+                    Prompt.ask(f"[yellow]{message}[/yellow]; press Enter to continue")
+                    progress.start()
+
+                grbl = sender.GrblSender(
+                    connection,
+                    on_tool_change=lambda line: pause(
+                        f"Tool change requested ({line})"
+                    ),
+                )
+                grbl.wake(delay=0.1 if simulator else 2.0)
+
+                tool: Optional[str] = None
+                for path, file_tool in files:
+                    if file_tool != tool:
+                        grbl.wait_for_idle()
+                        pause(f"Insert a {file_tool}")
+                        tool = file_tool
+
+                    with open(path, "r") as inf:
+                        lines = inf.readlines()
+
+                    task = progress.add_task(os.path.basename(path), total=len(lines))
+                    stats = grbl.stream(
+                        lines,
+                        on_line=lambda line: progress.update(task, completed=line),
+                    )
+                    progress.update(task, completed=len(lines))
+                    total += stats
+
+                    progress.console.print(
+                        f"{os.path.basename(path)}: {stats.lines} lines in "
+                        f"{stats.duration:.1f}s ({stats.lines_per_second:.0f} "
+                        f"lines/s, {stats.bytes_per_second:.0f} bytes/s)"
+                    )
+                grbl.wait_for_idle()
+        finally:
+            connection.close()
+            if simulator:
+                simulator.stop()
+
+        self.console.print(
+            f"[green]Sent {total.lines} lines ({total.bytes} bytes) in "
+            f"{total.duration:.1f}s: {total.lines_per_second:.0f} lines/s, "
+            f"{total.bytes_per_second:.0f} bytes/s.[/green]"
+        )
+        if simulator and simulator.overflowed:
+            self.console.print(
+                "The simulated controller's receive buffer overflowed.", style="red"
+            )
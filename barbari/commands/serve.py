@@ -0,0 +1,147 @@
+import argparse
+import os
+import tempfile
+
+from ..exceptions import BarbariUserError
+from ..server import JobHTTPServer, JobServer
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="Address to listen on.",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8000,
+            help="Port to listen on.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of jobs to run at once.",
+        )
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            default=100,
+            help="Number of jobs that may wait for a worker before new ones are refused.",
+        )
+        parser.add_argument(
+            "--keep-jobs",
+            type=int,
+            default=100,
+            help="Number of finished jobs (and their g-code) to keep.",
+        )
+        parser.add_argument(
+            "--max-upload-size",
+            type=float,
+            default=50,
+            help="Largest archive (in megabytes) to accept.",
+        )
+        parser.add_argument(
+            "--work-dir",
+            help=(
+                "Directory to extract uploads and write g-code into; "
+                "defaults to a new temporary directory."
+            ),
+        )
+        parser.add_argument(
+            "--flatcam",
+            help="Path to flatcam executable (FlatCAM.py)",
+        )
+        parser.add_argument(
+            "--python-bin",
+            help=(
+                "Path to the python binary to use when running "
+                "FlatCAM.py; set this to the correct python "
+                "binary for a virtualenvironment if you are "
+                "using one."
+            ),
+        )
+        parser.add_argument(
+            "--step-timeout",
+            type=float,
+            default=600,
+            help=(
+                "Number of seconds flatcam may take to start, or to run a "
+                "single command, before it is assumed to have hung and is "
+                "killed; set to 0 to disable."
+            ),
+        )
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help=(
+                "Number of decimal places to keep in g-code coordinates "
+                "(when in millimeters; one more is kept for inches)."
+            ),
+        )
+        parser.add_argument(
+            "--no-preflight",
+            dest="preflight",
+            action="store_false",
+            help=(
+                "Do not check that the isolation routing tool fits between "
+                "copper features before running flatcam."
+            ),
+        )
+        parser.add_argument(
+            "--no-compact",
+            dest="compact",
+            action="store_false",
+            help=(
+                "Leave g-code exactly as flatcam wrote it instead of "
+                "removing comments and redundant words."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        flatcam_path = self.options.flatcam or self.config.flatcam_path
+        if not flatcam_path:
+            raise BarbariUserError(
+                "No flatcam path given, and none is configured; "
+                "run `barbari setup-flatcam` or pass `--flatcam`."
+            )
+
+        work_dir = os.path.abspath(
+            os.path.expanduser(
+                self.options.work_dir or tempfile.mkdtemp(prefix="barbari-serve-")
+            )
+        )
+        job_server = JobServer(
+            work_dir,
+            workers=self.options.workers,
+            queue_size=self.options.queue_size,
+            keep_jobs=self.options.keep_jobs,
+            max_upload_size=int(self.options.max_upload_size * 1024 * 1024),
+            flatcam_path=flatcam_path,
+            python_bin=self.options.python_bin or self.config.python_bin,
+            step_timeout=self.options.step_timeout,
+            compact=self.options.compact,
+            precision=self.options.precision,
+            preflight=self.options.preflight,
+        )
+        http_server = JobHTTPServer((self.options.host, self.options.port), job_server)
+
+        job_server.start()
+        self.console.print(
+            f"Serving on http://{self.options.host}:{http_server.server_port}/ "
+            f"with {self.options.workers} workers; writing to {work_dir}. "
+            "Press Ctrl+C to stop."
+        )
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
+            job_server.stop()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import time
+from typing import List
+
+from rich.table import Table
+
+from .. import config, flatcam, gerbers, optimizer, panel
+from ..exceptions import BarbariUserError
+from ..verify import VerificationError, Violation, get_limits, verify_directory
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "directory",
+            help="Path to a directory holding your gerber/drl exports and generated g-code.",
+        )
+        parser.add_argument(
+            "config",
+            nargs="+",
+            help="Configuration the g-code was generated with; later configs override earlier configs.",
+        )
+        parser.add_argument(
+            "--no-optimize",
+            dest="optimize",
+            action="store_false",
+            help="Pass this if the g-code was built with `--no-optimize`.",
+        )
+        parser.add_argument(
+            "--margin",
+            type=float,
+            default=1.0,
+            help=(
+                "Distance (in mm) beyond the board (plus the tool's diameter "
+                "and cutout margin) that moves may reach."
+            ),
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.01,
+            help=(
+                "Distance (in mm) a move may exceed its limits by; raise this "
+                "when verifying leveled g-code."
+            ),
+        )
+        parser.add_argument(
+            "--machine-size",
+            type=float,
+            nargs="+",
+            help=(
+                "Travel (in mm) of your machine's X, Y and (optionally) Z "
+                "axes; defaults to the `machine_size` setting."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def display_violations(self, violations: List[Violation], count: int = 5) -> None:
+        table = Table(title="G-code problems")
+        table.add_column("File")
+        table.add_column("Problem")
+        table.add_column("Lines", justify="right")
+
+        for violation in violations:
+            lines = ", ".join(str(line) for line in violation.lines[:count])
+            if len(violation.lines) > count:
+                lines += f" (+{len(violation.lines) - count} more)"
+            table.add_row(violation.filename, violation.message, lines)
+
+        self.console.print(table)
+
+    def handle(self) -> None:
+        directory = os.path.abspath(os.path.expanduser(self.options.directory))
+
+        filenames = panel.find_gcode_files(directory)
+        if not filenames:
+            raise BarbariUserError(f"No numbered g-code files found in {directory}.")
+
+        project = gerbers.GerberProject(directory)
+        conf = config.get_merged_config(self.options.config)
+        processes = list(
+            flatcam.FlatcamProjectGenerator(project, conf).get_cnc_processes()
+        )
+        if self.options.optimize:
+            processes = optimizer.optimize(processes)
+        limits = get_limits(project, conf, processes, margin=self.options.margin)
+
+        started = time.monotonic()
+        violations = verify_directory(
+            directory,
+            filenames,
+            limits,
+            machine_size=self.options.machine_size or self.config.machine_size,
+            tolerance=self.options.tolerance,
+        )
+        elapsed = time.monotonic() - started
+
+        if violations:
+            self.display_violations(violations)
+            raise VerificationError(violations)
+
+        self.console.print(
+            f"[green]Verified {len(filenames)} files in {elapsed:.2f} seconds; "
+            "no problems found.[/green]"
+        )
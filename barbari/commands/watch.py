@@ -0,0 +1,156 @@
+import argparse
+import os
+import time
+from typing import List, Optional, Set
+
+from .. import config, exceptions, gerbers, watch
+from ..flatcam import FlatcamProcess, FlatcamWriteGcode
+from ..metrics import Metrics
+from .build import Command as BuildCommand
+
+
+class Command(BuildCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.5,
+            help="Number of seconds between checks for changed files.",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=1.0,
+            help=(
+                "Number of seconds files must remain unchanged before "
+                "rebuilding; this lets an export finish writing all of "
+                "its files first."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def __init__(self, options: argparse.Namespace):
+        super().__init__(options)
+        self._config_paths: List[str] = []
+
+    @property
+    def directory(self) -> str:
+        return os.path.abspath(os.path.expanduser(self.options.directory))
+
+    def get_watched_paths(self) -> List[str]:
+        project = gerbers.GerberProject(self.directory)
+
+        try:
+            self._config_paths = config.get_config_file_paths(self.options.config)
+        except Exception:
+            # Probably a config file that is half-written; keep watching
+            # the files we already knew about.
+            pass
+
+        return list(project.get_layer_paths().values()) + self._config_paths
+
+    def remove_outdated_output(self, processes: List[FlatcamProcess]) -> None:
+        """Remove g-code left over from steps that are no longer generated."""
+        expected = {
+            os.path.basename(process.filename)
+            for process in processes
+            if isinstance(process, FlatcamWriteGcode)
+        }
+
+        for filename in self.get_existing_output():
+            if filename not in expected:
+                os.unlink(os.path.join(self.directory, filename))
+
+    def rebuild_stale(
+        self, previous: List[FlatcamProcess], changed_paths: Set[str]
+    ) -> List[FlatcamProcess]:
+        """Rebuild out-of-date g-code; returns the processes now in effect."""
+        try:
+            processes = self.get_processes()
+        except Exception as e:
+            raise exceptions.BarbariUserError(
+                f"Unable to generate flatcam script: {e}"
+            ) from e
+
+        stale = watch.get_stale_processes(processes, previous, changed_paths)
+        self.remove_outdated_output(processes)
+        written = [
+            process for process in stale if isinstance(process, FlatcamWriteGcode)
+        ]
+        if not written:
+            self.console.print("All g-code is up to date.")
+            return processes
+
+        for process in written:
+            if os.path.exists(process.filename):
+                os.unlink(process.filename)
+
+        output_file = self.write_script(stale, self.directory, markers=True)
+        self.console.print(
+            f"Rebuilding {len(written)} of "
+            f"{sum(isinstance(p, FlatcamWriteGcode) for p in processes)} "
+            "g-code files."
+        )
+        started = time.monotonic()
+        runner = self.run_flatcam(output_file, stale)
+
+        self.compact_output(process.filename for process in written)
+        self.record_output(process.filename for process in written)
+        for process in written:
+            self.console.print(f"- {os.path.basename(process.filename)}")
+        self.console.print(
+            f"Rebuilt in {time.monotonic() - started:.1f}s.", style="green"
+        )
+        self.display_timings(runner.get_slowest(self.options.slowest))
+
+        return processes
+
+    def rebuild(
+        self, previous: List[FlatcamProcess], changed_paths: Set[str]
+    ) -> Optional[List[FlatcamProcess]]:
+        """Rebuild out-of-date g-code, returning `None` if that failed."""
+        # Each rebuild is reported on its own.
+        self._metrics = Metrics(**self.metrics.labels)
+
+        try:
+            with self.metrics.record_build():
+                return self.rebuild_stale(previous, changed_paths)
+        except exceptions.BarbariFlatcamError as e:
+            self.console.print(f"Flatcam failed: {e}", style="red")
+        except exceptions.BarbariError as e:
+            self.console.print(str(e), style="red")
+        finally:
+            self.write_metrics()
+
+        return None
+
+    def handle(self) -> None:
+        watcher = watch.PollingWatcher(
+            self.get_watched_paths,
+            interval=self.options.interval,
+            debounce=self.options.debounce,
+        )
+
+        previous: List[FlatcamProcess] = []
+        changed_paths: Set[str] = set()
+        while True:
+            processes = self.rebuild(previous, changed_paths)
+            # After a failure, rebuild everything once things are fixed
+            previous = processes or []
+
+            status = time.strftime("%H:%M:%S")
+            with self.console.status(
+                f"Watching {self.directory} for changes "
+                f"(last build {'succeeded' if processes else 'failed'} "
+                f"at {status}); press Ctrl+C to stop."
+            ):
+                try:
+                    changed_paths = watcher.wait()
+                except KeyboardInterrupt:
+                    return
+
+            self.console.rule(
+                "Changed: "
+                + ", ".join(sorted(os.path.basename(path) for path in changed_paths))
+            )
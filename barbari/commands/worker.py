@@ -0,0 +1,136 @@
+import argparse
+import socket
+
+from ..exceptions import BarbariUserError
+from ..spool import Spool, SpoolWorker
+from . import BaseCommand
+
+
+class Command(BaseCommand):
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "spool",
+            help=(
+                "Path to the spool directory jobs are queued in; every "
+                "worker sharing it takes jobs from the same queue."
+            ),
+        )
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Exit once no jobs are queued rather than waiting for more.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5,
+            help="Number of seconds to wait between checks for new jobs.",
+        )
+        parser.add_argument(
+            "--heartbeat",
+            type=float,
+            default=30,
+            help="Number of seconds between updates to a running job's claim.",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=300,
+            help=(
+                "Number of seconds after which a claim that hasn't been "
+                "updated is assumed to belong to a crashed worker, and its "
+                "job is queued again."
+            ),
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="Number of times a job may be abandoned by crashed workers before it is failed.",
+        )
+        parser.add_argument(
+            "--flatcam",
+            help="Path to flatcam executable (FlatCAM.py)",
+        )
+        parser.add_argument(
+            "--python-bin",
+            help=(
+                "Path to the python binary to use when running "
+                "FlatCAM.py; set this to the correct python "
+                "binary for a virtualenvironment if you are "
+                "using one."
+            ),
+        )
+        parser.add_argument(
+            "--step-timeout",
+            type=float,
+            default=600,
+            help=(
+                "Number of seconds flatcam may take to start, or to run a "
+                "single command, before it is assumed to have hung and is "
+                "killed; set to 0 to disable."
+            ),
+        )
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help=(
+                "Number of decimal places to keep in g-code coordinates "
+                "(when in millimeters; one more is kept for inches)."
+            ),
+        )
+        parser.add_argument(
+            "--no-preflight",
+            dest="preflight",
+            action="store_false",
+            help=(
+                "Do not check that the isolation routing tool fits between "
+                "copper features before running flatcam."
+            ),
+        )
+        parser.add_argument(
+            "--no-compact",
+            dest="compact",
+            action="store_false",
+            help=(
+                "Leave g-code exactly as flatcam wrote it instead of "
+                "removing comments and redundant words."
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def handle(self) -> None:
+        flatcam_path = self.options.flatcam or self.config.flatcam_path
+        if not flatcam_path:
+            raise BarbariUserError(
+                "No flatcam path given, and none is configured; "
+                "run `barbari setup-flatcam` or pass `--flatcam`."
+            )
+
+        spool = Spool(self.options.spool)
+        worker = SpoolWorker(
+            spool,
+            heartbeat=self.options.heartbeat,
+            stale_after=self.options.stale_after,
+            poll_interval=self.options.poll_interval,
+            max_attempts=self.options.max_attempts,
+            flatcam_path=flatcam_path,
+            python_bin=self.options.python_bin or self.config.python_bin,
+            step_timeout=self.options.step_timeout,
+            compact=self.options.compact,
+            precision=self.options.precision,
+            preflight=self.options.preflight,
+        )
+
+        self.console.print(
+            f"Worker {worker.worker_id} on {socket.gethostname()} taking jobs "
+            f"from {spool.path}. Press Ctrl+C to stop."
+        )
+        try:
+            finished = worker.run(drain=self.options.drain)
+        except KeyboardInterrupt:
+            return
+
+        self.console.print(f"No jobs left; finished {finished}.")
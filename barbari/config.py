@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import copy
 from dataclasses import dataclass, asdict
+import json
 import logging
 import os
+import re
 from typing import cast, Dict, Iterable, List, Optional, Type, Union, Tuple
 
 import appdirs
@@ -15,13 +17,34 @@ from . import exceptions
 logger = logging.getLogger(__name__)
 
 
+BUNDLE_VERSION = 1
+
+
 class JobSpec(object):
+    REQUIRED_FIELDS: Tuple[str, ...] = (
+        "tool_size",
+        "cut_z",
+        "travel_z",
+        "feed_rate",
+        "spindle_speed",
+    )
+
     def __init__(self, data, name=None):
         self._data = data
         self._name = name
 
         super().__init__()
 
+    def validate(self) -> None:
+        if not isinstance(self._data, dict):
+            raise exceptions.InvalidConfiguration(f"{self} must be a mapping.")
+
+        missing = [field for field in self.REQUIRED_FIELDS if field not in self._data]
+        if missing:
+            raise exceptions.InvalidConfiguration(
+                f"{self} is missing required fields: {', '.join(missing)}"
+            )
+
     @property
     def name(self) -> str:
         return self._name
@@ -67,6 +90,8 @@ class MillSlotsJobSpec(MillHolesJobSpec):
 
 
 class IsolationRoutingJobSpec(JobSpec):
+    REQUIRED_FIELDS = JobSpec.REQUIRED_FIELDS + ("passes",)
+
     @property
     def passes(self) -> float:
         return self._data["passes"]
@@ -77,6 +102,8 @@ class IsolationRoutingJobSpec(JobSpec):
 
 
 class BoardCutoutJobSpec(JobSpec):
+    REQUIRED_FIELDS = JobSpec.REQUIRED_FIELDS + ("margin", "gap_size", "gaps")
+
     @property
     def margin(self) -> float:
         return self._data["margin"]
@@ -91,12 +118,33 @@ class BoardCutoutJobSpec(JobSpec):
 
 
 class DrillHolesJobSpec(JobSpec):
+    REQUIRED_FIELDS = ("tool_size", "drill_z", "travel_z", "feed_rate", "spindle_speed")
+
     @property
     def drill_z(self) -> float:
         return self._data.get("drill_z")
 
 
 class ToolProfileSpec(JobSpec):
+    REQUIRED_FIELDS = ("specs",)
+
+    def validate(self) -> None:
+        super().validate()
+
+        for spec_data in self._data["specs"]:
+            if not isinstance(spec_data, dict) or not {"type", "params"} <= set(
+                spec_data
+            ):
+                raise exceptions.InvalidConfiguration(
+                    f"Each of {self}'s specs must have a 'type' and 'params'."
+                )
+
+        for spec in self.specs:
+            try:
+                spec.validate()
+            except exceptions.InvalidConfiguration as e:
+                raise exceptions.InvalidConfiguration(f"{self.name}: {e}") from e
+
     @property
     def min_size(self) -> float:
         return self._data.get("min_size", 0)
@@ -225,6 +273,8 @@ class SlotProfileSpec(ToolProfileSpec):
 
 
 class AlignmentHolesJobSpec(MillHolesJobSpec):
+    REQUIRED_FIELDS = MillHolesJobSpec.REQUIRED_FIELDS + ("hole_size", "hole_offset")
+
     @property
     def mirror_axis(self) -> str:
         return self._data.get("mirror_axis", "X")
@@ -238,7 +288,46 @@ class AlignmentHolesJobSpec(MillHolesJobSpec):
         return self._data["hole_offset"]
 
 
+class ToolClusteringSpec(object):
+    def __init__(self, data):
+        self._data = data
+
+        super().__init__()
+
+    @property
+    def tolerance(self) -> float:
+        return self._data.get("tolerance", 0)
+
+    @property
+    def stock_sizes(self) -> List[float]:
+        return self._data.get("stock_sizes", [])
+
+    def validate(self) -> None:
+        if not isinstance(self._data, dict):
+            raise exceptions.InvalidConfiguration(
+                "The 'tool_clustering' section must be a mapping."
+            )
+        elif not isinstance(self.tolerance, (int, float)) or self.tolerance < 0:
+            raise exceptions.InvalidConfiguration(
+                "Tool clustering tolerance must be a positive number."
+            )
+        elif not all(isinstance(size, (int, float)) for size in self.stock_sizes):
+            raise exceptions.InvalidConfiguration(
+                "Tool clustering stock sizes must be a list of diameters."
+            )
+
+
 class Config(object):
+    SECTIONS = {
+        "description",
+        "tool_clustering",
+        "alignment_holes",
+        "isolation_routing",
+        "edge_cuts",
+        "drill",
+        "slot",
+    }
+
     def __init__(self, data):
         self._data = data
 
@@ -287,11 +376,31 @@ class Config(object):
             return None
         return AlignmentHolesJobSpec(self._data["alignment_holes"])
 
+    @property
+    def isolation_routing_tools(self) -> List[IsolationRoutingJobSpec]:
+        """Isolation routing tools, largest first.
+
+        `isolation_routing` may be either a single tool or a list of them.
+        """
+        data = self._data.get("isolation_routing")
+        if not data:
+            return []
+        elif isinstance(data, dict):
+            data = [data]
+
+        return sorted(
+            (IsolationRoutingJobSpec(tool) for tool in data),
+            key=lambda tool: tool.tool_size,
+            reverse=True,
+        )
+
     @property
     def isolation_routing(self) -> Optional[IsolationRoutingJobSpec]:
-        if "isolation_routing" not in self._data:
+        """The smallest isolation routing tool; it isolates the narrowest gaps."""
+        tools = self.isolation_routing_tools
+        if not tools:
             return None
-        return IsolationRoutingJobSpec(self._data["isolation_routing"])
+        return tools[-1]
 
     @property
     def edge_cuts(self) -> Optional[BoardCutoutJobSpec]:
@@ -299,6 +408,12 @@ class Config(object):
             return None
         return BoardCutoutJobSpec(self._data["edge_cuts"])
 
+    @property
+    def tool_clustering(self) -> Optional[ToolClusteringSpec]:
+        if "tool_clustering" not in self._data:
+            return None
+        return ToolClusteringSpec(self._data["tool_clustering"])
+
     @property
     def drill(self) -> Dict[str, DrillProfileSpec]:
         drill_range_specs = {}
@@ -317,11 +432,42 @@ class Config(object):
 
         return drill_range_specs
 
+    def validate(self) -> None:
+        """Check every section now rather than when each is first used."""
+        unknown = set(self._data) - self.SECTIONS
+        if unknown:
+            raise exceptions.InvalidConfiguration(
+                f"Unknown configuration sections: {', '.join(sorted(unknown))}"
+            )
+
+        for spec in (self.alignment_holes, self.edge_cuts, self.tool_clustering):
+            if spec:
+                spec.validate()
+
+        isolation_routing = self._data.get("isolation_routing") or []
+        if not isinstance(isolation_routing, list):
+            isolation_routing = [isolation_routing]
+        for tool in isolation_routing:
+            IsolationRoutingJobSpec(tool).validate()
+
+        for section in ("drill", "slot"):
+            if not isinstance(self._data.get(section, {}), dict):
+                raise exceptions.InvalidConfiguration(
+                    f"The '{section}' section must be a mapping of profile names."
+                )
+        for profile in (*self.drill.values(), *self.slot.values()):
+            profile.validate()
+
     def __add__(self, other: Config) -> Config:
         left = copy.deepcopy(self._data)
         right = other._data
 
-        overwrite = ["alignment_holes", "isolation_routing", "edge_cuts"]
+        overwrite = [
+            "alignment_holes",
+            "isolation_routing",
+            "edge_cuts",
+            "tool_clustering",
+        ]
         merge = ["drill", "slot"]
 
         for key in overwrite:
@@ -352,6 +498,11 @@ def get_environment_config_file_path() -> str:
 class EnvironmentConfig:
     flatcam_path: Optional[str] = None
     python_bin: Optional[str] = None
+    serial_port: Optional[str] = None
+    baud_rate: Optional[int] = None
+    metrics_log: Optional[str] = None
+    metrics_textfile: Optional[str] = None
+    machine_size: Optional[List[float]] = None
 
 
 def get_environment_config() -> EnvironmentConfig:
@@ -404,10 +555,138 @@ def get_config_by_name(name: str) -> Config:
     return Config.from_file(config_path)
 
 
-def get_merged_config(names: List[str]) -> Config:
+def get_config_file_paths(names: List[str]) -> List[str]:
+    """Return the path of every file read when merging the named configs."""
+    paths: List[str] = []
+    path_map = _get_config_path_map()
+
+    def add_path(path: str) -> None:
+        if path in paths:
+            return
+        paths.append(path)
+
+        with open(path, "r") as inf:
+            loaded = yaml.safe_load(inf) or {}
+
+        config_dir = os.path.dirname(path)
+        for include in loaded.get("include", []):
+            if os.path.splitext(include)[1] in (".yaml", ".yml"):
+                add_path(os.path.join(config_dir, include))
+            elif include in path_map:
+                add_path(path_map[include])
+
+    for name in names:
+        try:
+            add_path(path_map[name])
+        except KeyError:
+            raise exceptions.ConfigNotFound(f"Config '{name}' not found")
+
+    return paths
+
+
+def get_bundle_path(names: List[str]) -> str:
+    filename = re.sub(r"[^\w.+-]", "_", "+".join(names))
+
+    return os.path.join(
+        appdirs.user_cache_dir("barbari", "coddingtonbear"),
+        "configs",
+        f"{filename}.json",
+    )
+
+
+def _get_bundle_sources(names: List[str]) -> Dict[str, float]:
+    # Config directories are included so that adding a config that
+    # shadows one of the names we resolved makes the bundle stale.
+    paths = get_config_file_paths(names) + [
+        directory
+        for directory in (get_default_config_dir(), get_user_config_dir())
+        if os.path.exists(directory)
+    ]
+
+    return {path: os.stat(path).st_mtime for path in paths}
+
+
+def compile_config(names: List[str]) -> str:
+    """Resolve, validate and write a precompiled bundle of the named configs.
+
+    Returns the path to which the bundle was written.
+    """
+    sources = _get_bundle_sources(names)
+    merged = _load_merged_config(names)
+    merged.validate()
+
+    bundle_path = get_bundle_path(names)
+    temp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    with open(temp_path, "w") as outf:
+        json.dump(
+            {
+                "version": BUNDLE_VERSION,
+                "names": names,
+                "sources": sources,
+                "data": merged._data,
+            },
+            outf,
+            separators=(",", ":"),
+        )
+    os.replace(temp_path, bundle_path)
+
+    return bundle_path
+
+
+def load_bundle(names: List[str]) -> Optional[Config]:
+    """Load a precompiled config bundle if one exists and is up to date."""
+    try:
+        with open(get_bundle_path(names), "r") as inf:
+            bundle = json.load(inf)
+    except (OSError, ValueError):
+        return None
+
+    if (
+        not isinstance(bundle, dict)
+        or bundle.get("version") != BUNDLE_VERSION
+        or bundle.get("names") != names
+    ):
+        return None
+
+    for path, mtime in bundle.get("sources", {}).items():
+        try:
+            current: Optional[float] = os.stat(path).st_mtime
+        except OSError:
+            current = None
+
+        if current != mtime:
+            logger.warning(
+                "Precompiled config for %s is out of date; "
+                "re-run compile-config to update it.",
+                " ".join(names),
+            )
+            return None
+
+    return Config(bundle["data"])
+
+
+def _load_merged_config(names: List[str]) -> Config:
     configs: List[Config] = []
 
     for config_name in names:
         configs.append(get_config_by_name(config_name))
 
     return sum(configs, Config({}))
+
+
+def get_merged_config(names: List[str]) -> Config:
+    """Load the named configs, merged, raising if the result is invalid.
+
+    Precompiled bundles were validated when they were compiled, so are
+    returned as-is.
+    """
+    bundle = load_bundle(names)
+    if bundle is not None:
+        logger.debug("Using precompiled config for %s", " ".join(names))
+        return bundle
+
+    merged = _load_merged_config(names)
+    merged.validate()
+
+    return merged
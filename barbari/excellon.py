@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+TOOL_PATTERN = re.compile(r"^T(\d+)")
+TOOL_DIAMETER_PATTERN = re.compile(r"C([-+]?\d*\.?\d+)")
+COORDINATE_PATTERN = re.compile(r"([XY])([-+]?\d*\.?\d*)")
+FORMAT_COMMENT_PATTERN = re.compile(r"(?:FORMAT=\{|FILE_FORMAT=)\s*(\d+):(\d+)")
+
+
+class UnsupportedExcellon(ValueError):
+    pass
+
+
+@dataclass
+class ExcellonTool:
+    number: int
+    diameter: float
+
+
+class ExcellonLayer(object):
+    """Drill hits and slots, stored as one coordinate array per tool.
+
+    Hits are stored as `(n, 2)` arrays of X/Y positions and slots as
+    `(n, 4)` arrays of start X/Y and end X/Y positions; all coordinates
+    and diameters are in the file's units.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        units: str,
+        tools: Dict[int, ExcellonTool],
+        hits: Dict[int, np.ndarray],
+        slots: Dict[int, np.ndarray],
+    ):
+        self.filename = filename
+        self.units = units
+        self.tools = tools
+        self.hits = hits
+        self.slots = slots
+
+    def get_hit_count(self, tool_number: int, slot: bool = False) -> int:
+        coordinates = (self.slots if slot else self.hits).get(tool_number)
+        if coordinates is None:
+            return 0
+
+        return len(coordinates)
+
+    @property
+    def hit_count(self) -> int:
+        return sum(len(hits) for hits in self.hits.values()) + sum(
+            len(slots) for slots in self.slots.values()
+        )
+
+    @property
+    def bounds(self) -> Optional[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        min_x = min_y = np.inf
+        max_x = max_y = -np.inf
+
+        for coordinates, columns in (
+            (self.hits, slice(0, 2)),
+            (self.slots, slice(0, 2)),
+            (self.slots, slice(2, 4)),
+        ):
+            for tool_number, tool_coordinates in coordinates.items():
+                if not len(tool_coordinates):
+                    continue
+                radius = self.tools[tool_number].diameter / 2
+                xy = tool_coordinates[:, columns]
+                min_x = min(min_x, xy[:, 0].min() - radius)
+                max_x = max(max_x, xy[:, 0].max() + radius)
+                min_y = min(min_y, xy[:, 1].min() - radius)
+                max_y = max(max_y, xy[:, 1].max() + radius)
+
+        if min_x == np.inf:
+            return None
+
+        return (float(min_x), float(max_x)), (float(min_y), float(max_y))
+
+    @classmethod
+    def from_pcb_tools(cls, layer) -> ExcellonLayer:
+        from gerber import excellon
+
+        tools = {
+            number: ExcellonTool(number=number, diameter=tool.diameter)
+            for number, tool in layer.tools.items()
+        }
+        hits: Dict[int, List[Tuple[float, ...]]] = {}
+        slots: Dict[int, List[Tuple[float, ...]]] = {}
+
+        for hit in layer.hits:
+            if isinstance(hit, excellon.DrillSlot):
+                slots.setdefault(hit.tool.number, []).append((*hit.start, *hit.end))
+            elif isinstance(hit, excellon.DrillHit):
+                hits.setdefault(hit.tool.number, []).append(tuple(hit.position))
+
+        return cls(
+            layer.filename,
+            layer.units,
+            tools,
+            {
+                number: np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+                for number, coordinates in hits.items()
+            },
+            {
+                number: np.array(coordinates, dtype=np.float64).reshape(-1, 4)
+                for number, coordinates in slots.items()
+            },
+        )
+
+
+def cluster_diameters(
+    diameters: Dict[int, float],
+    hit_counts: Dict[int, int],
+    tolerance: float = 0,
+    stock_sizes: Sequence[float] = (),
+) -> Dict[int, float]:
+    """Map each tool number to the diameter of the tool that will cut it.
+
+    Tools within `tolerance` of a stock size are snapped to the nearest
+    stock size.  Remaining tools are grouped with others within
+    `tolerance` of the group's smallest diameter, and the whole group is
+    cut with the diameter of its member having the most hits.
+    """
+    clustered: Dict[int, float] = {}
+
+    remaining: List[int] = []
+    for number, diameter in diameters.items():
+        nearest = min(stock_sizes, key=lambda size: abs(size - diameter), default=None)
+        if nearest is not None and abs(nearest - diameter) <= tolerance + 1e-9:
+            clustered[number] = nearest
+        else:
+            remaining.append(number)
+
+    group: List[int] = []
+    for number in sorted(remaining, key=lambda number: diameters[number]) + [-1]:
+        if group and (
+            number == -1 or diameters[number] - diameters[group[0]] > tolerance + 1e-9
+        ):
+            representative = max(
+                group, key=lambda member: (hit_counts.get(member, 0), -member)
+            )
+            for member in group:
+                clustered[member] = diameters[representative]
+            group = []
+        group.append(number)
+
+    return clustered
+
+
+class ExcellonReader(object):
+    """A streaming Excellon reader for the dialects KiCad and friends emit.
+
+    Raises `UnsupportedExcellon` for anything it does not understand so
+    that the caller can fall back to pcb-tools' more forgiving parser.
+    """
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._units = "metric"
+        self._zeros: Optional[str] = None
+        self._format: Optional[Tuple[int, int]] = None
+        self._tools: Dict[int, ExcellonTool] = {}
+        self._hits: Dict[int, array] = {}
+        self._slots: Dict[int, array] = {}
+        self._tool: Optional[int] = None
+        self._position = [0.0, 0.0]
+        self._rout = False
+        self._tool_down = False
+
+        super().__init__()
+
+    def _parse_number(self, value: str) -> float:
+        if "." in value or not value.lstrip("+-"):
+            return float(value)
+
+        if self._zeros is None:
+            raise UnsupportedExcellon(
+                "Coordinates without a decimal point require an explicit "
+                "zero suppression setting."
+            )
+
+        integer, decimal = self._format or (
+            (3, 3) if self._units == "metric" else (2, 4)
+        )
+        sign = -1 if value.startswith("-") else 1
+        digits = value.lstrip("+-")
+        if self._zeros == "leading":
+            # Leading zeros are present; trailing zeros were removed.
+            digits = digits.ljust(integer + decimal, "0")
+
+        return sign * int(digits) / (10**decimal)
+
+    def _parse_coordinates(self, line: str) -> Tuple[float, float]:
+        x, y = self._position
+        for axis, value in COORDINATE_PATTERN.findall(line):
+            if axis == "X":
+                x = self._parse_number(value)
+            else:
+                y = self._parse_number(value)
+
+        return x, y
+
+    def _add_tool(self, line: str) -> int:
+        number = int(TOOL_PATTERN.match(line).group(1))
+        diameter = TOOL_DIAMETER_PATTERN.search(line)
+        if diameter:
+            self._tools[number] = ExcellonTool(
+                number=number, diameter=float(diameter.group(1))
+            )
+
+        return number
+
+    def _parse_units(self, line: str) -> None:
+        options = line.split(",")
+        self._units = "metric" if options[0] == "METRIC" else "inch"
+        for option in options[1:]:
+            if option == "LZ":
+                self._zeros = "leading"
+            elif option == "TZ":
+                self._zeros = "trailing"
+            elif "." in option:
+                integer, decimal = option.split(".")
+                self._format = (len(integer), len(decimal))
+
+    def _add_hit(self, position: Tuple[float, float]) -> None:
+        if self._tool is None:
+            raise UnsupportedExcellon("Drill hit found before a tool was selected.")
+
+        self._hits.setdefault(self._tool, array("d")).extend(position)
+
+    def _add_slot(self, start: Tuple[float, float], end: Tuple[float, float]) -> None:
+        if self._tool is None:
+            raise UnsupportedExcellon("Slot found before a tool was selected.")
+
+        self._slots.setdefault(self._tool, array("d")).extend((*start, *end))
+
+    def _parse_header_line(self, line: str) -> None:
+        if line.startswith(("METRIC", "INCH")):
+            self._parse_units(line)
+        elif line.startswith("T"):
+            self._add_tool(line)
+        elif line in ("M71",):
+            self._units = "metric"
+        elif line in ("M72",):
+            self._units = "inch"
+        elif line.startswith("ICI") and "ON" in line:
+            raise UnsupportedExcellon("Incremental coordinates are not supported.")
+
+    def _parse_body_line(self, line: str) -> None:
+        if line.startswith("T"):
+            number = self._add_tool(line)
+            self._tool = number if number else None
+        elif line.startswith(("X", "Y")):
+            if "G85" in line:
+                start_text, end_text = line.split("G85", 1)
+                start = self._parse_coordinates(start_text)
+                self._position = list(start)
+                end = self._parse_coordinates(end_text)
+                self._add_slot(start, end)
+                self._position = list(end)
+            elif self._rout:
+                end = self._parse_coordinates(line)
+                if self._tool_down:
+                    self._add_slot(tuple(self._position), end)
+                self._position = list(end)
+            else:
+                position = self._parse_coordinates(line)
+                self._add_hit(position)
+                self._position = list(position)
+        elif line.startswith("G00"):
+            self._rout = True
+            self._position = list(self._parse_coordinates(line[3:]))
+        elif line.startswith("G01"):
+            self._rout = True
+            end = self._parse_coordinates(line[3:])
+            if self._tool_down:
+                self._add_slot(tuple(self._position), end)
+            self._position = list(end)
+        elif line.startswith("G05"):
+            self._rout = False
+        elif line.startswith("M15"):
+            self._tool_down = True
+        elif line.startswith(("M16", "M17")):
+            self._tool_down = False
+        elif line in ("M71",):
+            self._units = "metric"
+        elif line in ("M72",):
+            self._units = "inch"
+        elif line in ("G90", "%"):
+            pass
+        else:
+            # Repeats (R), incremental mode (G91), arcs (G02/G03) and
+            # anything else we don't know might place holes we'd miss.
+            raise UnsupportedExcellon(f"Unsupported statement: {line}")
+
+    def read(self, lines: Iterable[str]) -> ExcellonLayer:
+        header = False
+        seen_header = False
+
+        for raw_line in lines:
+            line = raw_line.strip()
+            if not line:
+                continue
+
+            if line.startswith(";"):
+                match = FORMAT_COMMENT_PATTERN.search(line)
+                if match:
+                    self._format = (int(match.group(1)), int(match.group(2)))
+                continue
+            elif line.startswith("M48"):
+                header = True
+                seen_header = True
+                continue
+            elif header and (line == "%" or line.startswith("M95")):
+                header = False
+                continue
+            elif line.startswith("M30"):
+                break
+
+            if header:
+                self._parse_header_line(line)
+            else:
+                self._parse_body_line(line)
+
+        if not seen_header:
+            raise UnsupportedExcellon("No Excellon header found.")
+
+        for number in (*self._hits, *self._slots):
+            if number not in self._tools:
+                raise UnsupportedExcellon(f"Tool {number} used but never defined.")
+
+        return ExcellonLayer(
+            self._filename,
+            self._units,
+            self._tools,
+            {
+                number: np.frombuffer(coordinates, dtype=np.float64).reshape(-1, 2)
+                for number, coordinates in self._hits.items()
+            },
+            {
+                number: np.frombuffer(coordinates, dtype=np.float64).reshape(-1, 4)
+                for number, coordinates in self._slots.items()
+            },
+        )
+
+
+def read(filename: str) -> ExcellonLayer:
+    """Read an Excellon drill file into per-tool coordinate arrays.
+
+    Falls back to pcb-tools for dialects the streaming reader doesn't
+    handle.
+    """
+    try:
+        with open(filename, "r") as inf:
+            return ExcellonReader(filename).read(inf)
+    except (UnsupportedExcellon, ValueError) as e:
+        logger.debug(
+            "Unable to read %s with the fast reader (%s); using pcb-tools.",
+            filename,
+            e,
+        )
+
+    import gerber
+
+    return ExcellonLayer.from_pcb_tools(gerber.read(filename))
@@ -14,5 +14,13 @@ class InvalidConfiguration(BarbariUserError):
     pass
 
 
+class InvalidGcode(BarbariUserError):
+    pass
+
+
 class BarbariFlatcamError(Exception):
     pass
+
+
+class FlatcamTimeout(BarbariFlatcamError):
+    pass
@@ -1,9 +1,22 @@
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass
 import logging
 import os
-from typing import Callable, Dict, Iterable, List, Mapping, Optional, Union
-
-from gerber import excellon
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
+from .excellon import ExcellonLayer, ExcellonTool, cluster_diameters
 from .gerbers import GerberProject
 from .config import (
     Config,
@@ -15,11 +28,29 @@ from .config import (
     ToolProfileSpec,
 )
 from .constants import LayerType, FlatcamLayer
+from .metrics import Metrics
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class ToolAssignment:
+    number: int
+    diameter: float
+    hits: int
+    profile: str
+    slot: bool = False
+
+
+@dataclass
+class UnassignedTool:
+    number: int
+    diameter: float
+    hits: int
+    slot: bool = False
+
+
 class FlatcamProcess(object):
     def __init__(self, cmd, *args, **params):
         self._cmd = cmd
@@ -41,6 +72,26 @@ class FlatcamProcess(object):
 
         return " ".join(cmd_parts)
 
+    @property
+    def cmd(self) -> str:
+        return self._cmd
+
+    @property
+    def args(self) -> Tuple[str, ...]:
+        return self._args
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self._params
+
+    def replace(self, *args, **params) -> FlatcamProcess:
+        process = copy.copy(self)
+        if args:
+            process._args = args
+        process._params = {**self._params, **params}
+
+        return process
+
     def get_layer_name(self, layer: Union[FlatcamLayer, str]):
         if isinstance(layer, FlatcamLayer):
             return layer.value
@@ -154,9 +205,16 @@ class FlatcamWriteGcode(FlatcamProcess):
         tool_name: str,
         tool_size: float,
     ):
+        self.layer = self.get_layer_name(layer)
+        self.path = path
+        self.counter = counter
+        self.name = name
+        self.tool_name = tool_name
+        self.tool_size = tool_size
+
         super().__init__(
             "write_gcode",
-            self.get_layer_name(layer),
+            self.layer,
             os.path.join(
                 path,
                 "{counter}.{name}.{tool_size}.{tool_name}.gcode".format(
@@ -168,12 +226,59 @@ class FlatcamWriteGcode(FlatcamProcess):
             ),
         )
 
+    @property
+    def filename(self) -> str:
+        return self._args[1]
+
+    def renumber(self, counter: int, name: Optional[str] = None) -> FlatcamWriteGcode:
+        return FlatcamWriteGcode(
+            self.layer,
+            self.path,
+            counter,
+            name or self.name,
+            self.tool_name,
+            self.tool_size,
+        )
+
+
+class FlatcamStepMarker(FlatcamProcess):
+    PREFIX = "barbari-step"
+
+    def __init__(self, index: int):
+        self.index = index
+
+        # FlatCAM swallows single-argument `puts` calls into its own
+        # shell; we need to name the channel explicitly for the text
+        # to reach the process's stdout.
+        super().__init__("puts", "stdout", f'"{self.PREFIX} {index}"')
+
+    def __str__(self):
+        return super().__str__() + "; flush stdout"
+
+
+def add_step_markers(
+    processes: Iterable[FlatcamProcess],
+) -> Iterable[FlatcamProcess]:
+    for idx, process in enumerate(processes):
+        yield FlatcamStepMarker(idx)
+        yield process
+
 
 class FlatcamProjectGenerator(object):
-    def __init__(self, gerbers: GerberProject, config: Config):
+    def __init__(
+        self,
+        gerbers: GerberProject,
+        config: Config,
+        output_path: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         self._gerbers = gerbers
         self._config = config
+        self._output_path = output_path
+        self._metrics = metrics or gerbers.metrics
         self._gcode_counter = 0
+        self._tool_assignments: List[ToolAssignment] = []
+        self._unassigned_tools: List[UnassignedTool] = []
 
         super().__init__()
 
@@ -194,40 +299,62 @@ class FlatcamProjectGenerator(object):
     def gerbers(self) -> GerberProject:
         return self._gerbers
 
+    @property
+    def output_path(self) -> str:
+        return self._output_path or self.gerbers.path
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def tool_assignments(self) -> List[ToolAssignment]:
+        """The drill or slot profile each tool having hits was assigned to.
+
+        Populated as the processes returned by `get_cnc_processes` are
+        generated.
+        """
+        return self._tool_assignments
+
+    @property
+    def unassigned_tools(self) -> List[UnassignedTool]:
+        """Drill and slot tools no profile could be found for.
+
+        Populated as the processes returned by `get_cnc_processes` are
+        generated.
+        """
+        return self._unassigned_tools
+
     def _load_layers(self) -> Iterable[FlatcamProcess]:
-        for layer_type, layer in self.gerbers.get_layers().items():
+        for layer_type, path in self.gerbers.get_layer_paths().items():
             if layer_type == LayerType.DRILL:
                 yield FlatcamProcess(
                     "open_excellon",
-                    layer.filename,
+                    path,
                     outname=layer_type.value,
                 )
             else:
                 yield FlatcamProcess(
                     "open_gerber",
-                    layer.filename,
+                    path,
                     outname=layer_type.value,
                 )
 
-    def _alignment_holes(self) -> Iterable[FlatcamProcess]:
+    def get_alignment_holes(self) -> List[Tuple[float, float]]:
         if not self.config.alignment_holes:
-            return
+            return []
 
-        logger.debug("Processing alignment holes...")
-
-        layers = self.gerbers.get_layers()
-
-        edge_cuts = layers[LayerType.EDGE_CUTS]
+        edge_cuts = self.gerbers.get_bounds(LayerType.EDGE_CUTS)
 
         min_x = edge_cuts.bounds[0][0]
         max_x = edge_cuts.bounds[0][1]
         min_y = edge_cuts.bounds[1][0]
-        max_y = edge_cuts.bounds[1][1]
 
         hole_offset = (
             self.config.alignment_holes.hole_size / 2
         ) + self.config.alignment_holes.hole_offset
-        holes = [
+
+        return [
             (
                 min_x + hole_offset,
                 min_y - hole_offset,
@@ -238,6 +365,15 @@ class FlatcamProjectGenerator(object):
             ),
         ]
 
+    def _alignment_holes(self) -> Iterable[FlatcamProcess]:
+        if not self.config.alignment_holes:
+            return
+
+        logger.debug("Processing alignment holes...")
+
+        max_y = self.gerbers.get_bounds(LayerType.EDGE_CUTS).bounds[1][1]
+        holes = self.get_alignment_holes()
+
         # This command took some trial and error to figure out --
         # the "holes" parameter is undocumented, and I was only
         # able to figure out how to set the rotation point by
@@ -250,12 +386,7 @@ class FlatcamProjectGenerator(object):
             holes='"' + ",".join(str(hole) for hole in holes) + '"',
             dist=max_y / 2,
         )
-        yield FlatcamProcess(
-            "mirror",
-            FlatcamLayer.B_CU.value,
-            axis=self.config.alignment_holes.mirror_axis,
-            box="edge_cuts",
-        )
+        yield from self._mirror()
         yield FlatcamMillHoles(
             self.config.alignment_holes,
             FlatcamLayer.ALIGNMENT,
@@ -269,55 +400,58 @@ class FlatcamProjectGenerator(object):
         )
         yield FlatcamWriteGcode(
             FlatcamLayer.ALIGNMENT_CNC,
-            self.gerbers.path,
+            self.output_path,
             self.counter,
             "alignment_holes",
             "end_mill",
             self.config.alignment_holes.tool_size,
         )
 
+    def _mirror(self) -> Iterable[FlatcamProcess]:
+        if not self.config.alignment_holes:
+            return
+
+        yield FlatcamProcess(
+            "mirror",
+            FlatcamLayer.B_CU.value,
+            axis=self.config.alignment_holes.mirror_axis,
+            box="edge_cuts",
+        )
+
     def _copper(self) -> Iterable[FlatcamProcess]:
-        if not self.config.isolation_routing:
+        tools = self.config.isolation_routing_tools
+        if not tools:
             return
 
         logger.debug("Processing isolation routing...")
 
-        yield FlatcamIsolate(
-            self.config.isolation_routing,
-            FlatcamLayer.B_CU,
-            FlatcamLayer.B_CU_PATH,
-        )
-        yield FlatcamCNCJob(
-            self.config.isolation_routing,
-            FlatcamLayer.B_CU_PATH,
-            FlatcamLayer.B_CU_CNC,
-        )
-        yield FlatcamWriteGcode(
-            FlatcamLayer.B_CU_CNC,
-            self.gerbers.path,
-            self.counter,
-            "b_cu",
-            "engraving_bit",
-            self.config.isolation_routing.tool_size,
-        )
-        yield FlatcamIsolate(
-            self.config.isolation_routing,
-            FlatcamLayer.F_CU,
-            FlatcamLayer.F_CU_PATH,
-        )
-        yield FlatcamCNCJob(
-            self.config.isolation_routing,
-            FlatcamLayer.F_CU_PATH,
-            FlatcamLayer.F_CU_CNC,
-        )
-        yield FlatcamWriteGcode(
-            FlatcamLayer.F_CU_CNC,
-            self.gerbers.path,
-            self.counter,
-            "f_cu",
-            "engraving_bit",
-            self.config.isolation_routing.tool_size,
-        )
+        for side, layer, path_layer, cnc_layer in (
+            ("b_cu", FlatcamLayer.B_CU, FlatcamLayer.B_CU_PATH, FlatcamLayer.B_CU_CNC),
+            ("f_cu", FlatcamLayer.F_CU, FlatcamLayer.F_CU_PATH, FlatcamLayer.F_CU_CNC),
+        ):
+            # Tools are ordered largest first; the large tools clear
+            # wide gaps in few passes, and the smaller tools that follow
+            # isolate the gaps too narrow for the larger ones to fit.
+            for idx, tool in enumerate(tools):
+                suffix = f"_{idx + 1}" if len(tools) > 1 else ""
+                yield FlatcamIsolate(
+                    tool,
+                    layer,
+                    f"{path_layer.value}{suffix}",
+                )
+                yield FlatcamCNCJob(
+                    tool,
+                    f"{path_layer.value}{suffix}",
+                    f"{cnc_layer.value}{suffix}",
+                )
+                yield FlatcamWriteGcode(
+                    f"{cnc_layer.value}{suffix}",
+                    self.output_path,
+                    self.counter,
+                    side,
+                    "engraving_bit",
+                    tool.tool_size,
+                )
 
     def _get_spec_for_tool(
         self, tool, specs: Mapping[str, ToolProfileSpec]
@@ -332,21 +466,81 @@ class FlatcamProjectGenerator(object):
 
         return selected
 
+    def _record_tool_assignment(self, assignment: ToolAssignment) -> None:
+        kind = "slot" if assignment.slot else "drill"
+
+        self._tool_assignments.append(assignment)
+        self._metrics.increment(
+            "profile_assignments_total", kind=kind, profile=assignment.profile
+        )
+        self._metrics.event(
+            "profile_assigned",
+            kind=kind,
+            tool=assignment.number,
+            diameter=assignment.diameter,
+            hits=assignment.hits,
+            profile=assignment.profile,
+        )
+
+    def _record_unassigned_tool(self, tool: UnassignedTool) -> None:
+        kind = "slot" if tool.slot else "drill"
+
+        self._unassigned_tools.append(tool)
+        self._metrics.increment("unassigned_tools_total", kind=kind)
+        self._metrics.increment("unassigned_hits_total", tool.hits, kind=kind)
+        self._metrics.event(
+            "tool_unassigned",
+            kind=kind,
+            tool=tool.number,
+            diameter=tool.diameter,
+            hits=tool.hits,
+        )
+
     def _get_tool_hit_count(
         self,
-        layer: excellon.ExcellonFile,
-        tool: excellon.ExcellonTool,
+        layer: ExcellonLayer,
+        tool: ExcellonTool,
         slot: bool = False,
     ):
-        counter = 0
-
-        expected_class = excellon.DrillSlot if slot else excellon.DrillHit
+        return layer.get_hit_count(tool.number, slot=slot)
+
+    def _get_tool_diameters(
+        self, layer: ExcellonLayer, slot: bool = False
+    ) -> Dict[int, float]:
+        """Return the diameter each tool having hits should be cut with.
+
+        If `tool_clustering` is configured, tools having nearly the same
+        diameter are treated as the same tool.
+        """
+        diameters = {
+            number: tool.diameter
+            for number, tool in layer.tools.items()
+            if self._get_tool_hit_count(layer, tool, slot=slot)
+        }
+        clustering = self.config.tool_clustering
+        if not clustering:
+            return diameters
+
+        clustered = cluster_diameters(
+            diameters,
+            {number: layer.get_hit_count(number, slot=slot) for number in diameters},
+            tolerance=clustering.tolerance,
+            stock_sizes=clustering.stock_sizes,
+        )
 
-        for hit in layer.hits:
-            if isinstance(hit, expected_class) and hit.tool == tool:
-                counter += 1
+        groups: Dict[float, List[int]] = {}
+        for number, diameter in sorted(clustered.items()):
+            groups.setdefault(diameter, []).append(number)
+        for diameter, numbers in groups.items():
+            if len(numbers) > 1 or diameters[numbers[0]] != diameter:
+                logger.info(
+                    "Treating %s as one %s dia %s.",
+                    ", ".join(f"tool {n} ({diameters[n]} dia)" for n in numbers),
+                    diameter,
+                    "slot tool" if slot else "drill",
+                )
 
-        return counter
+        return clustered
 
     def _drill(self) -> Iterable[FlatcamProcess]:
         if not self.config.drill:
@@ -354,11 +548,12 @@ class FlatcamProjectGenerator(object):
 
         logger.debug("Processing drills...")
 
-        layer: excellon.ExcellonFile = self.gerbers.get_layers()[LayerType.DRILL]
+        layer: ExcellonLayer = self.gerbers.get_drill_layer()
 
+        diameters = self._get_tool_diameters(layer)
         process_map: Dict[str, List[int]] = {}
         for tool_number, tool in layer.tools.items():
-            if not self._get_tool_hit_count(layer, tool):
+            if tool_number not in diameters:
                 logger.debug(
                     "Tool %s (%s dia) has no drill hits.",
                     tool_number,
@@ -366,7 +561,9 @@ class FlatcamProjectGenerator(object):
                 )
                 continue
 
-            selected_spec = self._get_spec_for_tool(tool, self.config.drill)
+            selected_spec = self._get_spec_for_tool(
+                ExcellonTool(tool_number, diameters[tool_number]), self.config.drill
+            )
             if selected_spec:
                 logger.debug(
                     "Assigning tool %s (%s dia) to drill process %s.",
@@ -374,6 +571,15 @@ class FlatcamProjectGenerator(object):
                     tool.diameter,
                     selected_spec,
                 )
+                self._record_tool_assignment(
+                    ToolAssignment(
+                        tool_number,
+                        tool.diameter,
+                        self._get_tool_hit_count(layer, tool),
+                        selected_spec,
+                        slot=False,
+                    )
+                )
                 process_map.setdefault(selected_spec, []).append(tool_number)
             else:
                 logger.error(
@@ -382,6 +588,14 @@ class FlatcamProjectGenerator(object):
                     tool_number,
                     tool.diameter,
                 )
+                self._record_unassigned_tool(
+                    UnassignedTool(
+                        tool_number,
+                        tool.diameter,
+                        self._get_tool_hit_count(layer, tool),
+                        slot=False,
+                    )
+                )
 
         for process_name, tool_numbers in process_map.items():
             specs = self.config.drill[process_name].specs
@@ -399,7 +613,7 @@ class FlatcamProjectGenerator(object):
                     )
                     yield FlatcamWriteGcode(
                         layer_name,
-                        self.gerbers.path,
+                        self.output_path,
                         self.counter,
                         "drill_{name}".format(name=process_name),
                         "drill",
@@ -415,7 +629,7 @@ class FlatcamProjectGenerator(object):
                     yield FlatcamCNCJob(spec, layer_name, layer_name + "_cnc")
                     yield FlatcamWriteGcode(
                         layer_name + "_cnc",
-                        self.gerbers.path,
+                        self.output_path,
                         self.counter,
                         "drill_{name}".format(name=process_name),
                         "end_mill",
@@ -430,11 +644,12 @@ class FlatcamProjectGenerator(object):
 
         logger.debug("Processing slots...")
 
-        layer: excellon.ExcellonFile = self.gerbers.get_layers()[LayerType.DRILL]
+        layer: ExcellonLayer = self.gerbers.get_drill_layer()
 
+        diameters = self._get_tool_diameters(layer, slot=True)
         process_map: Dict[str, List[int]] = {}
         for tool_number, tool in layer.tools.items():
-            if not self._get_tool_hit_count(layer, tool, slot=True):
+            if tool_number not in diameters:
                 logger.debug(
                     "Tool %s (%s dia) has no slot hits.",
                     tool_number,
@@ -442,7 +657,9 @@ class FlatcamProjectGenerator(object):
                 )
                 continue
 
-            selected_spec = self._get_spec_for_tool(tool, self.config.slot)
+            selected_spec = self._get_spec_for_tool(
+                ExcellonTool(tool_number, diameters[tool_number]), self.config.slot
+            )
             if selected_spec:
                 logger.debug(
                     "Assigning tool %s (%s dia) to slot process %s.",
@@ -450,6 +667,15 @@ class FlatcamProjectGenerator(object):
                     tool.diameter,
                     selected_spec,
                 )
+                self._record_tool_assignment(
+                    ToolAssignment(
+                        tool_number,
+                        tool.diameter,
+                        self._get_tool_hit_count(layer, tool, slot=True),
+                        selected_spec,
+                        slot=True,
+                    )
+                )
                 process_map.setdefault(selected_spec, []).append(tool_number)
             else:
                 logger.error(
@@ -458,6 +684,14 @@ class FlatcamProjectGenerator(object):
                     tool_number,
                     tool.diameter,
                 )
+                self._record_unassigned_tool(
+                    UnassignedTool(
+                        tool_number,
+                        tool.diameter,
+                        self._get_tool_hit_count(layer, tool, slot=True),
+                        slot=True,
+                    )
+                )
 
         for process_name, tool_numbers in process_map.items():
             specs = self.config.slot[process_name].specs
@@ -477,7 +711,7 @@ class FlatcamProjectGenerator(object):
                 yield FlatcamCNCJob(spec, layer_name, layer_name + "_cnc")
                 yield FlatcamWriteGcode(
                     layer_name + "_cnc",
-                    self.gerbers.path,
+                    self.output_path,
                     self.counter,
                     "slot_{name}".format(name=process_name),
                     "end_mill",
@@ -505,7 +739,7 @@ class FlatcamProjectGenerator(object):
         )
         yield FlatcamWriteGcode(
             FlatcamLayer.EDGE_CUTS_CNC,
-            self.gerbers.path,
+            self.output_path,
             self.counter,
             "edge_cuts",
             "end_mill",
@@ -529,4 +763,5 @@ class FlatcamProjectGenerator(object):
         for major_step in major_step_generators:
             for step in major_step():
                 logger.debug("Step %s generated", step)
+                self._metrics.increment("steps_generated_total", command=step.cmd)
                 yield step
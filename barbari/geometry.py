@@ -0,0 +1,493 @@
+"""Flatten gerber layers into polygons.
+
+Copper layers flash the same few apertures -- SMD pads, vias, a
+footprint's fine-pitch pads -- thousands of times.  Rather than
+outlining every flash, each aperture (or aperture macro) is outlined
+once, and that outline is stamped at every position it was flashed at
+by a single array operation.  Traces drawn with round apertures are
+outlined together in the same way, a batch per aperture size.
+
+Polygons are approximations: arcs and circles are flattened into chords
+no longer than `CHORD_LENGTH`, and the parts of an aperture macro whose
+exposure is off are returned as clear polygons (strictly they only
+clear the flash they belong to).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import math
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+from .bounds import Bounds
+
+MM_PER_INCH = 25.4
+
+# Arcs and circles are flattened into chords no longer than this (in
+# millimeters).
+CHORD_LENGTH = 0.1
+
+# Circles are never outlined with fewer points than this, or more than
+# `MAX_SEGMENTS`, however small or large they are.
+MIN_SEGMENTS = 8
+MAX_SEGMENTS = 360
+
+# Aperture shapes are compared to this many decimal places (of the
+# layer's units) when deciding whether they can share an outline.
+KEY_PLACES = 9
+
+# An aperture's outline: its polygons, relative to where it's flashed,
+# each with whether it is dark (rather than clear).
+Template = List[Tuple[np.ndarray, bool]]
+
+
+@dataclass
+class LayerGeometry:
+    """A layer's primitives as closed polygons, in millimeters.
+
+    Polygon `i` is `points[offsets[i]:offsets[i + 1]]`; polygons are in
+    the order their primitives were drawn, and those that aren't `dark`
+    clear whatever was drawn before them.
+    """
+
+    points: np.ndarray
+    offsets: np.ndarray
+    dark: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.dark)
+
+    def get_polygon(self, index: int) -> np.ndarray:
+        return self.points[self.offsets[index] : self.offsets[index + 1]]
+
+    @property
+    def bounds(self) -> Bounds:
+        (min_x, min_y), (max_x, max_y) = self.points.min(axis=0), self.points.max(
+            axis=0
+        )
+        return (float(min_x), float(max_x)), (float(min_y), float(max_y))
+
+
+class _Polygons(object):
+    """Polygons gathered in batches, to be put in drawing order at the end.
+
+    Each batch holds `k` polygons of `m` points each; every polygon has
+    the index of the primitive it was drawn by, and a part number to
+    order the polygons a single primitive was drawn as.
+    """
+
+    def __init__(self):
+        self._points: List[np.ndarray] = []
+        self._primitives: List[np.ndarray] = []
+        self._parts: List[np.ndarray] = []
+        self._dark: List[np.ndarray] = []
+
+        super().__init__()
+
+    def add(self, points: np.ndarray, primitives: np.ndarray, parts, dark) -> None:
+        count = len(points)
+        self._points.append(points)
+        self._primitives.append(np.asarray(primitives, dtype=np.intp))
+        self._parts.append(np.broadcast_to(np.asarray(parts, dtype=np.intp), count))
+        self._dark.append(np.broadcast_to(np.asarray(dark, dtype=bool), count))
+
+    def get_geometry(self) -> LayerGeometry:
+        if not self._points:
+            return LayerGeometry(
+                points=np.zeros((0, 2)),
+                offsets=np.zeros(1, dtype=np.intp),
+                dark=np.zeros(0, dtype=bool),
+            )
+
+        points = np.concatenate([batch.reshape(-1, 2) for batch in self._points])
+        sizes = np.concatenate(
+            [
+                np.full(len(batch), batch.shape[1], dtype=np.intp)
+                for batch in self._points
+            ]
+        )
+        order = np.lexsort(
+            (np.concatenate(self._parts), np.concatenate(self._primitives))
+        )
+
+        starts = (np.cumsum(sizes) - sizes)[order]
+        sizes = sizes[order]
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        within = np.arange(offsets[-1]) - np.repeat(offsets[:-1], sizes)
+
+        return LayerGeometry(
+            points=points[np.repeat(starts, sizes) + within],
+            offsets=offsets,
+            dark=np.concatenate(self._dark)[order],
+        )
+
+
+def _round(value: float) -> float:
+    return round(value, KEY_PLACES)
+
+
+def _get_segment_count(radius: float, sweep: float, chord_length: float) -> int:
+    return min(
+        max(math.ceil(abs(sweep) * radius / chord_length), MIN_SEGMENTS), MAX_SEGMENTS
+    )
+
+
+def _get_circle(radius: float, chord_length: float) -> np.ndarray:
+    count = _get_segment_count(radius, 2 * math.pi, chord_length)
+    angles = np.arange(count) * (2 * math.pi / count)
+
+    return radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+
+def _get_capsules(
+    starts: np.ndarray, ends: np.ndarray, radius: float, chord_length: float
+) -> np.ndarray:
+    """Outline lines `starts[i]`-`ends[i]` drawn with a round aperture.
+
+    Returns a `(k, m, 2)` array: each line's end cap, then its start cap.
+    """
+    count = max(_get_segment_count(radius, math.pi, chord_length) // 2, 2)
+    cap = np.linspace(-math.pi / 2, math.pi / 2, count + 1)
+    direction = ends - starts
+    angles = np.arctan2(direction[:, 1], direction[:, 0])[:, None]
+
+    end_angles = angles + cap
+    start_angles = end_angles + math.pi
+    return np.concatenate(
+        [
+            ends[:, None, :]
+            + radius * np.stack([np.cos(end_angles), np.sin(end_angles)], axis=2),
+            starts[:, None, :]
+            + radius * np.stack([np.cos(start_angles), np.sin(start_angles)], axis=2),
+        ],
+        axis=1,
+    )
+
+
+def _get_arc_points(primitive, scale: float, chord_length: float) -> np.ndarray:
+    """Flatten an arc into chords; returns its points, in millimeters."""
+    start = np.array(primitive.start) * scale
+    end = np.array(primitive.end) * scale
+    center = np.array(primitive.center) * scale
+
+    radius = math.hypot(*(start - center))
+    start_angle = math.atan2(*(start - center)[::-1])
+    end_angle = math.atan2(*(end - center)[::-1])
+    clockwise = primitive.direction == "clockwise"
+
+    sweep = (start_angle - end_angle) if clockwise else (end_angle - start_angle)
+    sweep %= 2 * math.pi
+    if sweep < 1e-9:
+        sweep = 2 * math.pi
+    if clockwise:
+        sweep = -sweep
+
+    count = min(max(math.ceil(abs(sweep) * radius / chord_length), 2), MAX_SEGMENTS)
+    angles = start_angle + sweep * np.arange(count + 1) / count
+    points = center + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    points[-1] = end
+
+    return points
+
+
+def _get_convex_hull(points: np.ndarray) -> np.ndarray:
+    """Andrew's monotone chain; returns the hull counterclockwise."""
+    ordered = sorted(set(map(tuple, points.tolist())))
+    if len(ordered) < 3:
+        return np.array(ordered)
+
+    def cross(o, a, b) -> float:
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower: List[Tuple[float, float]] = []
+    upper: List[Tuple[float, float]] = []
+    for point in ordered:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(ordered):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def _is_dark(primitive) -> bool:
+    return getattr(primitive, "level_polarity", "dark") != "clear"
+
+
+def _get_position(primitive) -> Tuple[float, float]:
+    """Where a primitive was flashed; apertures themselves are at the origin."""
+    return getattr(primitive, "position", None) or (0.0, 0.0)
+
+
+class Flattener(object):
+    """Flattens layers into `LayerGeometry`, outlining each aperture once.
+
+    Outlines are kept between layers, so flattening both copper layers
+    of a board outlines the apertures they share only once.
+    """
+
+    def __init__(self, chord_length: float = CHORD_LENGTH):
+        self._chord_length = chord_length
+        self._templates: Dict[Hashable, Template] = {}
+
+        super().__init__()
+
+    @property
+    def template_count(self) -> int:
+        return len(self._templates)
+
+    def _get_key(self, primitive, origin: Tuple[float, float]) -> Hashable:
+        """Describe a flashed shape independently of where it was flashed."""
+        from gerber import primitives
+
+        dark = _is_dark(primitive)
+        if isinstance(primitive, primitives.AMGroup):
+            return ("macro",) + tuple(
+                self._get_key(part, origin) for part in primitive.primitives
+            )
+        if isinstance(primitive, primitives.Outline):
+            return (
+                "outline",
+                dark,
+                tuple(
+                    (
+                        _round(line.end[0] - origin[0]),
+                        _round(line.end[1] - origin[1]),
+                    )
+                    for line in primitive.primitives
+                ),
+            )
+
+        x, y = _get_position(primitive)
+        offset = (_round(x - origin[0]), _round(y - origin[1]))
+        if isinstance(primitive, primitives.Circle):
+            return ("circle", dark, offset, _round(primitive.diameter))
+        if isinstance(primitive, (primitives.Rectangle, primitives.Obround)):
+            return (
+                type(primitive).__name__,
+                dark,
+                offset,
+                _round(primitive.width),
+                _round(primitive.height),
+                _round(primitive.rotation),
+            )
+        if isinstance(primitive, primitives.Polygon):
+            return (
+                "polygon",
+                dark,
+                offset,
+                primitive.sides,
+                _round(primitive.radius),
+                _round(primitive.rotation),
+            )
+
+        (min_x, max_x), (min_y, max_y) = primitive.bounding_box
+        return (
+            "box",
+            dark,
+            tuple(
+                _round(value)
+                for value in (
+                    min_x - origin[0],
+                    max_x - origin[0],
+                    min_y - origin[1],
+                    max_y - origin[1],
+                )
+            ),
+        )
+
+    def _render(self, primitive, origin: Tuple[float, float], scale: float) -> Template:
+        """Outline a flashed shape, relative to `origin`, in millimeters."""
+        from gerber import primitives
+
+        chord_length = self._chord_length
+        dark = _is_dark(primitive)
+        if isinstance(primitive, primitives.AMGroup):
+            return [
+                polygon
+                for part in primitive.primitives
+                for polygon in self._render(part, origin, scale)
+            ]
+        if isinstance(primitive, primitives.Outline):
+            # pcb-tools starts every line of some macro primitives' outlines
+            # (center lines, vector lines) at the same corner; their ends
+            # are the outline's corners.
+            points = [line.end for line in primitive.primitives]
+            return [((np.array(points) - origin) * scale, dark)]
+
+        if isinstance(primitive, primitives.Circle):
+            points = _get_circle(primitive.radius * scale, chord_length)
+        elif isinstance(primitive, primitives.Obround):
+            half_x = max(primitive.width - primitive.height, 0) / 2 * scale
+            half_y = max(primitive.height - primitive.width, 0) / 2 * scale
+            points = _get_capsules(
+                np.array([[-half_x, -half_y]]),
+                np.array([[half_x, half_y]]),
+                min(primitive.width, primitive.height) / 2 * scale,
+                chord_length,
+            )[0]
+        elif isinstance(primitive, primitives.Rectangle):
+            half_x, half_y = primitive.width / 2 * scale, primitive.height / 2 * scale
+            points = np.array(
+                [
+                    (-half_x, -half_y),
+                    (half_x, -half_y),
+                    (half_x, half_y),
+                    (-half_x, half_y),
+                ]
+            )
+        elif isinstance(primitive, primitives.Polygon):
+            angles = np.radians(primitive.rotation) + np.arange(primitive.sides) * (
+                2 * math.pi / primitive.sides
+            )
+            points = (
+                primitive.radius
+                * scale
+                * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+            )
+        else:
+            # Anything else is approximated by its bounding box.
+            (min_x, max_x), (min_y, max_y) = primitive.bounding_box
+            return [
+                (
+                    (
+                        np.array(
+                            [
+                                (min_x, min_y),
+                                (max_x, min_y),
+                                (max_x, max_y),
+                                (min_x, max_y),
+                            ]
+                        )
+                        - origin
+                    )
+                    * scale,
+                    dark,
+                )
+            ]
+
+        if isinstance(primitive, (primitives.Rectangle, primitives.Obround)):
+            angle = math.radians(primitive.rotation)
+            cos, sin = math.cos(angle), math.sin(angle)
+            points = points @ np.array([[cos, sin], [-sin, cos]])
+        x, y = _get_position(primitive)
+        return [(points + np.array([x - origin[0], y - origin[1]]) * scale, dark)]
+
+    def get_template(self, primitive, scale: float = 1.0) -> Template:
+        """Outline a flashed primitive relative to its position, once per shape."""
+        origin = _get_position(primitive)
+        key = (scale, self._get_key(primitive, origin))
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = self._render(primitive, origin, scale)
+
+        return template
+
+    def get_flash(self, primitive, scale: float = 1.0) -> Template:
+        """Outline a flashed primitive where it was flashed."""
+        x, y = _get_position(primitive)
+        offset = np.array([x, y]) * scale
+
+        return [
+            (points + offset, dark)
+            for points, dark in self.get_template(primitive, scale)
+        ]
+
+    def flatten(self, layer) -> LayerGeometry:
+        from gerber import primitives
+
+        scale = MM_PER_INCH if layer.units == "inch" else 1.0
+        polygons = _Polygons()
+
+        # Flashes, by their shape's key, and lines drawn with a round
+        # aperture, by radius: each is outlined as a batch at the end.
+        flashes: Dict[Hashable, Tuple[object, List[Tuple[int, float, float, bool]]]] = (
+            {}
+        )
+        strokes: Dict[float, List[Tuple[int, int, Tuple[float, ...], bool]]] = {}
+
+        def add_stroke(index: int, points: np.ndarray, aperture, dark: bool) -> None:
+            if isinstance(aperture, primitives.Circle):
+                radius = _round(aperture.radius * scale)
+                strokes.setdefault(radius, []).extend(
+                    (index, part, tuple(start) + tuple(end), dark)
+                    for part, (start, end) in enumerate(zip(points, points[1:]))
+                )
+                return
+
+            # Other apertures (rectangles, in practice) sweep out the
+            # hull of the aperture at either end of each segment.
+            outline = np.concatenate(
+                [part for part, _ in self.get_template(aperture, scale)]
+            )
+            for part, (start, end) in enumerate(zip(points, points[1:])):
+                hull = _get_convex_hull(
+                    np.concatenate([outline + start, outline + end])
+                )
+                polygons.add(hull[None], [index], part, dark)
+
+        for index, primitive in enumerate(layer.primitives):
+            dark = _is_dark(primitive)
+            if isinstance(primitive, primitives.Line):
+                add_stroke(
+                    index,
+                    np.array([primitive.start, primitive.end]) * scale,
+                    primitive.aperture,
+                    dark,
+                )
+            elif isinstance(primitive, primitives.Arc):
+                add_stroke(
+                    index,
+                    _get_arc_points(primitive, scale, self._chord_length),
+                    primitive.aperture,
+                    dark,
+                )
+            elif isinstance(primitive, primitives.Region):
+                points: List[np.ndarray] = []
+                for part in primitive.primitives:
+                    if isinstance(part, primitives.Arc):
+                        points.append(
+                            _get_arc_points(part, scale, self._chord_length)[:-1]
+                        )
+                    else:
+                        points.append(np.array([part.start]) * scale)
+                outline = np.concatenate(points)
+                if len(outline) >= 3:
+                    polygons.add(outline[None], [index], 0, dark)
+            else:
+                x, y = _get_position(primitive)
+                key = (scale, self._get_key(primitive, (x, y)))
+                flashes.setdefault(key, (primitive, []))[1].append((index, x, y, dark))
+
+        for key, (primitive, flashed) in flashes.items():
+            template = self._templates.get(key)
+            if template is None:
+                template = self._templates[key] = self._render(
+                    primitive, _get_position(primitive), scale
+                )
+            indexes, xs, ys, darks = (np.array(column) for column in zip(*flashed))
+            positions = np.stack([xs, ys], axis=1) * scale
+            for part, (points, part_dark) in enumerate(template):
+                polygons.add(
+                    points[None] + positions[:, None], indexes, part, darks & part_dark
+                )
+
+        for radius, lines in strokes.items():
+            indexes, parts, segments, darks = (
+                np.array(column) for column in zip(*lines)
+            )
+            polygons.add(
+                _get_capsules(
+                    segments[:, :2], segments[:, 2:], radius, self._chord_length
+                ),
+                indexes,
+                parts,
+                darks,
+            )
+
+        return polygons.get_geometry()
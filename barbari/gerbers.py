@@ -1,16 +1,34 @@
 import logging
 import os
 import re
-from typing import Dict
-
-import gerber
+from typing import Dict, Optional
 
+from . import bounds, excellon, geometry
 from .constants import LayerType
+from .metrics import Metrics
 
 
 logger = logging.getLogger(__name__)
 
 
+# Layers are recognized by name, but other files (backups, archives,
+# notes) can have similar names.  Every gerber states its coordinate
+# format (`%FS`) and every Excellon file opens with a header (`M48`)
+# near the start of the file; a file lacking one isn't a layer.
+HEADER_SIZE = 65536
+LAYER_HEADERS = {
+    LayerType.DRILL: re.compile(rb"^\s*M48", re.MULTILINE),
+}
+GERBER_HEADER = re.compile(rb"%\s*FS")
+
+
+def has_layer_header(path: str, layer_type: LayerType) -> bool:
+    with open(path, "rb") as inf:
+        head = inf.read(HEADER_SIZE)
+
+    return bool(LAYER_HEADERS.get(layer_type, GERBER_HEADER).search(head))
+
+
 class UnknownLayerType(ValueError):
     pass
 
@@ -24,9 +42,15 @@ class GerberProject(object):
         LayerType.DRILL: re.compile(".*\.drl$"),
     }
 
-    def __init__(self, path):
+    def __init__(self, path, metrics: Optional[Metrics] = None):
         self._path = path
+        self._metrics = metrics or Metrics()
         self._layers = {}
+        self._layers_loaded = False
+        self._layer_paths: Dict[LayerType, str] = {}
+        self._bounds: Dict[LayerType, bounds.LayerBounds] = {}
+        self._geometry: Dict[LayerType, geometry.LayerGeometry] = {}
+        self._flattener = geometry.Flattener()
 
         super().__init__()
 
@@ -34,6 +58,15 @@ class GerberProject(object):
     def path(self) -> str:
         return self._path
 
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def flattener(self) -> geometry.Flattener:
+        """Outlines apertures for every layer of the project."""
+        return self._flattener
+
     def detect_layer_type(self, filename: str, layer):
         for layer_type, pattern in self.LAYER_NAME_PATTERNS.items():
             if pattern.match(filename):
@@ -41,10 +74,126 @@ class GerberProject(object):
 
         raise UnknownLayerType("Unable to guess layer position for {}".format(filename))
 
+    def get_layer_paths(self) -> Dict[LayerType, str]:
+        """Find each layer's file by name alone, without parsing it."""
+        if self._layer_paths:
+            return self._layer_paths
+
+        for filename in sorted(os.listdir(self._path)):
+            full_path = os.path.join(self._path, filename)
+            if not os.path.isfile(full_path):
+                continue
+
+            try:
+                layer_type = self.detect_layer_type(filename, None)
+            except UnknownLayerType:
+                continue
+            if not has_layer_header(full_path, layer_type):
+                logger.debug(
+                    "Skipping %s; probably not a %s layer.", full_path, layer_type.value
+                )
+                continue
+
+            self._layer_paths[layer_type] = full_path
+
+        for layer_type, path in self._layer_paths.items():
+            self._metrics.event(
+                "layer_found",
+                layer=layer_type.value,
+                path=path,
+                size=os.path.getsize(path),
+            )
+        self._metrics.set("layers", len(self._layer_paths))
+
+        return self._layer_paths
+
+    def get_drill_layer(self) -> excellon.ExcellonLayer:
+        if LayerType.DRILL not in self._layers:
+            with self._metrics.timer("layer_read_seconds_total", layer="drill"):
+                layer = excellon.read(self.get_layer_paths()[LayerType.DRILL])
+            self._layers[LayerType.DRILL] = layer
+
+            self._metrics.set("drill_tools", len(layer.tools))
+            self._metrics.set("drill_hits", layer.hit_count)
+            self._metrics.event(
+                "drill_layer_read", tools=len(layer.tools), hits=layer.hit_count
+            )
+
+        return self._layers[LayerType.DRILL]
+
+    def get_layer(self, layer_type: LayerType):
+        """Read a single layer without parsing any other layers."""
+        if layer_type == LayerType.DRILL:
+            return self.get_drill_layer()
+
+        if layer_type not in self._layers:
+            import gerber
+
+            with self._metrics.timer(
+                "layer_read_seconds_total", layer=layer_type.value
+            ):
+                self._layers[layer_type] = gerber.read(
+                    self.get_layer_paths()[layer_type]
+                )
+
+        return self._layers[layer_type]
+
+    def get_bounds(self, layer_type: LayerType) -> bounds.LayerBounds:
+        """Find a layer's extent without parsing any other layers."""
+        if layer_type in self._bounds:
+            return self._bounds[layer_type]
+
+        if layer_type == LayerType.DRILL:
+            layer = self.get_drill_layer()
+            self._bounds[layer_type] = bounds.LayerBounds(
+                units=layer.units, bounds=layer.bounds, bounding_box=layer.bounds
+            )
+        elif layer_type in self._layers:
+            layer = self._layers[layer_type]
+            self._bounds[layer_type] = bounds.LayerBounds(
+                units=layer.units,
+                bounds=layer.bounds,
+                bounding_box=layer.bounding_box,
+            )
+        else:
+            with self._metrics.timer(
+                "layer_read_seconds_total", layer=layer_type.value
+            ):
+                self._bounds[layer_type] = bounds.read_bounds(
+                    self.get_layer_paths()[layer_type]
+                )
+
+        return self._bounds[layer_type]
+
+    def get_geometry(self, layer_type: LayerType) -> geometry.LayerGeometry:
+        """Flatten a gerber layer into polygons (in millimeters).
+
+        Apertures are outlined once for the whole project, so layers
+        sharing pad shapes are flattened faster after the first.
+        """
+        if layer_type not in self._geometry:
+            layer = self.get_layer(layer_type)
+            with self._metrics.timer(
+                "layer_flatten_seconds_total", layer=layer_type.value
+            ):
+                self._geometry[layer_type] = self._flattener.flatten(layer)
+
+            self._metrics.set("aperture_templates", self._flattener.template_count)
+            self._metrics.event(
+                "layer_flattened",
+                layer=layer_type.value,
+                polygons=len(self._geometry[layer_type]),
+                templates=self._flattener.template_count,
+            )
+
+        return self._geometry[layer_type]
+
     def get_layers(self):
-        if self._layers:
+        if self._layers_loaded:
             return self._layers
 
+        import gerber
+
         for filename in os.listdir(self._path):
             full_path = os.path.join(
                 self._path,
@@ -54,7 +203,25 @@ class GerberProject(object):
                 continue
 
             try:
-                layer = gerber.read(full_path)
+                layer_type = self.detect_layer_type(filename, None)
+            except UnknownLayerType:
+                layer_type = None
+
+            if layer_type == LayerType.DRILL:
+                if layer_type not in self._layers:
+                    self._layers[layer_type] = excellon.read(full_path)
+                logger.debug("Loaded %s", full_path)
+                continue
+
+            if layer_type in self._layers:
+                continue
+
+            try:
+                with self._metrics.timer(
+                    "layer_read_seconds_total",
+                    layer=layer_type.value if layer_type else "",
+                ):
+                    layer = gerber.read(full_path)
                 layer_type = self.detect_layer_type(filename, layer)
                 self._layers[layer_type] = layer
                 logger.debug("Loaded %s", full_path)
@@ -63,4 +230,5 @@ class GerberProject(object):
             except gerber.common.ParseError:
                 logger.debug("Unable to parse %s; probably not a gerber.", full_path)
 
+        self._layers_loaded = True
         return self._layers
@@ -0,0 +1,374 @@
+"""Correct g-code for copper blanks that aren't perfectly flat.
+
+Isolation routing cuts only a fraction of a millimeter deep, so a blank
+that is a tenth of a millimeter higher at one corner than another will
+be cut too deep in some places and not at all in others.  To correct for
+that, the blank's surface is first probed on a grid (`ProbeGrid` writes
+the program for that), then every move in the generated g-code is split
+into short segments whose depths are offset by the surface height
+interpolated from the probed grid (`HeightMap`).
+
+Programs are rewritten as arrays (see `program.Program`) rather than a
+line at a time; the files being corrected are usually isolation routing
+programs having millions of lines.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import json
+import math
+import os
+import re
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .exceptions import BarbariUserError
+from .program import Program, TextWriter
+
+LEVELED_MARKER = b"(leveled by barbari)"
+
+PROBE_REPORT_PATTERN = re.compile(
+    r"\[PRB:([-+\d.]+),([-+\d.]+),([-+\d.]+)(?:,[-+\d.]+)*:([01])\]"
+)
+
+# Programs are rewritten a chunk of blocks at a time; each chunk holds
+# about this many blocks and segments so memory use stays bounded no
+# matter how finely moves are split.
+CHUNK_SIZE = 500_000
+
+# How far a probed position may be from where the probe grid says it
+# should be (in mm) before we assume a report is for a different point.
+PROBE_POSITION_TOLERANCE = 0.05
+
+
+class LevelingError(BarbariUserError):
+    pass
+
+
+@dataclass
+class ProbeGrid:
+    """Points (in mm) at which to probe the blank's surface."""
+
+    xs: List[float]
+    ys: List[float]
+
+    @classmethod
+    def from_bounds(
+        cls,
+        bounds: Tuple[Tuple[float, float], Tuple[float, float]],
+        spacing: float,
+        margin: float = 0.0,
+    ) -> ProbeGrid:
+        """Cover `bounds` with points at most `spacing` apart."""
+        axes: List[List[float]] = []
+        for low, high in bounds:
+            low, high = low - margin, high + margin
+            count = max(math.ceil((high - low) / spacing), 1) + 1
+            axes.append([float(value) for value in np.linspace(low, high, count)])
+
+        return cls(xs=axes[0], ys=axes[1])
+
+    @classmethod
+    def load(cls, path: str) -> ProbeGrid:
+        with open(path, "r") as inf:
+            data = json.load(inf)
+
+        return cls(xs=data["xs"], ys=data["ys"])
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as outf:
+            json.dump({"xs": self.xs, "ys": self.ys}, outf, indent=2)
+
+    @property
+    def points(self) -> List[Tuple[int, int]]:
+        """Column and row of each point, in the order they are probed.
+
+        Rows are probed alternately left-to-right and right-to-left so
+        the probe never has to travel back across the blank.
+        """
+        order: List[Tuple[int, int]] = []
+        for row in range(len(self.ys)):
+            columns = range(len(self.xs))
+            order.extend(
+                (column, row)
+                for column in (columns if row % 2 == 0 else reversed(columns))
+            )
+
+        return order
+
+    def get_program(
+        self, travel_z: float, probe_depth: float, feed_rate: float
+    ) -> List[str]:
+        """G-code probing each point in turn with `G38.2`.
+
+        Zero Z on the blank's surface at the first point before running
+        this; heights are measured relative to it.
+        """
+        lines = ["G21", "G90", f"G0 Z{travel_z:.3f}"]
+        for column, row in self.points:
+            lines.extend(
+                [
+                    f"G0 X{self.xs[column]:.3f} Y{self.ys[row]:.3f}",
+                    f"G38.2 Z{-probe_depth:.3f} F{feed_rate:g}",
+                    f"G0 Z{travel_z:.3f}",
+                ]
+            )
+        lines.append("M2")
+
+        return [line + "\n" for line in lines]
+
+
+class HeightMap(object):
+    """Surface heights (in mm) probed on a grid; `heights[row][column]`."""
+
+    def __init__(self, xs: Sequence[float], ys: Sequence[float], heights: np.ndarray):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.heights = np.asarray(heights, dtype=np.float64)
+
+        if self.heights.shape != (len(self.ys), len(self.xs)):
+            raise LevelingError("Height map does not match the size of its grid.")
+        if np.any(np.diff(self.xs) <= 0) or np.any(np.diff(self.ys) <= 0):
+            raise LevelingError("Height map grid positions must be increasing.")
+
+        super().__init__()
+
+    @classmethod
+    def from_probe_reports(cls, grid: ProbeGrid, lines: Iterable[str]) -> HeightMap:
+        """Read GRBL's probe reports (`[PRB:x,y,z:1]`) for a probe grid's program.
+
+        GRBL reports positions in machine coordinates, so only the
+        differences between reports are used: heights are relative to
+        the first point probed, and each report's position is checked
+        against the grid's to make sure none were missed.
+        """
+        reports: List[Tuple[float, float, float]] = []
+        for line in lines:
+            for match in PROBE_REPORT_PATTERN.finditer(line):
+                if match.group(4) != "1":
+                    raise LevelingError(
+                        f"Probe #{len(reports) + 1} did not touch the blank."
+                    )
+                reports.append(
+                    (
+                        float(match.group(1)),
+                        float(match.group(2)),
+                        float(match.group(3)),
+                    )
+                )
+
+        points = grid.points
+        if len(reports) != len(points):
+            raise LevelingError(
+                f"Found {len(reports)} probe reports, but the grid has "
+                f"{len(points)} points."
+            )
+
+        heights = np.zeros((len(grid.ys), len(grid.xs)))
+        first_x, first_y, first_z = reports[0]
+        first_column, first_row = points[0]
+        for (column, row), (x, y, z) in zip(points, reports):
+            expected_x = grid.xs[column] - grid.xs[first_column]
+            expected_y = grid.ys[row] - grid.ys[first_row]
+            if (
+                abs(x - first_x - expected_x) > PROBE_POSITION_TOLERANCE
+                or abs(y - first_y - expected_y) > PROBE_POSITION_TOLERANCE
+            ):
+                raise LevelingError(
+                    f"Probe report at ({x}, {y}) does not match its grid "
+                    "position; was it recorded with a different grid?"
+                )
+            heights[row, column] = z - first_z
+
+        return cls(grid.xs, grid.ys, heights)
+
+    @classmethod
+    def from_points(cls, lines: Iterable[str]) -> HeightMap:
+        """Read `x,y,z` rows (comma- or space-separated) covering a grid."""
+        points = []
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                points.append([float(value) for value in re.split(r"[,\s]+", line)[:3]])
+            except ValueError:
+                raise LevelingError(f"Unable to read height map point: {line}")
+
+        if not points:
+            raise LevelingError("No height map points were found.")
+
+        data = np.array(points, dtype=np.float64).reshape(-1, 3)
+        xs, columns = np.unique(np.round(data[:, 0], 3), return_inverse=True)
+        ys, rows = np.unique(np.round(data[:, 1], 3), return_inverse=True)
+        if len(xs) * len(ys) != len(data):
+            raise LevelingError("Height map points do not form a complete grid.")
+
+        heights = np.full((len(ys), len(xs)), np.nan)
+        heights[rows, columns] = data[:, 2]
+        if np.isnan(heights).any():
+            raise LevelingError("Height map points do not form a complete grid.")
+
+        return cls(xs, ys, heights)
+
+    @classmethod
+    def read(cls, path: str, grid: Optional[ProbeGrid] = None) -> HeightMap:
+        """Read probe reports (if `grid` is given) or `x,y,z` points from a file."""
+        with open(path, "r") as inf:
+            lines = inf.readlines()
+
+        if grid is not None and any(
+            PROBE_REPORT_PATTERN.search(line) for line in lines
+        ):
+            return cls.from_probe_reports(grid, lines)
+
+        return cls.from_points(lines)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as outf:
+            for row, y in enumerate(self.ys):
+                for column, x in enumerate(self.xs):
+                    outf.write(f"{x:.3f},{y:.3f},{self.heights[row, column]:.4f}\n")
+
+    def get_heights(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Bilinearly interpolate heights; points off the grid use its edge."""
+        x = np.clip(x, self.xs[0], self.xs[-1])
+        y = np.clip(y, self.ys[0], self.ys[-1])
+
+        if len(self.xs) > 1:
+            column = np.clip(
+                np.searchsorted(self.xs, x, side="right") - 1, 0, len(self.xs) - 2
+            )
+            tx = (x - self.xs[column]) / (self.xs[column + 1] - self.xs[column])
+        else:
+            column = np.zeros(len(x), dtype=np.intp)
+            tx = np.zeros(len(x))
+        if len(self.ys) > 1:
+            row = np.clip(
+                np.searchsorted(self.ys, y, side="right") - 1, 0, len(self.ys) - 2
+            )
+            ty = (y - self.ys[row]) / (self.ys[row + 1] - self.ys[row])
+        else:
+            row = np.zeros(len(y), dtype=np.intp)
+            ty = np.zeros(len(y))
+
+        next_column = np.minimum(column + 1, len(self.xs) - 1)
+        next_row = np.minimum(row + 1, len(self.ys) - 1)
+        heights = self.heights
+
+        return (
+            heights[row, column] * (1 - tx) * (1 - ty)
+            + heights[row, next_column] * tx * (1 - ty)
+            + heights[next_row, column] * (1 - tx) * ty
+            + heights[next_row, next_column] * tx * ty
+        )
+
+
+def level_program(
+    data: bytes,
+    height_map: HeightMap,
+    segment_length: float = 1.0,
+    decimals: int = 3,
+) -> Iterator[bytes]:
+    """Offset every move's depth by the height of the surface beneath it.
+
+    Feed moves longer than `segment_length` (in mm) are split so that
+    each segment follows the surface; rapid moves only have their end
+    point corrected.  The program must use absolute positioning and
+    linear moves; arcs can't follow a non-flat surface.
+
+    Comments are dropped, and unchanged words omitted, as
+    `gcode.compact_file` would.  The leveled program is returned in
+    chunks.
+    """
+    program = Program.parse(data)
+    blocks = program.blocks
+    moves = blocks["move"]
+    if (moves & (blocks["motion"] >= 2)).any():
+        raise LevelingError("Programs having arcs (G2/G3) cannot be leveled.")
+
+    end = np.stack([blocks["x"], blocks["y"], blocks["z"]], axis=1)
+    begin = np.full_like(end, np.nan)
+    begin[1:] = end[:-1]
+    # Moves whose end isn't known (e.g. after homing) are left alone.
+    leveled = moves & ~np.isnan(end).any(axis=1)
+    lengths = np.hypot(end[:, 0] - begin[:, 0], end[:, 1] - begin[:, 1])
+    splittable = leveled & (blocks["motion"] == 1) & ~np.isnan(lengths)
+    counts = np.ones(len(blocks), dtype=np.intp)
+    counts[splittable] = np.maximum(
+        np.ceil(lengths[splittable] / segment_length), 1
+    ).astype(np.intp)
+    begin = np.where(np.isnan(begin), end, begin)
+
+    yield LEVELED_MARKER + b"\n"
+
+    totals = np.cumsum(counts)
+    bounds = np.unique(
+        np.concatenate(
+            [
+                [0],
+                np.searchsorted(
+                    totals, np.arange(CHUNK_SIZE, totals[-1], CHUNK_SIZE), side="right"
+                ),
+                [len(blocks)],
+            ]
+        )
+    )
+    writer = TextWriter(decimals)
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        chunk_counts = counts[start:stop]
+        piece = program[start:stop].repeat(chunk_counts)
+
+        # Each segment's fraction of the way along its move.
+        firsts = np.cumsum(chunk_counts) - chunk_counts
+        step = np.arange(len(piece)) - np.repeat(firsts, chunk_counts) + 1
+        fraction = (step / np.repeat(chunk_counts, chunk_counts))[:, None]
+        chunk_begin = np.repeat(begin[start:stop], chunk_counts, axis=0)
+        points = (
+            chunk_begin
+            + (np.repeat(end[start:stop], chunk_counts, axis=0) - chunk_begin)
+            * fraction
+        )
+
+        segments = np.repeat(leveled[start:stop], chunk_counts)
+        points = points[segments]
+        for index, axis in enumerate("xyz"):
+            piece.blocks[axis][segments] = points[:, index]
+        piece.blocks["z"][segments] += height_map.get_heights(
+            points[:, 0], points[:, 1]
+        )
+
+        yield writer.write(piece)
+
+
+def is_leveled(path: str) -> bool:
+    with open(path, "rb") as inf:
+        return inf.readline().strip() == LEVELED_MARKER
+
+
+def level_file(
+    path: str,
+    height_map: HeightMap,
+    segment_length: float = 1.0,
+    decimals: int = 3,
+) -> Tuple[int, int]:
+    """Level a g-code file in place; returns its line count before and after."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(path, "rb") as inf:
+        data = inf.read()
+
+    lines = 0
+    try:
+        with open(temp_path, "wb") as outf:
+            for chunk in level_program(data, height_map, segment_length, decimals):
+                outf.write(chunk)
+                lines += chunk.count(b"\n")
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+    return data.count(b"\n"), lines
@@ -2,21 +2,31 @@ import argparse
 import logging
 import sys
 
-from rich.console import Console
-from rich.logging import RichHandler
-from rich.traceback import install as enable_rich_traceback
-
 from . import exceptions
-from .commands import get_installed_commands
+from .commands import get_installed_commands, load_command
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_command_name(argv) -> str:
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+
+    return ""
+
+
 def main(*args):
-    enable_rich_traceback()
+    argv = list(args) or sys.argv[1:]
 
     commands = get_installed_commands()
+    command_name = get_command_name(argv)
+    if command_name and command_name not in commands:
+        # Installing a command in development mode only rewrites its
+        # distribution's metadata, which the cached index can't notice;
+        # look again before argparse rejects it.
+        commands = get_installed_commands(refresh=True)
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", default=False, action="store_true")
@@ -24,17 +34,27 @@ def main(*args):
     subparsers = parser.add_subparsers(dest="command")
     subparsers.required = True
 
-    for cmd_name, cmd_class in commands.items():
+    # Only the command actually being run is imported; its arguments
+    # are only needed when that subcommand is the one being parsed.
+    cmd_class = None
+    for cmd_name, cmd_entry in commands.items():
         parser_kwargs = {}
 
-        cmd_help = cmd_class.get_help()
-        if cmd_help:
-            parser_kwargs["help"] = cmd_help
+        if cmd_entry.help:
+            parser_kwargs["help"] = cmd_entry.help
 
         subparser = subparsers.add_parser(cmd_name, **parser_kwargs)
-        cmd_class._add_arguments(subparser)
+        if cmd_name == command_name:
+            cmd_class = load_command(cmd_entry)
+            cmd_class._add_arguments(subparser)
+
+    args = parser.parse_args(argv)
 
-    args = parser.parse_args()
+    from rich.console import Console
+    from rich.logging import RichHandler
+    from rich.traceback import install as enable_rich_traceback
+
+    enable_rich_traceback()
 
     logging.basicConfig(
         format="%(message)s",
@@ -52,7 +72,7 @@ def main(*args):
     console = Console()
 
     try:
-        commands[args.command](args).handle()
+        cmd_class(args).handle()
     except exceptions.BarbariError as e:
         console.print(f"[red]{e}[/red]")
     except exceptions.BarbariUserError as e:
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+METRIC_PREFIX = "barbari_"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _get_label_set(labels: Dict[str, Any]) -> LabelSet:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: LabelSet, value: float) -> str:
+    label_text = ""
+    if labels:
+        label_text = (
+            "{"
+            + ",".join(f'{key}="{_escape_label_value(val)}"' for key, val in labels)
+            + "}"
+        )
+
+    return f"{METRIC_PREFIX}{name}{label_text} {float(value)!r}"
+
+
+class Metrics(object):
+    """Counters, gauges and events collected while building a project.
+
+    Counters (whose names should end in `_total`) only ever increase;
+    gauges hold the last value set.  `labels` are added to every sample
+    and event recorded, and so should identify the build -- e.g. the
+    project's directory.  Recording is thread-safe.
+    """
+
+    def __init__(self, **labels: Any):
+        self._labels = {key: str(value) for key, value in labels.items()}
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._gauges: Dict[Tuple[str, LabelSet], float] = {}
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return self._labels
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        return self._events
+
+    def _get_key(self, name: str, labels: Dict[str, Any]) -> Tuple[str, LabelSet]:
+        return name, _get_label_set({**self._labels, **labels})
+
+    def increment(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = self._get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._gauges[self._get_key(name, labels)] = value
+
+    def get(self, name: str, **labels: Any) -> float:
+        key = self._get_key(name, labels)
+
+        return self._counters.get(key, self._gauges.get(key, 0))
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Add the time spent within this block to the `name` counter."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.increment(name, time.monotonic() - started, **labels)
+
+    @contextlib.contextmanager
+    def record_build(self) -> Iterator[None]:
+        """Record whether the build within this block succeeded, and its duration."""
+        started = time.monotonic()
+        result = "failure"
+        self.event("build_started")
+
+        try:
+            yield
+            result = "success"
+        finally:
+            duration = time.monotonic() - started
+            self.increment("builds_total", result=result)
+            self.set("build_duration_seconds", duration)
+            self.set("build_timestamp_seconds", time.time())
+            self.event("build_finished", result=result, duration=duration)
+
+    def event(self, name: str, **fields: Any) -> None:
+        with self._lock:
+            self._events.append(
+                {"time": time.time(), "event": name, **self._labels, **fields}
+            )
+
+    def get_samples(self) -> Iterator[Tuple[str, str, LabelSet, float]]:
+        """Yield each sample's name, type, labels and value."""
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                yield name, "counter", labels, value
+            for (name, labels), value in self._gauges.items():
+                yield name, "gauge", labels, value
+
+
+def format_textfile(recorders: Iterable[Metrics]) -> str:
+    """Format samples in the Prometheus text exposition format."""
+    families: Dict[str, Tuple[str, List[str]]] = {}
+
+    for recorder in recorders:
+        for name, metric_type, labels, value in recorder.get_samples():
+            _, samples = families.setdefault(name, (metric_type, []))
+            samples.append(_format_sample(name, labels, value))
+
+    lines: List[str] = []
+    for name, (metric_type, samples) in sorted(families.items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+        lines.extend(sorted(samples))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str, recorders: Iterable[Metrics]) -> None:
+    """Write a file for node_exporter's textfile collector.
+
+    The collector may read the file at any moment, so it is replaced
+    atomically rather than rewritten in place.
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(temp_path, "w") as outf:
+        outf.write(format_textfile(recorders))
+    os.replace(temp_path, path)
+
+
+def write_event_log(path: str, recorders: Iterable[Metrics]) -> None:
+    """Append every recorded event to a JSON-lines log, oldest first."""
+    path = os.path.abspath(os.path.expanduser(path))
+    events = sorted(
+        (event for recorder in recorders for event in recorder.events),
+        key=lambda event: event["time"],
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as outf:
+        for event in events:
+            outf.write(json.dumps(event, default=str))
+            outf.write("\n")
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import math
+from typing import List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PackedRectangle:
+    index: int
+    x: float
+    y: float
+    rotated: bool
+
+
+@dataclass
+class _FreeRectangle:
+    x: float
+    y: float
+    width: float
+    height: float
+
+    def contains(self, other: _FreeRectangle) -> bool:
+        return (
+            self.x <= other.x
+            and self.y <= other.y
+            and other.x + other.width <= self.x + self.width
+            and other.y + other.height <= self.y + self.height
+        )
+
+    def split(
+        self, x: float, y: float, width: float, height: float
+    ) -> List[_FreeRectangle]:
+        """Return the parts of this rectangle not covered by the given one."""
+        if (
+            x >= self.x + self.width
+            or x + width <= self.x
+            or y >= self.y + self.height
+            or y + height <= self.y
+        ):
+            return [self]
+
+        parts: List[_FreeRectangle] = []
+        if x > self.x:
+            parts.append(_FreeRectangle(self.x, self.y, x - self.x, self.height))
+        if x + width < self.x + self.width:
+            parts.append(
+                _FreeRectangle(
+                    x + width, self.y, self.x + self.width - (x + width), self.height
+                )
+            )
+        if y > self.y:
+            parts.append(_FreeRectangle(self.x, self.y, self.width, y - self.y))
+        if y + height < self.y + self.height:
+            parts.append(
+                _FreeRectangle(
+                    self.x, y + height, self.width, self.y + self.height - (y + height)
+                )
+            )
+
+        return parts
+
+
+def pack_rectangles(
+    sizes: Sequence[Tuple[float, float]],
+    width: float,
+    height: float,
+    spacing: float = 0,
+    rotation: bool = True,
+) -> List[Optional[PackedRectangle]]:
+    """Place rectangles of the given sizes within a `width`x`height` area.
+
+    Uses the MaxRects algorithm with the "best short side fit" heuristic,
+    placing the largest rectangles first.  Returns one entry per size, in
+    the order given; rectangles that could not be placed are `None`.
+    """
+    # Every rectangle is padded by `spacing` on its top and right edges;
+    # growing the area by the same amount lets rectangles sit flush
+    # against its far edges.
+    free = [_FreeRectangle(0, 0, width + spacing, height + spacing)]
+    placed: List[Optional[PackedRectangle]] = [None] * len(sizes)
+
+    order = sorted(
+        range(len(sizes)),
+        key=lambda idx: (sizes[idx][0] * sizes[idx][1], max(sizes[idx])),
+        reverse=True,
+    )
+    for idx in order:
+        best: Optional[Tuple[Tuple[float, float], _FreeRectangle, bool]] = None
+        best_score = (math.inf, math.inf)
+
+        for rotated in (False, True) if rotation else (False,):
+            rect_width, rect_height = sizes[idx][::-1] if rotated else sizes[idx]
+            rect_width += spacing
+            rect_height += spacing
+
+            for candidate in free:
+                if rect_width > candidate.width or rect_height > candidate.height:
+                    continue
+
+                leftover_x = candidate.width - rect_width
+                leftover_y = candidate.height - rect_height
+                score = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+                if score < best_score:
+                    best_score = score
+                    best = ((rect_width, rect_height), candidate, rotated)
+
+        if best is None:
+            logger.debug("Unable to fit rectangle %s (%s)", idx, sizes[idx])
+            continue
+
+        (rect_width, rect_height), target, rotated = best
+        placed[idx] = PackedRectangle(
+            index=idx, x=target.x, y=target.y, rotated=rotated
+        )
+
+        split: List[_FreeRectangle] = []
+        for candidate in free:
+            split.extend(candidate.split(target.x, target.y, rect_width, rect_height))
+        free = [
+            candidate
+            for candidate_idx, candidate in enumerate(split)
+            if not any(
+                other_idx != candidate_idx
+                and other.contains(candidate)
+                and (other != candidate or other_idx < candidate_idx)
+                for other_idx, other in enumerate(split)
+            )
+        ]
+
+    return placed
+
+
+def order_by_travel(
+    points: Sequence[Tuple[float, float]], start: Tuple[float, float] = (0, 0)
+) -> List[int]:
+    """Return the indexes of `points` in nearest-neighbour order from `start`."""
+    remaining = list(range(len(points)))
+    ordered: List[int] = []
+    position = start
+
+    while remaining:
+        nearest = min(
+            remaining,
+            key=lambda idx: math.hypot(
+                points[idx][0] - position[0], points[idx][1] - position[1]
+            ),
+        )
+        remaining.remove(nearest)
+        ordered.append(nearest)
+        position = points[nearest]
+
+    return ordered
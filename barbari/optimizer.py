@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import functools
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .flatcam import FlatcamProcess, FlatcamWriteGcode
+
+logger = logging.getLogger(__name__)
+
+
+GEOMETRY_DIAS_PARAMS = {
+    "milldrills": "milled_dias",
+    "millslots": "milled_dias",
+    "drillcncjob": "drilled_dias",
+}
+
+# Commands that load a file rather than reading an existing layer
+OPEN_COMMANDS = {"open_gerber", "open_excellon"}
+
+# Commands that write a layer named after their input rather than
+# accepting an `outname` parameter.
+IMPLICIT_OUTPUT_SUFFIXES = {
+    "aligndrill": "_aligndrill",
+    "cutout": "_cutout",
+}
+
+# Commands that modify their input layer in-place.
+IN_PLACE_COMMANDS = {"mirror"}
+
+# Parameters naming a layer that is read by the command.
+LAYER_PARAMS = {"box"}
+
+# G-code files that must be run before or after all others; alignment
+# holes are what allow the board to be flipped, and once the board is
+# cut out, it can no longer be milled.
+SEQUENCE_FIRST = {"alignment_holes"}
+SEQUENCE_LAST = {"edge_cuts"}
+
+# Names of g-code files milling the back of the board.
+BACK_SIDE_PREFIXES = ("b_cu",)
+
+# Beyond this many files, sequence greedily rather than exhaustively.
+MAX_EXHAUSTIVE_SEQUENCE = 14
+
+
+def get_layer_usage(process: FlatcamProcess) -> Tuple[Set[str], Set[str], bool]:
+    """Return the layers read and written by a process.
+
+    The final element is `True` if the process has effects beyond the
+    layers it writes (e.g. writing a file) and must always be kept.
+    """
+    if process.cmd in OPEN_COMMANDS:
+        return set(), {process.params["outname"]}, False
+    elif process.cmd == "write_gcode":
+        return {process.args[0]}, set(), True
+    elif process.cmd in IN_PLACE_COMMANDS:
+        inputs = {process.args[0]}
+        inputs.update(
+            str(value) for key, value in process.params.items() if key in LAYER_PARAMS
+        )
+        return inputs, {process.args[0]}, False
+    elif process.cmd in IMPLICIT_OUTPUT_SUFFIXES:
+        return (
+            {process.args[0]},
+            {process.args[0] + IMPLICIT_OUTPUT_SUFFIXES[process.cmd]},
+            False,
+        )
+    elif process.cmd == "join_geometries":
+        return set(process.args[1:]), {process.args[0]}, False
+    elif process.args and "outname" in process.params:
+        return {process.args[0]}, {process.params["outname"]}, False
+
+    return set(), set(), True
+
+
+def drop_unused_layers(processes: List[FlatcamProcess]) -> List[FlatcamProcess]:
+    live: Set[str] = set()
+    kept: List[FlatcamProcess] = []
+
+    for process in reversed(processes):
+        inputs, outputs, side_effects = get_layer_usage(process)
+
+        if not side_effects and not (outputs & live):
+            logger.info("Dropping unused flatcam step: %s", process)
+            continue
+
+        live -= outputs
+        live |= inputs
+        kept.append(process)
+
+    kept.reverse()
+    return kept
+
+
+def _split_dias(value: str) -> List[str]:
+    return [dia for dia in str(value).split(",") if dia]
+
+
+class GcodeChain(object):
+    """The geometry, cncjob, and write_gcode steps producing one g-code file."""
+
+    def __init__(
+        self,
+        geometries: List[FlatcamProcess],
+        cncjob: Optional[FlatcamProcess],
+        write: FlatcamWriteGcode,
+    ):
+        self.geometries = geometries
+        self.cncjob = cncjob
+        self.write = write
+        self.names = [write.name]
+        self.members = [*geometries, *([cncjob] if cncjob else []), write]
+
+    def _get_geometry_key(self, process: FlatcamProcess) -> Tuple:
+        dias_param = GEOMETRY_DIAS_PARAMS[process.cmd]
+
+        return (
+            process.cmd,
+            process.args,
+            tuple(
+                (key, str(value))
+                for key, value in process.params.items()
+                if key not in (dias_param, "outname")
+            ),
+        )
+
+    def _get_cncjob_key(self) -> Optional[Tuple]:
+        if not self.cncjob:
+            return None
+
+        return tuple(
+            (key, str(value))
+            for key, value in self.cncjob.params.items()
+            if key != "outname"
+        )
+
+    def can_absorb(self, other: GcodeChain) -> bool:
+        # Chains may read different layers (e.g. alignment holes and the
+        # drill file); only the tool and how it cuts need to match.
+        if (
+            self._get_cncjob_key() != other._get_cncjob_key()
+            or self.write.tool_name != other.write.tool_name
+            or str(self.write.tool_size) != str(other.write.tool_size)
+        ):
+            return False
+
+        if self.cncjob:
+            # Differing geometry can be joined before generating the
+            # tool path...
+            return True
+
+        # ...but drilling jobs generate their tool path directly, so
+        # they can only be merged if their parameters are identical.
+        own_keys = {self._get_geometry_key(geometry) for geometry in self.geometries}
+        return all(
+            self._get_geometry_key(geometry) in own_keys
+            for geometry in other.geometries
+        )
+
+    def absorb(self, other: GcodeChain) -> None:
+        for geometry in other.geometries:
+            key = self._get_geometry_key(geometry)
+            dias_param = GEOMETRY_DIAS_PARAMS[geometry.cmd]
+
+            for idx, existing in enumerate(self.geometries):
+                if self._get_geometry_key(existing) == key:
+                    dias = _split_dias(existing.params[dias_param])
+                    for dia in _split_dias(geometry.params[dias_param]):
+                        if dia not in dias:
+                            dias.append(dia)
+                    self.geometries[idx] = existing.replace(
+                        **{dias_param: ",".join(dias)}
+                    )
+                    break
+            else:
+                self.geometries.append(geometry)
+
+        for name in other.names:
+            if name not in self.names:
+                self.names.append(name)
+
+    def get_processes(self, counter: int) -> Iterable[FlatcamProcess]:
+        yield from self.geometries
+
+        if self.cncjob:
+            if len(self.geometries) > 1:
+                joined = self.cncjob.args[0] + "_joined"
+                yield FlatcamProcess(
+                    "join_geometries",
+                    joined,
+                    *[geometry.params["outname"] for geometry in self.geometries],
+                )
+                yield self.cncjob.replace(joined)
+            else:
+                yield self.cncjob
+
+        yield self.write.renumber(counter, "+".join(self.names))
+
+
+def find_gcode_chains(processes: List[FlatcamProcess]) -> List[GcodeChain]:
+    producers: Dict[str, FlatcamProcess] = {}
+    consumers: Dict[str, int] = {}
+    for process in processes:
+        inputs, outputs, _ = get_layer_usage(process)
+        for layer in inputs:
+            consumers[layer] = consumers.get(layer, 0) + 1
+        for layer in outputs:
+            producers[layer] = process
+
+    chains: List[GcodeChain] = []
+    for process in processes:
+        if not isinstance(process, FlatcamWriteGcode):
+            continue
+
+        producer = producers.get(process.layer)
+        if producer is None or consumers.get(process.layer) != 1:
+            continue
+
+        if producer.cmd == "drillcncjob":
+            chains.append(GcodeChain([producer], None, process))
+        elif producer.cmd == "cncjob":
+            geometry = producers.get(producer.args[0])
+            if (
+                geometry is not None
+                and geometry.cmd in GEOMETRY_DIAS_PARAMS
+                and geometry.cmd != "drillcncjob"
+                and consumers.get(producer.args[0]) == 1
+            ):
+                chains.append(GcodeChain([geometry], producer, process))
+
+    return chains
+
+
+def merge_gcode_chains(processes: List[FlatcamProcess]) -> List[FlatcamProcess]:
+    chains = find_gcode_chains(processes)
+
+    # A chain merged into an earlier one runs at that one's place in
+    # the script, so every layer it reads must be complete by then.
+    positions = {id(process): idx for idx, process in enumerate(processes)}
+    last_written: Dict[str, int] = {}
+    for idx, process in enumerate(processes):
+        for layer in get_layer_usage(process)[1]:
+            last_written[layer] = idx
+
+    def is_ready(chain: GcodeChain, root: GcodeChain) -> bool:
+        start = positions[id(root.members[0])]
+        return all(
+            last_written.get(geometry.args[0], -1) < start
+            for geometry in chain.geometries
+        )
+
+    roots: List[GcodeChain] = []
+    root_for: Dict[int, int] = {}
+    for idx, chain in enumerate(chains):
+        # Profiles with multiple specs (e.g. drilling a pilot hole
+        # before enlarging it) must keep their order; only merge into
+        # a file that runs no earlier than this profile's prior steps.
+        earliest = max(
+            (
+                root_for[prior_idx]
+                for prior_idx, prior in enumerate(chains[:idx])
+                if prior.write.name == chain.write.name
+            ),
+            default=0,
+        )
+        for root_idx in range(earliest, len(roots)):
+            if roots[root_idx].can_absorb(chain) and is_ready(chain, roots[root_idx]):
+                logger.info(
+                    "Merging %s into %s; both use a %s %s.",
+                    chain.write.filename,
+                    roots[root_idx].write.filename,
+                    chain.write.tool_size,
+                    chain.write.tool_name,
+                )
+                roots[root_idx].absorb(chain)
+                root_for[idx] = root_idx
+                break
+        else:
+            root_for[idx] = len(roots)
+            roots.append(chain)
+
+    member_of: Dict[int, int] = {}
+    for idx, chain in enumerate(chains):
+        for member in chain.members:
+            member_of[id(member)] = root_for[idx]
+
+    optimized: List[FlatcamProcess] = []
+    emitted: Set[int] = set()
+    counter = 0
+    for process in processes:
+        root_idx = member_of.get(id(process))
+        if root_idx is None:
+            if isinstance(process, FlatcamWriteGcode):
+                counter += 1
+                process = process.renumber(counter)
+            optimized.append(process)
+        elif root_idx not in emitted:
+            emitted.add(root_idx)
+            counter += 1
+            optimized.extend(roots[root_idx].get_processes(counter))
+
+    return optimized
+
+
+def _get_tool(write: FlatcamWriteGcode) -> Tuple[str, str]:
+    return write.tool_name, str(write.tool_size)
+
+
+def _get_side(write: FlatcamWriteGcode) -> str:
+    return "back" if write.name.startswith(BACK_SIDE_PREFIXES) else "front"
+
+
+def count_setup_changes(writes: Sequence[FlatcamWriteGcode]) -> Tuple[int, int]:
+    """Return the number of tool changes and board flips needed."""
+    tool_changes = 0
+    flips = 0
+    tool: Optional[Tuple[str, str]] = None
+    side = "front"
+
+    for write in writes:
+        if tool is not None and _get_tool(write) != tool:
+            tool_changes += 1
+        if _get_side(write) != side:
+            flips += 1
+        tool = _get_tool(write)
+        side = _get_side(write)
+
+    return tool_changes, flips
+
+
+def _get_predecessors(writes: Sequence[FlatcamWriteGcode]) -> List[int]:
+    """Return a bitmask of the files that must run before each file."""
+    # Merged files are named for every profile they hold.
+    first = [
+        idx
+        for idx, write in enumerate(writes)
+        if SEQUENCE_FIRST & set(write.name.split("+"))
+    ]
+    last = [
+        idx
+        for idx, write in enumerate(writes)
+        if SEQUENCE_LAST & set(write.name.split("+"))
+    ]
+
+    predecessors: List[int] = []
+    for idx, write in enumerate(writes):
+        mask = 0
+        profiles = set(write.name.split("+"))
+        for prior_idx, prior in enumerate(writes[:idx]):
+            # Steps of one profile (or one side's isolation tools) keep
+            # their relative order.
+            if profiles & set(prior.name.split("+")):
+                mask |= 1 << prior_idx
+        if idx not in first:
+            mask |= sum(1 << first_idx for first_idx in first)
+        if idx in last:
+            mask |= sum(
+                1 << other_idx
+                for other_idx in range(len(writes))
+                if other_idx not in last
+            )
+        predecessors.append(mask & ~(1 << idx))
+
+    return predecessors
+
+
+def get_sequence(writes: Sequence[FlatcamWriteGcode]) -> List[int]:
+    """Order g-code files to minimize tool changes and board flips."""
+    predecessors = _get_predecessors(writes)
+    complete = (1 << len(writes)) - 1
+
+    def get_cost(last: int, idx: int) -> int:
+        if last < 0:
+            return int(_get_side(writes[idx]) != "front")
+        return int(_get_tool(writes[last]) != _get_tool(writes[idx])) + int(
+            _get_side(writes[last]) != _get_side(writes[idx])
+        )
+
+    def get_available(done: int) -> List[int]:
+        return [
+            idx
+            for idx in range(len(writes))
+            if not done & (1 << idx) and predecessors[idx] & done == predecessors[idx]
+        ]
+
+    if len(writes) > MAX_EXHAUSTIVE_SEQUENCE:
+        order: List[int] = []
+        done = 0
+        while done != complete:
+            last = order[-1] if order else -1
+            idx = min(get_available(done), key=lambda idx: get_cost(last, idx))
+            order.append(idx)
+            done |= 1 << idx
+        return order
+
+    @functools.lru_cache(maxsize=None)
+    def solve(done: int, last: int) -> Tuple[int, Tuple[int, ...]]:
+        if done == complete:
+            return 0, ()
+
+        best: Optional[Tuple[int, Tuple[int, ...]]] = None
+        for idx in get_available(done):
+            cost, rest = solve(done | (1 << idx), idx)
+            cost += get_cost(last, idx)
+            if best is None or cost < best[0]:
+                best = cost, (idx, *rest)
+
+        assert best is not None, "G-code files have circular dependencies"
+        return best
+
+    return list(solve(0, -1)[1])
+
+
+def sequence_gcode(processes: List[FlatcamProcess]) -> List[FlatcamProcess]:
+    """Renumber g-code files to minimize tool changes and board flips.
+
+    Only the numbers (and so the order in which files are run) change;
+    flatcam still generates them in the same order.
+    """
+    writes = [
+        process for process in processes if isinstance(process, FlatcamWriteGcode)
+    ]
+    order = get_sequence(writes)
+
+    before = count_setup_changes(writes)
+    after = count_setup_changes([writes[idx] for idx in order])
+    if sum(after) >= sum(before):
+        return processes
+
+    logger.info(
+        "Reordered g-code files to save %s tool changes and %s board flips.",
+        before[0] - after[0],
+        before[1] - after[1],
+    )
+
+    counters = {id(writes[idx]): counter for counter, idx in enumerate(order, start=1)}
+    return [
+        (
+            process.renumber(counters[id(process)])
+            if isinstance(process, FlatcamWriteGcode)
+            else process
+        )
+        for process in processes
+    ]
+
+
+def optimize(processes: Iterable[FlatcamProcess]) -> List[FlatcamProcess]:
+    """Eliminate duplicated geometry work from a flatcam process stream.
+
+    Drilling and milling steps using the same tool and parameters on the
+    same layer are merged into a single step covering all of their
+    diameters, milling steps sharing a tool and parameters (whichever
+    layer they mill, e.g. alignment holes and drilled holes) are joined
+    into a single g-code file, and layers that nothing uses are never
+    loaded.  Files
+    are then numbered so as to minimize tool changes and board flips.
+    """
+    optimized = merge_gcode_chains(list(processes))
+    optimized = drop_unused_layers(optimized)
+    optimized = sequence_gcode(optimized)
+
+    return optimized
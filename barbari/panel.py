@@ -0,0 +1,425 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple, Type
+
+from . import gcode, nesting
+from .config import Config
+from .constants import LayerType
+from .exceptions import BarbariUserError
+from .flatcam import FlatcamProcess, FlatcamProjectGenerator
+from .gerbers import GerberProject
+
+logger = logging.getLogger(__name__)
+
+
+GCODE_FILENAME_PATTERN = re.compile(
+    r"^(?P<counter>\d+)\.(?P<name>.+?)\.(?P<tool_size>\d+(?:\.\d+)?)"
+    r"\.(?P<tool_name>[^.]+)\.gcode$"
+)
+
+
+@dataclass
+class PanelPlacement:
+    board: int
+    column: int
+    row: int
+    offset_x: float
+    offset_y: float
+    rotated: bool = False
+
+    @property
+    def transform(self) -> gcode.Transform:
+        return gcode.Transform(self.offset_x, self.offset_y, 1 if self.rotated else 0)
+
+
+class PanelBoardGenerator(FlatcamProjectGenerator):
+    """Generates the per-board toolpaths that are repeated across a panel.
+
+    Alignment holes and the board cutout are generated once for the
+    whole panel by `PanelFrameGenerator`, but the back copper still needs
+    to be mirrored so it lines up once the panel is flipped.
+    """
+
+    def _alignment_holes(self) -> Iterable[FlatcamProcess]:
+        yield from self._mirror()
+
+    def _edge_cuts(self) -> Iterable[FlatcamProcess]:
+        return []
+
+
+class PanelFrameGenerator(FlatcamProjectGenerator):
+    """Generates alignment holes and the cutout around a whole panel."""
+
+    def _mirror(self) -> Iterable[FlatcamProcess]:
+        return []
+
+    def _copper(self) -> Iterable[FlatcamProcess]:
+        return []
+
+    def _drill(self) -> Iterable[FlatcamProcess]:
+        return []
+
+    def _slot(self) -> Iterable[FlatcamProcess]:
+        return []
+
+
+class NestedBoardGenerator(FlatcamProjectGenerator):
+    """Generates toolpaths for a board nested among others on one blank.
+
+    Unlike boards in a panel, each nested board is cut out on its own.
+    """
+
+    def _alignment_holes(self) -> Iterable[FlatcamProcess]:
+        yield from self._mirror()
+
+
+class NestedFrameGenerator(PanelFrameGenerator):
+    """Generates only the alignment holes shared by nested boards."""
+
+    def _edge_cuts(self) -> Iterable[FlatcamProcess]:
+        return []
+
+
+class Panel(object):
+    BOARD_GENERATOR: Type[FlatcamProjectGenerator] = PanelBoardGenerator
+    FRAME_GENERATOR: Type[FlatcamProjectGenerator] = PanelFrameGenerator
+
+    def __init__(
+        self,
+        boards: Sequence[GerberProject],
+        columns: int,
+        rows: int,
+        spacing: float = 0,
+    ):
+        self._boards = list(boards)
+        self._columns = columns
+        self._rows = rows
+        self._spacing = spacing
+
+        super().__init__()
+
+    @property
+    def boards(self) -> List[GerberProject]:
+        return self._boards
+
+    def get_board_bounds(
+        self, board: int
+    ) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        return self._boards[board].get_bounds(LayerType.EDGE_CUTS).bounds
+
+    def get_board_center(self, board: int) -> Tuple[float, float]:
+        (min_x, max_x), (min_y, max_y) = self.get_board_bounds(board)
+
+        return (min_x + max_x) / 2, (min_y + max_y) / 2
+
+    @property
+    def cell_size(self) -> Tuple[float, float]:
+        width = 0.0
+        height = 0.0
+
+        for idx in range(len(self._boards)):
+            (min_x, max_x), (min_y, max_y) = self.get_board_bounds(idx)
+            width = max(width, max_x - min_x)
+            height = max(height, max_y - min_y)
+
+        return width, height
+
+    @property
+    def bounds(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        width, height = self.cell_size
+
+        return (
+            (0.0, (width * self._columns) + (self._spacing * (self._columns - 1))),
+            (0.0, (height * self._rows) + (self._spacing * (self._rows - 1))),
+        )
+
+    @property
+    def placements(self) -> List[PanelPlacement]:
+        width, height = self.cell_size
+        placements: List[PanelPlacement] = []
+
+        for row in range(self._rows):
+            for column in range(self._columns):
+                board = len(placements) % len(self._boards)
+                (min_x, _), (min_y, _) = self.get_board_bounds(board)
+                placements.append(
+                    PanelPlacement(
+                        board=board,
+                        column=column,
+                        row=row,
+                        offset_x=(column * (width + self._spacing)) - min_x,
+                        offset_y=(row * (height + self._spacing)) - min_y,
+                    )
+                )
+
+        return placements
+
+    def get_transforms(
+        self, board: int, mirror_axis: str = ""
+    ) -> List[gcode.Transform]:
+        """Return the transforms with which a board's toolpaths are repeated.
+
+        Toolpaths for the back of the board were mirrored around the
+        center of the board itself, but need to end up mirrored around
+        the center of the panel; mirroring twice cancels out, so what
+        remains is a rotation (in the opposite direction) and a shift.
+        """
+        board_center = self.get_board_center(board)
+        (panel_min_x, panel_max_x), (panel_min_y, panel_max_y) = self.bounds
+        panel_center = (panel_min_x + panel_max_x) / 2, (panel_min_y + panel_max_y) / 2
+
+        def reflect(
+            point: Tuple[float, float], center: Tuple[float, float]
+        ) -> Tuple[float, float]:
+            if mirror_axis.upper() == "X":
+                return point[0], (2 * center[1]) - point[1]
+            elif mirror_axis.upper() == "Y":
+                return (2 * center[0]) - point[0], point[1]
+            return point
+
+        transforms: List[gcode.Transform] = []
+        for placement in self.placements:
+            if placement.board != board:
+                continue
+
+            transform = placement.transform
+            if mirror_axis.upper() in ("X", "Y"):
+                dx, dy = reflect(
+                    transform.apply(*reflect((0.0, 0.0), board_center)), panel_center
+                )
+                transform = gcode.Transform(dx, dy, -transform.quarter_turns)
+
+            transforms.append(transform)
+
+        return transforms
+
+    def write_outline(self, path: str) -> str:
+        """Write an Edge.Cuts gerber covering the panel's bounds."""
+        (min_x, max_x), (min_y, max_y) = self.bounds
+
+        def coord(value: float) -> str:
+            return str(int(round(value * 1000000)))
+
+        os.makedirs(path, exist_ok=True)
+        filename = os.path.join(path, "panel-Edge_Cuts.gm1")
+        with open(filename, "w") as outf:
+            outf.write("%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.100000*%\nG01*\nD10*\n")
+            outf.write(f"X{coord(min_x)}Y{coord(min_y)}D02*\n")
+            for x, y in (
+                (max_x, min_y),
+                (max_x, max_y),
+                (min_x, max_y),
+                (min_x, min_y),
+            ):
+                outf.write(f"X{coord(x)}Y{coord(y)}D01*\n")
+            outf.write("M02*\n")
+
+        return filename
+
+    def get_board_generator(
+        self, board: int, config: Config, output_path: str
+    ) -> FlatcamProjectGenerator:
+        return self.BOARD_GENERATOR(
+            self._boards[board], config, output_path=output_path
+        )
+
+    def get_frame_generator(self, config: Config, path: str) -> FlatcamProjectGenerator:
+        self.write_outline(path)
+
+        return self.FRAME_GENERATOR(GerberProject(path), config, output_path=path)
+
+
+class NestedPanel(Panel):
+    """Boards packed (and possibly rotated) to fit onto one copper blank.
+
+    Boards are placed within `margin` of the blank's edges, leaving room
+    for the alignment holes shared by every board.
+    """
+
+    BOARD_GENERATOR = NestedBoardGenerator
+    FRAME_GENERATOR = NestedFrameGenerator
+
+    def __init__(
+        self,
+        boards: Sequence[GerberProject],
+        copies: Sequence[int],
+        stock_width: float,
+        stock_height: float,
+        margin: float = 0,
+        spacing: float = 0,
+        rotation: bool = True,
+    ):
+        super().__init__(boards, columns=0, rows=0, spacing=spacing)
+
+        self._placements: List[PanelPlacement] = []
+        self._stock = (stock_width, stock_height)
+
+        sizes: List[Tuple[float, float]] = []
+        board_indexes: List[int] = []
+        for board, count in enumerate(copies):
+            (min_x, max_x), (min_y, max_y) = self.get_board_bounds(board)
+            for _ in range(count):
+                sizes.append((max_x - min_x, max_y - min_y))
+                board_indexes.append(board)
+
+        packed = nesting.pack_rectangles(
+            sizes,
+            stock_width - (2 * margin),
+            stock_height - (2 * margin),
+            spacing=spacing,
+            rotation=rotation,
+        )
+        unplaced = [board_indexes[idx] for idx, rect in enumerate(packed) if not rect]
+        if unplaced:
+            raise BarbariUserError(
+                f"Unable to fit {len(unplaced)} of {len(packed)} boards onto "
+                f"a {stock_width}x{stock_height}mm blank: "
+                + ", ".join(sorted({self._boards[idx].path for idx in unplaced}))
+            )
+
+        for rect in packed:
+            assert rect is not None
+            board = board_indexes[rect.index]
+            (min_x, max_x), (min_y, max_y) = self.get_board_bounds(board)
+            x = margin + rect.x
+            y = margin + rect.y
+            self._placements.append(
+                PanelPlacement(
+                    board=board,
+                    column=0,
+                    row=0,
+                    # Rotating a quarter turn counter-clockwise maps the
+                    # board's (min_x, max_y) corner to (-max_y, min_x).
+                    offset_x=(x + max_y) if rect.rotated else (x - min_x),
+                    offset_y=(y - min_x) if rect.rotated else (y - min_y),
+                    rotated=rect.rotated,
+                )
+            )
+
+    @property
+    def stock(self) -> Tuple[float, float]:
+        return self._stock
+
+    @property
+    def placements(self) -> List[PanelPlacement]:
+        return self._placements
+
+    @property
+    def bounds(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        xs: List[float] = []
+        ys: List[float] = []
+
+        for placement in self._placements:
+            (min_x, max_x), (min_y, max_y) = self.get_board_bounds(placement.board)
+            for corner in ((min_x, min_y), (max_x, max_y)):
+                x, y = placement.transform.apply(*corner)
+                xs.append(x)
+                ys.append(y)
+
+        return (min(xs), max(xs)), (min(ys), max(ys))
+
+
+def find_gcode_files(path: str) -> List[str]:
+    return sorted(
+        filename
+        for filename in os.listdir(path)
+        if GCODE_FILENAME_PATTERN.match(filename)
+    )
+
+
+def assemble_panel_gcode(
+    panel: Panel,
+    frame_path: str,
+    board_paths: Dict[int, str],
+    output_path: str,
+    mirror_axis: str = "",
+) -> List[str]:
+    """Combine per-board g-code into one numbered file per operation.
+
+    Each board's toolpaths are repeated at every position that board
+    occupies in the panel; files for different boards performing the
+    same operation with the same tool are combined.
+    """
+    frame_files = {
+        GCODE_FILENAME_PATTERN.match(filename).group("name"): filename
+        for filename in find_gcode_files(frame_path)
+    }
+
+    operations: Dict[Tuple[str, str, str], List[Tuple[int, int, str]]] = {}
+    for board, path in board_paths.items():
+        for filename in find_gcode_files(path):
+            match = GCODE_FILENAME_PATTERN.match(filename)
+            key = (
+                match.group("name"),
+                match.group("tool_size"),
+                match.group("tool_name"),
+            )
+            operations.setdefault(key, []).append(
+                (int(match.group("counter")), board, os.path.join(path, filename))
+            )
+
+    ordered = sorted(operations.items(), key=lambda item: min(item[1])[0])
+
+    written: List[str] = []
+
+    def output_filename(name: str, tool_size: str, tool_name: str) -> str:
+        return os.path.join(
+            output_path,
+            "{counter}.{name}.{tool_size}.{tool_name}.gcode".format(
+                counter=str(len(written) + 1).zfill(2),
+                name=name,
+                tool_size=tool_size,
+                tool_name=tool_name,
+            ),
+        )
+
+    def copy_frame_file(name: str) -> None:
+        if name not in frame_files:
+            return
+
+        match = GCODE_FILENAME_PATTERN.match(frame_files[name])
+        filename = output_filename(
+            name, match.group("tool_size"), match.group("tool_name")
+        )
+        with open(os.path.join(frame_path, frame_files[name]), "r") as inf:
+            with open(filename, "w") as outf:
+                outf.writelines(inf)
+        written.append(filename)
+
+    copy_frame_file("alignment_holes")
+
+    position: Tuple[float, float] = (0.0, 0.0)
+    for (name, tool_size, tool_name), sources in ordered:
+        filename = output_filename(name, tool_size, tool_name)
+        back = name.startswith("b_cu")
+
+        copies: List[Tuple[Tuple[float, float], List[str], gcode.Transform]] = []
+        for _, board, source in sorted(sources):
+            with open(source, "r") as inf:
+                lines = inf.readlines()
+
+            transforms = panel.get_transforms(board, mirror_axis if back else "")
+            logger.debug("Repeating %s at %s positions.", source, len(transforms))
+            center = panel.get_board_center(board)
+            for transform in transforms:
+                copies.append((transform.apply(*center), lines, transform))
+
+        # Visit each copy in turn starting from wherever the previous
+        # operation finished to keep travel moves short.
+        order = nesting.order_by_travel([copy[0] for copy in copies], position)
+        programs = [(copies[idx][1], [copies[idx][2]]) for idx in order]
+        if order:
+            position = copies[order[-1]][0]
+
+        with open(filename, "w") as outf:
+            outf.writelines(gcode.replicate_programs(programs))
+
+        written.append(filename)
+
+    copy_frame_file("edge_cuts")
+
+    return written
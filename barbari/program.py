@@ -0,0 +1,596 @@
+"""G-code programs parsed once into arrays, for analyzing and rewriting.
+
+A `Program` holds one row (a block) per line of g-code, with the
+modal state in effect after it -- motion mode, position, feed rate and
+tool -- in columns of a numpy structured array.  Positions are absolute
+and in mm, whatever units the program was written in, so checking,
+measuring or transforming a program is a matter of array operations
+rather than interpreting it a line at a time.
+
+Only the words of blocks that move the tool (G0-G3 and their axis, arc
+center and feed words) are held in columns; every other word is kept as
+text and written back out as-is.  Programs are written back to g-code a
+chunk of blocks at a time (see `TextWriter`), so a transform can work
+through even a very large program without holding all of its output in
+memory.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from .exceptions import InvalidGcode
+from .gcode import fill_forward, MM_PER_INCH, MOTION_CODES, WordArrays
+
+BLOCK_DTYPE = np.dtype(
+    [
+        # Zero-based line in the source; -1 for blocks a transform added.
+        ("line", np.int64),
+        # Motion mode in effect (0-3 for G0-G3); -1 when there is none
+        # (before the first, or after probing or a canned cycle).
+        ("motion", np.int8),
+        # Whether the block moves the tool (to x, y, z).
+        ("move", np.bool_),
+        # Whether the block is in inches (G20); columns are always in mm.
+        ("inches", np.bool_),
+        # Position after the block; NaN while unknown (e.g. after homing).
+        ("x", np.float64),
+        ("y", np.float64),
+        ("z", np.float64),
+        # Arc center, relative to the start of the move; NaN unless an arc.
+        ("i", np.float64),
+        ("j", np.float64),
+        # Feed rate in mm/min; NaN before the first.
+        ("feed", np.float64),
+        # Last tool selected (T word); -1 before the first.
+        ("tool", np.int32),
+        # Seconds to pause for (G4 P); zero for every other block.
+        ("dwell", np.float64),
+        # Where the block's other words are in `Program.text`.
+        ("text_start", np.int64),
+        ("text_length", np.int32),
+    ]
+)
+
+# G-codes ending the G0-G3 motion mode: probing, and canned cycles.
+MOTION_CANCEL_CODES = {
+    73.0,
+    76.0,
+    80.0,
+    81.0,
+    82.0,
+    83.0,
+    84.0,
+    85.0,
+    86.0,
+    87.0,
+    88.0,
+    89.0,
+}
+# G-codes after which the tool's position is no longer known: setting
+# offsets, homing and moving in machine coordinates.
+POSITION_RESET_CODES = {10.0, 28.0, 30.0, 53.0, 92.0}
+
+# Digits kept to the left of the decimal point when writing coordinates.
+INTEGER_DIGITS = 6
+# Blocks written to text at once by `Program.iter_text`.
+CHUNK_SIZE = 1_000_000
+
+
+def _pack(text: str) -> np.ndarray:
+    """Pack every four bytes of `text` into a 32-bit integer."""
+    return np.frombuffer(text.encode(), dtype=np.uint32)
+
+
+def _pack_groups(strip: str) -> np.ndarray:
+    """Every three-digit group's bytes, packed into 32-bit integers.
+
+    Stripped zeros are left as zero bytes; the ones digit of a group
+    with its leading zeros stripped is always kept.
+    """
+    groups = []
+    for value in range(1000):
+        text = f"{value:03}"
+        if strip == "leading":
+            text = (text.lstrip("0") or "0").rjust(3, "\0")
+        elif strip == "trailing":
+            text = text.rstrip("0").ljust(3, "\0")
+        groups.append(text.encode() + b"\0")
+
+    return np.frombuffer(b"".join(groups), dtype=np.uint32)
+
+
+# Three-digit groups, for writing numbers.
+_GROUPS = _pack_groups("")
+_GROUPS_LEADING = _pack_groups("leading")
+_GROUPS_TRAILING = _pack_groups("trailing")
+_OWNED_LETTERS = np.frombuffer(b"XYZF", dtype=np.uint8)
+_ARC_LETTERS = np.frombuffer(b"IJ", dtype=np.uint8)
+
+
+def _gather_runs(
+    data: np.ndarray, starts: np.ndarray, lengths: np.ndarray
+) -> np.ndarray:
+    """Concatenate `data[start:start + length]` for each run."""
+    total = int(lengths.sum())
+    within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return data[np.repeat(starts, lengths) + within]
+
+
+def _get_line_values(words: WordArrays, letters: str) -> np.ndarray:
+    """Like `WordArrays.get_line_values`, for several letters at once."""
+    lookup = np.full(256, len(letters), dtype=np.intp)
+    lookup[np.frombuffer(letters.encode(), dtype=np.uint8)] = np.arange(len(letters))
+    rows = lookup[words.letters]
+    found = rows < len(letters)
+
+    values = np.full((len(letters), words.line_count), np.nan)
+    values[rows[found], words.lines[found]] = words.values[found]
+
+    return values
+
+
+def _format_words(
+    letter: str,
+    rounded: np.ndarray,
+    written: np.ndarray,
+    pad: np.ndarray,
+    max_places: int,
+    first: np.ndarray,
+) -> List[np.ndarray]:
+    """Write a word (` X1.25`) for each value, four bytes at a time.
+
+    Values are given `rounded` to a whole number of their last place,
+    and are multiplied by `pad` to have `max_places` places.  Returns
+    columns of 32-bit integers, each packing up to four bytes of every
+    value's word; values not `written`, and each number's leading and
+    trailing zeros, are left as zero bytes.  A zero byte never appears
+    in g-code, so these are dropped once a block's words are assembled.
+    Words are written with a leading space, except those `first` on
+    their line.
+    """
+    scaled = np.where(written, np.abs(rounded), 0).astype(np.int64) * pad
+    whole, fraction = np.divmod(scaled, 10**max_places)
+    too_large = whole >= 10**INTEGER_DIGITS
+    if too_large.any():
+        index = np.argmax(too_large)
+        value = (
+            rounded[index] * np.broadcast_to(pad, rounded.shape)[index] / 10**max_places
+        )
+        raise InvalidGcode(f"Unable to write {letter}{float(value)}; it is too large.")
+
+    prefixes = _pack(f" {letter}\0\0 {letter}-\0\0{letter}\0\0\0{letter}-\0\0\0\0\0")
+    # Digits are written in groups of three, each looked up with or
+    # without its leading (or trailing) zeros as needed.  Values not
+    # written are zero, which only leaves their prefix and ones digit to
+    # be cleared.
+    high, low = np.divmod(whole, 1000)
+    large = high > 0
+    columns = [
+        prefixes[np.where(written, (rounded < 0) + 2 * first, 4)],
+        np.where(large, _GROUPS_LEADING[high], 0),
+        np.where(written, np.where(large, _GROUPS[low], _GROUPS_LEADING[low]), 0)
+        | np.where(fraction != 0, _pack("\0\0\0."), 0),
+    ]
+    fraction_groups = -(-max_places // 3)
+    fraction = fraction * 10 ** (3 * fraction_groups - max_places)
+    rest = np.zeros(len(rounded), dtype=np.int64)
+    for group in range(fraction_groups):
+        value = fraction // 10 ** (3 * group) % 1000
+        columns.insert(3, np.where(rest == 0, _GROUPS_TRAILING[value], _GROUPS[value]))
+        rest += value
+
+    return columns
+
+
+@dataclass
+class ToolpathStats:
+    cut_length: float = 0.0
+    rapid_length: float = 0.0
+    plunges: int = 0
+    duration: float = 0.0
+
+    def __add__(self, other: ToolpathStats) -> ToolpathStats:
+        return ToolpathStats(
+            cut_length=self.cut_length + other.cut_length,
+            rapid_length=self.rapid_length + other.rapid_length,
+            plunges=self.plunges + other.plunges,
+            duration=self.duration + other.duration,
+        )
+
+
+class Program(object):
+    """A g-code program; see `BLOCK_DTYPE` for what each block holds.
+
+    Programs using relative positioning (G91) can't be represented, and
+    comments are not kept.  Transforms should only change the columns of
+    blocks that move; other blocks are written from their text.
+    """
+
+    def __init__(self, blocks: np.ndarray, text: np.ndarray):
+        self.blocks = blocks
+        self.text = text
+
+        super().__init__()
+
+    @classmethod
+    def parse(cls, data: bytes) -> Program:
+        words = WordArrays(data)
+        count = words.line_count
+        letters, values, lines = words.letters, words.values, words.lines
+
+        g_mask = letters == ord("G")
+        g_lines, g_values = lines[g_mask], values[g_mask]
+        relative = g_values == 91.0
+        if relative.any():
+            raise InvalidGcode(
+                "Relative positioning (G91, on line "
+                f"{g_lines[np.argmax(relative)] + 1}) is not supported."
+            )
+
+        def get_modal(mask: np.ndarray, mask_values: np.ndarray) -> np.ndarray:
+            column = np.full(count, np.nan)
+            column[g_lines[mask]] = mask_values[mask]
+            return fill_forward(column, ~np.isnan(column))
+
+        is_motion = np.isin(g_values, list(MOTION_CODES))
+        ends_motion = np.isin(g_values, list(MOTION_CANCEL_CODES)) | (
+            np.floor(g_values) == 38.0
+        )
+        motion = get_modal(is_motion | ends_motion, np.where(is_motion, g_values, -1.0))
+        motion[np.isnan(motion)] = -1.0
+        inches = get_modal(np.isin(g_values, (20.0, 21.0)), g_values) == 20.0
+        # Most programs are metric throughout, and needn't be scaled.
+        scale: Union[np.ndarray, float] = 1.0
+        if inches.any():
+            scale = np.where(inches, MM_PER_INCH, 1.0)
+
+        resets = np.zeros(count, dtype=bool)
+        resets[g_lines[np.isin(g_values, list(POSITION_RESET_CODES))]] = True
+        dwells = np.zeros(count, dtype=bool)
+        dwells[g_lines[g_values == 4.0]] = True
+
+        axes = dict(zip("XYZIJFTP", _get_line_values(words, "XYZIJFTP")))
+        has_axis = ~(np.isnan(axes["X"]) & np.isnan(axes["Y"]) & np.isnan(axes["Z"]))
+        move = has_axis & ~resets & (motion >= 0)
+        arc = move & (motion >= 2)
+        # Axis words outside of a move (probing, canned cycles) leave the
+        # tool somewhere we can't predict.
+        unknown = (has_axis & ~move) | resets
+        any_unknown = unknown.any()
+
+        # Every column is assigned below, so there's no need to zero them.
+        blocks = np.empty(count, dtype=BLOCK_DTYPE)
+        blocks["line"] = np.arange(count)
+        blocks["motion"] = motion
+        blocks["move"] = move
+        blocks["inches"] = inches
+        for letter in "XYZ":
+            value = axes[letter] * scale
+            if any_unknown:
+                known = (move & ~np.isnan(value)) | unknown
+                value[unknown] = np.nan
+            else:
+                known = ~np.isnan(value)
+            blocks[letter.lower()] = fill_forward(value, known)
+        for letter in "IJ":
+            blocks[letter.lower()] = (
+                np.where(arc, axes[letter] * scale, np.nan) if arc.any() else np.nan
+            )
+        feed = axes["F"] * scale
+        blocks["feed"] = fill_forward(feed, ~np.isnan(feed))
+        tool = fill_forward(axes["T"], ~np.isnan(axes["T"]))
+        blocks["tool"] = np.where(np.isnan(tool), -1, tool)
+        blocks["dwell"] = (
+            np.where(dwells, np.nan_to_num(axes["P"]), 0.0) if dwells.any() else 0.0
+        )
+
+        # Words held in columns are dropped from the text; whatever else
+        # is on the line (other words, and anything ahead of the first
+        # word, like a `%`) is kept, with words separated by spaces.
+        owned = move[lines] & (
+            np.isin(letters, _OWNED_LETTERS)
+            | (g_mask & np.isin(values, list(MOTION_CODES)))
+            | (np.isin(letters, _ARC_LETTERS) & arc[lines])
+        )
+        kept = ~owned
+        line_starts = np.concatenate([[0], words.newlines[:-1] + 1])
+        prefix_ends = words.newlines.copy()
+        first = np.ones(len(lines), dtype=bool)
+        first[1:] = lines[1:] != lines[:-1]
+        prefix_ends[lines[first]] = words.starts[first]
+        prefixed = np.flatnonzero(prefix_ends > line_starts)
+
+        run_starts = np.concatenate([line_starts[prefixed], words.starts[kept]])
+        run_lengths = np.concatenate(
+            [(prefix_ends - line_starts)[prefixed], (words.ends - words.starts)[kept]]
+        )
+        run_lines = np.concatenate([prefixed, lines[kept]])
+        order = np.argsort(run_starts, kind="stable")
+        run_starts, run_lengths, run_lines = (
+            run_starts[order],
+            run_lengths[order],
+            run_lines[order],
+        )
+
+        spaced = np.zeros(len(run_starts), dtype=bool)
+        spaced[1:] = run_lines[1:] == run_lines[:-1]
+        sizes = run_lengths + spaced
+        text = np.full(int(sizes.sum()), ord(" "), dtype=np.uint8)
+        offsets = np.cumsum(sizes) - sizes + spaced
+        text[
+            np.repeat(offsets, run_lengths)
+            + np.arange(int(run_lengths.sum()))
+            - np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+        ] = _gather_runs(words.data, run_starts, run_lengths)
+
+        text_lengths = np.bincount(run_lines, weights=sizes, minlength=count).astype(
+            np.int64
+        )
+        blocks["text_length"] = text_lengths
+        blocks["text_start"] = np.cumsum(text_lengths) - text_lengths
+
+        return cls(blocks, text)
+
+    @classmethod
+    def read(cls, path: str) -> Program:
+        with open(path, "rb") as inf:
+            return cls.parse(inf.read())
+
+    def save(self, path: str) -> None:
+        """Save blocks and text to a file `load` can memory-map."""
+        with open(path, "wb") as outf:
+            for array in (self.blocks, self.text):
+                np.lib.format.write_array(outf, np.ascontiguousarray(array))
+
+    @classmethod
+    def load(cls, path: str) -> Program:
+        """Memory-map a program saved by `save`; it is read-only."""
+        arrays: List[np.ndarray] = []
+        with open(path, "rb") as inf:
+            for _ in range(2):
+                version = np.lib.format.read_magic(inf)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(
+                        inf
+                    )
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(
+                        inf
+                    )
+                offset = inf.tell()
+                arrays.append(
+                    np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+                    if np.prod(shape)
+                    else np.zeros(shape, dtype=dtype)
+                )
+                inf.seek(offset + arrays[-1].nbytes)
+
+        return cls(arrays[0], arrays[1])
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def __getitem__(self, index: slice) -> Program:
+        return Program(self.blocks[index], self.text)
+
+    def repeat(self, counts: np.ndarray) -> Program:
+        """Repeat each block `counts` times; its text goes with the first copy."""
+        blocks = np.repeat(self.blocks, counts)
+        firsts = (np.cumsum(counts) - counts)[counts > 0]
+        text_lengths = np.zeros(len(blocks), dtype=np.int32)
+        text_lengths[firsts] = self.blocks["text_length"][counts > 0]
+        blocks["text_length"] = text_lengths
+
+        return Program(blocks, self.text)
+
+    def iter_text(
+        self, decimals: int = 3, chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        writer = TextWriter(decimals)
+        for start in range(0, len(self), chunk_size):
+            yield writer.write(self[start : start + chunk_size])
+
+    def write(self, outf: BinaryIO, decimals: int = 3) -> None:
+        for chunk in self.iter_text(decimals):
+            outf.write(chunk)
+
+    def get_toolpath_stats(self, rapid_rate: float) -> ToolpathStats:
+        """Measure the program's travel, starting from the origin.
+
+        Arcs are measured along the arc when given by their center (I/J).
+        Where a position isn't known (after homing, say), the tool is
+        taken to be where it last was.  A plunge is any move from above
+        Z0 to or below it.
+        """
+        blocks = self.blocks
+        moves = np.flatnonzero(blocks["move"])
+
+        end = np.empty((3, len(moves)))
+        for idx, column in enumerate("xyz"):
+            values = blocks[column][moves]
+            end[idx] = np.nan_to_num(fill_forward(values, ~np.isnan(values)))
+        start = np.zeros_like(end)
+        start[:, 1:] = end[:, :-1]
+        delta = end - start
+        length = np.sqrt((delta * delta).sum(axis=0))
+
+        motion = blocks["motion"][moves]
+        center_x, center_y = blocks["i"][moves], blocks["j"][moves]
+        arc = (motion >= 2) & ~(np.isnan(center_x) & np.isnan(center_y))
+        if arc.any():
+            (start_x, start_y), (end_x, end_y) = start[:2, arc], end[:2, arc]
+            center_x = start_x + np.nan_to_num(center_x[arc])
+            center_y = start_y + np.nan_to_num(center_y[arc])
+            angle = np.arctan2(end_y - center_y, end_x - center_x) - np.arctan2(
+                start_y - center_y, start_x - center_x
+            )
+            angle = np.where(motion[arc] == 2, -angle, angle) % (2 * np.pi)
+            angle[angle == 0] = 2 * np.pi
+            radius = np.hypot(start_x - center_x, start_y - center_y)
+            length[arc] = np.hypot(radius * angle, delta[2, arc])
+
+        rapid = motion == 0
+        feed = blocks["feed"][moves]
+        rate = np.where(rapid | ~(feed > 0), rapid_rate, feed)
+
+        return ToolpathStats(
+            cut_length=float(length[~rapid].sum()),
+            rapid_length=float(length[rapid].sum()),
+            plunges=int(((start[2] > 0) & (end[2] <= 0)).sum()),
+            duration=float(blocks["dwell"].sum() + (length / rate).sum() * 60),
+        )
+
+    def estimate_duration(self, rapid_rate: float) -> float:
+        """Estimate the number of seconds the program takes to run.
+
+        Moves are assumed to run at their programmed feed rate (or at
+        `rapid_rate`, in mm/min, for rapids) from start to finish; time
+        spent accelerating is ignored, so this is an underestimate.
+        """
+        return self.get_toolpath_stats(rapid_rate).duration
+
+
+class TextWriter(object):
+    """Write programs to g-code a piece at a time.
+
+    Like `gcode.compact_lines`, the motion mode, axes and feed rate are
+    only written when they change, and coordinates are rounded to
+    `decimals` places (one more when in inches).  The machine's state
+    after each piece is remembered, so a program written in pieces is
+    the same as one written at once.
+    """
+
+    def __init__(self, decimals: int = 3):
+        self.decimals = decimals
+        self._state = np.zeros(1, dtype=BLOCK_DTYPE)
+        self._state["motion"] = -1
+        self._state["move"] = True
+        for column in ("x", "y", "z", "feed"):
+            self._state[column] = np.nan
+
+        super().__init__()
+
+    def write(self, program: Program) -> bytes:
+        blocks = program.blocks
+        count = len(blocks)
+        if not count:
+            return b""
+
+        def get_prior(column: str) -> np.ndarray:
+            """The column, preceded by the state before this piece."""
+            return np.concatenate([self._state[column], blocks[column]])
+
+        is_move = blocks["move"]
+        inches = blocks["inches"]
+        max_places = self.decimals + 1
+        # Coordinates are written rounded to a whole number of this scale.
+        factor: Union[np.ndarray, float]
+        pad: Union[np.ndarray, int]
+        if inches.all():
+            factor, pad = 10.0**max_places / MM_PER_INCH, 1
+        elif not inches.any():
+            factor, pad = 10.0**self.decimals, 10
+        else:
+            factor = np.where(
+                inches, 10.0**max_places / MM_PER_INCH, 10.0**self.decimals
+            )
+            pad = np.where(inches, 1, 10)
+
+        def round_prior(
+            values: np.ndarray, previous: Any
+        ) -> Tuple[np.ndarray, np.ndarray]:
+            """Round each value, and the `previous` ones, in the block's units."""
+            if np.ndim(factor) == 0:
+                rounded = np.round(values * factor)
+                return rounded[1:], rounded[previous]
+            return np.round(values[1:] * factor), np.round(values[previous] * factor)
+
+        text_lengths = blocks["text_length"].astype(np.int64)
+        written_any = np.zeros(count, dtype=bool)
+        columns: List[np.ndarray] = []
+
+        def add_words(letter: str, rounded: np.ndarray, written: np.ndarray) -> None:
+            if written.any():
+                first = written & ~written_any & (text_lengths == 0)
+                columns.extend(
+                    _format_words(letter, rounded, written, pad, max_places, first)
+                )
+                written_any[written] = True
+
+        motion = get_prior("motion")
+        arc = is_move & (motion[1:] >= 2)
+        written = is_move & (motion[1:] != motion[:-1])
+        if written.any():
+            codes = _pack(" G0\0 G1\0 G2\0 G3\0\0G0\0\0G1\0\0G2\0\0G3\0")
+            index = np.where(written, motion[1:], 0) + 4 * (text_lengths == 0)
+            columns.append(np.where(written, codes[index], 0))
+            written_any |= written
+
+        # Only moves change the position, or make it unknown; the columns
+        # of other blocks may not have been updated by a transform.
+        anchors = get_prior("move")
+        anchors[0] = True
+        all_anchors = anchors.all()
+        indexes = np.arange(count + 1)
+        state = self._state.copy()
+        for axis in "xyz":
+            values = get_prior(axis)
+            if all_anchors:
+                latest: Any = slice(None, -1)
+                state[axis] = values[-1]
+            else:
+                latest = np.maximum.accumulate(
+                    np.where(anchors | np.isnan(values), indexes, 0)
+                )
+                state[axis] = values[latest[-1]]
+                latest = latest[:-1]
+
+            rounded, previous = round_prior(values, latest)
+            add_words(
+                axis.upper(),
+                rounded,
+                is_move
+                & ~np.isnan(rounded)
+                & ((rounded != previous) | (arc & (axis != "z"))),
+            )
+        for axis in "ij":
+            add_words(
+                axis.upper(),
+                np.round(blocks[axis] * factor),
+                arc & ~np.isnan(blocks[axis]),
+            )
+        rounded, previous = round_prior(get_prior("feed"), slice(None, -1))
+        add_words("F", rounded, is_move & ~np.isnan(rounded) & (rounded != previous))
+
+        columns.append(np.where((text_lengths > 0) | written_any, _pack("\n\0\0\0"), 0))
+        rows = np.ascontiguousarray(np.array(columns).T).view(np.uint8)
+        nonzero = rows != 0
+        generated = rows[nonzero]
+
+        if not text_lengths.any():
+            output = generated
+        else:
+            sizes = text_lengths + np.count_nonzero(nonzero, axis=1)
+            text_offsets = (
+                np.repeat(np.cumsum(sizes) - sizes, text_lengths)
+                + np.arange(int(text_lengths.sum()))
+                - np.repeat(np.cumsum(text_lengths) - text_lengths, text_lengths)
+            )
+            output = np.empty(int(sizes.sum()), dtype=np.uint8)
+            is_text = np.zeros(len(output), dtype=bool)
+            is_text[text_offsets] = True
+            output[text_offsets] = _gather_runs(
+                program.text, blocks["text_start"], text_lengths
+            )
+            output[~is_text] = generated
+
+        state["motion"] = blocks["motion"][-1]
+        state["feed"] = blocks["feed"][-1]
+        self._state = state
+
+        return output.tobytes()
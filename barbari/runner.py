@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import collections
+from dataclasses import dataclass
+import logging
+import queue
+import re
+import subprocess
+import threading
+import time
+from typing import Callable, Deque, List, Optional, Sequence
+
+from .exceptions import BarbariFlatcamError, FlatcamTimeout
+from .flatcam import FlatcamProcess, FlatcamStepMarker
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StepTiming:
+    index: int
+    command: str
+    duration: float
+
+
+class FlatcamRunner(object):
+    """Run FlatCAM, timing each step of its script by the markers it prints.
+
+    A step taking longer than `step_timeout` seconds kills FlatCAM, as
+    does FlatCAM taking longer than `startup_timeout` seconds (by
+    default, `step_timeout`) to reach the first step.
+    """
+
+    MARKER_PATTERN = re.compile(r"^%s (\d+)$" % re.escape(FlatcamStepMarker.PREFIX))
+    OUTPUT_TAIL_LINES = 20
+
+    def __init__(
+        self,
+        args: Sequence[str],
+        processes: Sequence[FlatcamProcess],
+        step_timeout: Optional[float] = None,
+        metrics: Optional[Metrics] = None,
+        startup_timeout: Optional[float] = None,
+    ):
+        self._args = list(args)
+        self._processes = list(processes)
+        self._step_timeout = step_timeout
+        self._startup_timeout = startup_timeout or step_timeout
+        self._metrics = metrics or Metrics()
+        self._timings: List[StepTiming] = []
+        self._output: Deque[str] = collections.deque(maxlen=self.OUTPUT_TAIL_LINES)
+
+        super().__init__()
+
+    @property
+    def timings(self) -> List[StepTiming]:
+        return self._timings
+
+    @property
+    def output_tail(self) -> List[str]:
+        return list(self._output)
+
+    def get_slowest(self, count: int) -> List[StepTiming]:
+        return sorted(self._timings, key=lambda timing: timing.duration, reverse=True)[
+            :count
+        ]
+
+    def _read_output(self, stream, lines: queue.Queue) -> None:
+        for line in iter(stream.readline, ""):
+            lines.put(line.rstrip("\r\n"))
+        lines.put(None)
+
+    def _finish_step(self, index: Optional[int], started: float) -> None:
+        if index is None:
+            return
+
+        timing = StepTiming(
+            index=index,
+            command=str(self._processes[index]),
+            duration=time.monotonic() - started,
+        )
+        self._timings.append(timing)
+
+        cmd = self._processes[index].cmd
+        self._metrics.increment("flatcam_steps_total", command=cmd)
+        self._metrics.increment(
+            "flatcam_step_seconds_total", timing.duration, command=cmd
+        )
+        self._metrics.event(
+            "flatcam_step",
+            index=timing.index,
+            command=timing.command,
+            duration=timing.duration,
+        )
+
+    def _finish_run(self, result: str, started: float, **fields) -> None:
+        duration = time.monotonic() - started
+
+        self._metrics.increment("flatcam_runs_total", result=result)
+        self._metrics.increment("flatcam_run_seconds_total", duration)
+        self._metrics.event("flatcam_run", result=result, duration=duration, **fields)
+
+    def run(
+        self,
+        on_step: Optional[Callable[[int, FlatcamProcess], None]] = None,
+    ) -> int:
+        run_started = time.monotonic()
+        proc = subprocess.Popen(
+            self._args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+        lines: queue.Queue = queue.Queue()
+        reader = threading.Thread(
+            target=self._read_output, args=(proc.stdout, lines), daemon=True
+        )
+        reader.start()
+
+        current: Optional[int] = None
+        started = time.monotonic()
+
+        while True:
+            limit = self._startup_timeout if current is None else self._step_timeout
+            timeout = None
+            if limit:
+                timeout = max(limit - (time.monotonic() - started), 0)
+
+            try:
+                line = lines.get(timeout=timeout)
+            except queue.Empty:
+                proc.kill()
+                proc.wait()
+                self._finish_run("timeout", run_started, step=current)
+                if current is None:
+                    raise FlatcamTimeout(
+                        f"Flatcam did not start its first step within {limit} "
+                        "seconds; last output:\n" + "\n".join(self._output)
+                    )
+                raise FlatcamTimeout(
+                    f"Flatcam step {current} did not finish within "
+                    f"{self._step_timeout} seconds: {self._processes[current]}"
+                )
+
+            if line is None:
+                break
+
+            match = self.MARKER_PATTERN.match(line.strip())
+            if not match:
+                logger.debug("flatcam: %s", line)
+                self._output.append(line)
+                continue
+
+            self._finish_step(current, started)
+            current = int(match.group(1))
+            started = time.monotonic()
+            logger.debug(
+                "Flatcam started step %s: %s", current, self._processes[current]
+            )
+            if on_step:
+                on_step(current, self._processes[current])
+
+        self._finish_step(current, started)
+        result = proc.wait()
+
+        if result != 0:
+            self._finish_run("failure", run_started, step=current, status=result)
+            raise BarbariFlatcamError(
+                f"Flatcam exited with status {result} during step {current}; "
+                "last output:\n" + "\n".join(self._output)
+            )
+
+        self._finish_run("success", run_started)
+        return result
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import collections
+from dataclasses import dataclass
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from .exceptions import BarbariError
+from .gcode import split_comment
+
+logger = logging.getLogger(__name__)
+
+
+TOOL_CHANGE_PATTERN = re.compile(r"(?<![A-Z])M0*6(?!\d)")
+TOOL_WORD_PATTERN = re.compile(r"T\d+")
+
+
+class GrblError(BarbariError):
+    pass
+
+
+class GrblAlarm(GrblError):
+    pass
+
+
+class SerialPort(Protocol):
+    def write(self, data: bytes) -> Optional[int]: ...
+
+    def readline(self) -> bytes: ...
+
+    def reset_input_buffer(self) -> None: ...
+
+
+@dataclass
+class StreamStats:
+    lines: int = 0
+    bytes: int = 0
+    duration: float = 0.0
+
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines / self.duration if self.duration else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.duration if self.duration else 0.0
+
+    def __add__(self, other: StreamStats) -> StreamStats:
+        return StreamStats(
+            lines=self.lines + other.lines,
+            bytes=self.bytes + other.bytes,
+            duration=self.duration + other.duration,
+        )
+
+
+def clean_line(line: str) -> str:
+    """Strip comments and whitespace; GRBL counts every byte we send."""
+    code, _ = split_comment(line)
+
+    return "".join(code.split()).upper()
+
+
+def is_tool_change(line: str) -> bool:
+    return bool(TOOL_CHANGE_PATTERN.search(line))
+
+
+class GrblSender(object):
+    """Streams g-code to GRBL using its character-counting protocol.
+
+    Rather than waiting for each line to be acknowledged before sending
+    the next, we keep as many lines in flight as fit in GRBL's serial
+    receive buffer so that its planner always has moves queued.  Each
+    `ok` or `error` acknowledges the oldest line in flight; errors name
+    that line's number in the program being streamed.
+    """
+
+    RX_BUFFER_SIZE = 128
+
+    def __init__(
+        self,
+        port: SerialPort,
+        rx_buffer_size: int = RX_BUFFER_SIZE,
+        on_tool_change: Optional[Callable[[str], None]] = None,
+    ):
+        self._port = port
+        self._rx_buffer_size = rx_buffer_size
+        self._on_tool_change = on_tool_change
+        # Size and line number of each line sent but not yet acknowledged
+        self._in_flight: Deque[Tuple[int, int]] = collections.deque()
+        self._in_flight_bytes = 0
+
+        super().__init__()
+
+    def wake(self, delay: float = 2.0) -> None:
+        """Wake GRBL up and discard its startup messages."""
+        self._port.write(b"\r\n\r\n")
+        time.sleep(delay)
+        self._port.reset_input_buffer()
+
+    def _read_response(self) -> None:
+        while True:
+            response = self._port.readline().decode("ascii", "replace").strip()
+            if not response:
+                continue
+            elif response == "ok":
+                break
+            elif response.startswith("error"):
+                raise GrblError(
+                    f"Line {self._in_flight[0][1]}: GRBL rejected a line ({response})."
+                )
+            elif response.startswith("ALARM"):
+                raise GrblAlarm(
+                    f"Line {self._in_flight[0][1]}: GRBL entered an alarm "
+                    f"state ({response})."
+                )
+
+            logger.debug("GRBL: %s", response)
+
+        size, _ = self._in_flight.popleft()
+        self._in_flight_bytes -= size
+
+    def drain(self) -> None:
+        """Wait until every line sent has been acknowledged."""
+        while self._in_flight:
+            self._read_response()
+
+    def wait_for_idle(self, interval: float = 0.2) -> None:
+        """Wait until GRBL has finished executing every queued move."""
+        self.drain()
+
+        while True:
+            # `?` is a realtime command; it isn't counted against the
+            # receive buffer and is answered with a status report.
+            self._port.write(b"?")
+            response = self._port.readline().decode("ascii", "replace").strip()
+            if response.startswith("<Idle"):
+                return
+            elif response.startswith("ALARM"):
+                raise GrblAlarm(f"GRBL entered an alarm state ({response}).")
+            time.sleep(interval)
+
+    def _send(self, line: str, line_number: int) -> None:
+        data = (line + "\n").encode("ascii")
+        if len(data) > self._rx_buffer_size:
+            raise GrblError(
+                f"Line {line_number}: Line is too long to send to GRBL: {line}"
+            )
+
+        while self._in_flight_bytes + len(data) > self._rx_buffer_size:
+            self._read_response()
+
+        self._port.write(data)
+        self._in_flight.append((len(data), line_number))
+        self._in_flight_bytes += len(data)
+
+    def stream(
+        self,
+        lines: Iterable[str],
+        on_line: Optional[Callable[[int], None]] = None,
+    ) -> StreamStats:
+        """Send lines of g-code, returning once all have been acknowledged.
+
+        Tool changes (`M6`) are not supported by GRBL; instead, we wait
+        for the machine to finish moving, let `on_tool_change` prompt the
+        operator, and then carry on.  Time spent paused is not counted
+        in the returned statistics.
+        """
+        stats = StreamStats()
+        started = time.monotonic()
+        paused = 0.0
+
+        for line_number, raw_line in enumerate(lines, start=1):
+            line = clean_line(raw_line)
+            if not line:
+                continue
+
+            if is_tool_change(line):
+                pause_started = time.monotonic()
+                self.wait_for_idle()
+                if self._on_tool_change:
+                    self._on_tool_change(raw_line.strip())
+                paused += time.monotonic() - pause_started
+
+                line = TOOL_WORD_PATTERN.sub("", TOOL_CHANGE_PATTERN.sub("", line))
+                if not line:
+                    continue
+
+            self._send(line, line_number)
+            stats.lines += 1
+            stats.bytes += len(line) + 1
+            if on_line:
+                on_line(line_number)
+
+        self.drain()
+        stats.duration = time.monotonic() - started - paused
+
+        return stats
+
+
+class SimulatedGrbl(object):
+    """A stand-in for a GRBL controller listening on a pseudo-terminal.
+
+    Lines are acknowledged after `line_delay` seconds each, as though
+    they had been executed; if more bytes are ever waiting than fit in
+    GRBL's receive buffer, `overflowed` is set.  Lines found in
+    `responses` are answered with its value (e.g. `error:20` or
+    `ALARM:2`) instead of `ok`.
+    """
+
+    def __init__(
+        self,
+        rx_buffer_size: int = GrblSender.RX_BUFFER_SIZE,
+        line_delay: float = 0.001,
+        responses: Optional[Dict[str, str]] = None,
+    ):
+        import tty
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self._rx_buffer_size = rx_buffer_size
+        self._line_delay = line_delay
+        self._responses = responses or {}
+        self._received: List[str] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.overflowed = False
+        self.max_buffered = 0
+
+        super().__init__()
+
+    @property
+    def port(self) -> str:
+        return os.ttyname(self._slave)
+
+    @property
+    def received(self) -> List[str]:
+        return self._received
+
+    def start(self) -> SimulatedGrbl:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self) -> None:
+        import select
+
+        buffered = b""
+        busy_until = 0.0
+
+        os.write(self._master, b"\r\nGrbl 1.1h ['$' for help]\r\n")
+        while not self._stop.is_set():
+            timeout = 0.05
+            if b"\n" in buffered:
+                timeout = max(0.0, busy_until - time.monotonic())
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                for byte in os.read(self._master, 1024):
+                    if byte == ord("?"):
+                        running = buffered or time.monotonic() < busy_until
+                        state = "Run" if running else "Idle"
+                        os.write(
+                            self._master,
+                            f"<{state}|MPos:0.000,0.000,0.000|FS:0,0>\r\n".encode(),
+                        )
+                    else:
+                        buffered += bytes([byte])
+
+                self.max_buffered = max(self.max_buffered, len(buffered))
+                if len(buffered) > self._rx_buffer_size:
+                    self.overflowed = True
+
+            while b"\n" in buffered and time.monotonic() >= busy_until:
+                line, buffered = buffered.split(b"\n", 1)
+                decoded = line.strip(b"\r").decode("ascii")
+                if decoded:
+                    self._received.append(decoded)
+                busy_until = time.monotonic() + self._line_delay
+                response = self._responses.get(decoded, "ok")
+                os.write(self._master, f"{response}\r\n".encode())
@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+import collections
+from dataclasses import asdict, dataclass, field
+import enum
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import urllib.parse
+import uuid
+import zipfile
+
+from . import api, watch
+from .config import Config, get_config_file_paths, get_merged_config
+from .exceptions import BarbariError, BarbariFlatcamError, BarbariUserError
+from .gerbers import GerberProject
+from .metrics import Metrics, format_textfile
+
+logger = logging.getLogger(__name__)
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    configs: List[str]
+    output_path: str
+    upload_path: str
+    digest: str
+    status: JobStatus = JobStatus.QUEUED
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[api.BuildResult] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def gcode_files(self) -> List[str]:
+        if not self.result:
+            return []
+
+        return [os.path.basename(path) for path in self.result.gcode_files]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "id": self.id,
+            "status": self.status.value,
+            "configs": self.configs,
+            "submitted": self.submitted,
+            "queued_seconds": (self.started or time.time()) - self.submitted,
+            "build_seconds": (
+                (self.finished or time.time()) - self.started if self.started else None
+            ),
+            "error": self.error,
+            "files": self.gcode_files,
+        }
+        if self.result:
+            data["steps"] = [asdict(timing) for timing in self.result.timings]
+            data["tool_assignments"] = [
+                asdict(assignment) for assignment in self.result.plan.tool_assignments
+            ]
+            data["unassigned_tools"] = [
+                asdict(tool) for tool in self.result.plan.unassigned_tools
+            ]
+
+        return data
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def extract_archive(path: str, directory: str, max_size: int) -> None:
+    """Extract the files in a zip of exports into `directory`.
+
+    Exports are expected to sit side by side, so any folders within the
+    archive are ignored and only each file's name is kept.
+    """
+    try:
+        zipped = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise BarbariUserError(f"Unable to read archive: {e}") from e
+
+    members = [
+        info
+        for info in zipped.infolist()
+        if not info.is_dir() and not os.path.basename(info.filename).startswith(".")
+    ]
+    if sum(info.file_size for info in members) > max_size:
+        raise BarbariUserError("Archive is too large once extracted.")
+
+    os.makedirs(directory, exist_ok=True)
+    for info in members:
+        with zipped.open(info) as inf, open(
+            os.path.join(directory, os.path.basename(info.filename)), "wb"
+        ) as outf:
+            shutil.copyfileobj(inf, outf)
+
+
+class ConfigCache(object):
+    """Merged configurations, reloaded when any file they were read from changes."""
+
+    def __init__(self):
+        self._configs: Dict[Tuple[str, ...], Tuple[Config, watch.Snapshot]] = {}
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def get(self, names: List[str]) -> Config:
+        key = tuple(names)
+
+        with self._lock:
+            cached = self._configs.get(key)
+            if cached is not None:
+                loaded, snapshot = cached
+                if watch.take_snapshot(snapshot) == snapshot:
+                    return loaded
+
+            loaded = get_merged_config(names)
+            self._configs[key] = (
+                loaded,
+                watch.take_snapshot(get_config_file_paths(names)),
+            )
+
+            return loaded
+
+
+class ProjectCache(object):
+    """Uploaded exports and the layers read from them, keyed by content.
+
+    Boards are often submitted more than once (e.g. re-ordered, or built
+    with different configs); the same upload reuses the files already
+    extracted and any layers already read.  Up to `size` projects are
+    kept; those not in use by a job are removed least-recently-used first.
+    """
+
+    def __init__(self, directory: str, size: int, max_upload_size: int):
+        self._directory = directory
+        self._size = size
+        self._max_upload_size = max_upload_size
+        self._projects: collections.OrderedDict[str, GerberProject] = (
+            collections.OrderedDict()
+        )
+        self._in_use: Dict[str, int] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def checkout(self, digest: str, archive_path: str) -> GerberProject:
+        """Return the project uploaded as `archive_path`, whose digest is `digest`."""
+        with self._lock:
+            project = self._projects.get(digest)
+            if project is None:
+                path = os.path.join(self._directory, digest)
+                shutil.rmtree(path, ignore_errors=True)
+                extract_archive(archive_path, path, self._max_upload_size)
+                project = GerberProject(path)
+                self._projects[digest] = project
+            self._projects.move_to_end(digest)
+            self._in_use[digest] += 1
+            self._evict()
+
+        return project
+
+    def release(self, digest: str) -> None:
+        with self._lock:
+            self._in_use[digest] -= 1
+            self._evict()
+
+    def _evict(self) -> None:
+        for digest in list(self._projects):
+            if len(self._projects) <= self._size:
+                break
+            if self._in_use[digest]:
+                continue
+
+            shutil.rmtree(self._projects.pop(digest).path, ignore_errors=True)
+            del self._in_use[digest]
+
+
+class JobServer(object):
+    """Queues build jobs and runs them on a fixed number of worker threads.
+
+    Each job runs its own flatcam process; at most `workers` run at once,
+    and at most `queue_size` more wait their turn.  Uploads wait on disk
+    rather than in memory, and are removed once their job has run.  Only
+    the most recent `keep_jobs` finished jobs (and their g-code) are kept.
+    """
+
+    def __init__(
+        self,
+        work_dir: str,
+        workers: int = 2,
+        queue_size: int = 100,
+        keep_jobs: int = 100,
+        max_upload_size: int = 50 * 1024 * 1024,
+        **build_options: Any,
+    ):
+        self._work_dir = work_dir
+        self._workers = workers
+        self._keep_jobs = keep_jobs
+        self._max_upload_size = max_upload_size
+        self._build_options = build_options
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._jobs: collections.OrderedDict[str, Job] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._configs = ConfigCache()
+        self._projects = ProjectCache(
+            os.path.join(work_dir, "projects"), keep_jobs, max_upload_size
+        )
+        self.metrics = Metrics()
+
+        super().__init__()
+
+    @property
+    def max_upload_size(self) -> int:
+        return self._max_upload_size
+
+    def start(self) -> None:
+        for idx in range(self._workers):
+            thread = threading.Thread(
+                target=self._work, name=f"barbari-worker-{idx}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _write_upload(
+        self, upload: BinaryIO, path: str, length: Optional[int] = None
+    ) -> str:
+        """Copy an upload into `path`, returning its SHA-256 digest."""
+        limit = self._max_upload_size + 1
+        if length is not None:
+            limit = min(length, limit)
+
+        digest = hashlib.sha256()
+        written = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as outf:
+            while written < limit:
+                chunk = upload.read(min(UPLOAD_CHUNK_SIZE, limit - written))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                outf.write(chunk)
+                written += len(chunk)
+
+        if written > self._max_upload_size:
+            raise BarbariUserError("Archive is too large.")
+
+        return digest.hexdigest()
+
+    def submit(
+        self, upload: BinaryIO, configs: List[str], length: Optional[int] = None
+    ) -> Job:
+        """Queue a job building the zip of exports read from `upload`.
+
+        At most `length` bytes are read, if given.
+        """
+        if not configs:
+            raise BarbariUserError("At least one config is required.")
+        # Fail fast on configs that don't exist rather than queueing.
+        self._configs.get(configs)
+        if self._queue.full():
+            raise BarbariUserError("Too many jobs are waiting; try again later.")
+
+        job_id = uuid.uuid4().hex
+        upload_path = os.path.join(self._work_dir, "uploads", f"{job_id}.zip")
+        try:
+            digest = self._write_upload(upload, upload_path, length)
+            if not zipfile.is_zipfile(upload_path):
+                raise BarbariUserError("Jobs must be submitted as a zip archive.")
+
+            job = Job(
+                id=job_id,
+                configs=configs,
+                output_path=os.path.join(self._work_dir, "jobs", job_id),
+                upload_path=upload_path,
+                digest=digest,
+            )
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise BarbariUserError("Too many jobs are waiting; try again later.")
+        except BaseException:
+            _remove_file(upload_path)
+            raise
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self.metrics.increment("jobs_submitted_total")
+        self.metrics.set("jobs_queued", self._queue.qsize())
+
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        finished = [
+            job
+            for job in self._jobs.values()
+            if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+        ]
+        for job in finished[: max(len(finished) - self._keep_jobs, 0)]:
+            del self._jobs[job.id]
+            shutil.rmtree(job.output_path, ignore_errors=True)
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            self.metrics.set("jobs_queued", self._queue.qsize())
+            try:
+                self._run(job)
+            except Exception:
+                logger.exception("Unexpected error running job %s", job.id)
+                job.status = JobStatus.FAILED
+                job.error = "Unexpected error; see the server's log."
+            finally:
+                job.finished = time.time()
+                _remove_file(job.upload_path)
+                job.done.set()
+                self.metrics.increment("jobs_total", result=job.status.value)
+                self.metrics.increment(
+                    "job_seconds_total", job.finished - (job.started or job.finished)
+                )
+                with self._lock:
+                    self._prune()
+
+    def _run(self, job: Job) -> None:
+        job.started = time.time()
+        job.status = JobStatus.RUNNING
+        logger.info("Starting job %s (%s)", job.id, ", ".join(job.configs))
+
+        project: Optional[GerberProject] = None
+        try:
+            project = self._projects.checkout(job.digest, job.upload_path)
+            job.result = api.build(
+                project.path,
+                self._configs.get(job.configs),
+                output_path=job.output_path,
+                project=project,
+                metrics=Metrics(job=job.id),
+                **self._build_options,
+            )
+            job.status = JobStatus.SUCCEEDED
+        except (BarbariError, BarbariFlatcamError) as e:
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        finally:
+            if project is not None:
+                self._projects.release(job.digest)
+
+        logger.info(
+            "Finished job %s: %s in %.1fs",
+            job.id,
+            job.status.value,
+            time.time() - job.started,
+        )
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface to a `JobServer`.
+
+    - `POST /jobs?config=NAME[&config=NAME...]` with a zip of exports as
+      the body queues a job, returning its status.
+    - `GET /jobs/ID[?wait=SECONDS]` returns a job's status (including
+      step timings and the g-code files written once finished), waiting
+      up to `wait` seconds for it to finish.
+    - `GET /jobs/ID/gcode` returns a zip of the job's g-code files, and
+      `GET /jobs/ID/gcode/FILENAME` a single file.
+    - `GET /metrics` returns server metrics in Prometheus' text format.
+    """
+
+    server: JobHTTPServer
+    JOB_PATH = re.compile(r"^/jobs/(?P<id>[0-9a-f]+)(?:/gcode(?:/(?P<file>[^/]+))?)?$")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status: HTTPStatus, data: Any) -> None:
+        self.send_body(status, json.dumps(data).encode("utf-8"), "application/json")
+
+    def send_error_json(self, status: HTTPStatus, message: str) -> None:
+        self.send_json(status, {"error": message})
+
+    def send_body(self, status: HTTPStatus, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def discard_body(self, length: int) -> None:
+        """Read and drop a request's body before refusing it.
+
+        Closing the connection while the client is still sending would
+        reset it, and the client would never see our response.
+        """
+        while length > 0:
+            chunk = self.rfile.read(min(length, UPLOAD_CHUNK_SIZE))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        if url.path != "/jobs":
+            self.discard_body(length)
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found.")
+            return
+
+        if length > self.server.job_server.max_upload_size:
+            self.discard_body(length)
+            self.send_error_json(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Archive is too large."
+            )
+            return
+
+        configs = urllib.parse.parse_qs(url.query).get("config", [])
+        try:
+            job = self.server.job_server.submit(self.rfile, configs, length)
+        except BarbariError as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        self.send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/metrics":
+            self.send_body(
+                HTTPStatus.OK,
+                format_textfile([self.server.job_server.metrics]).encode("utf-8"),
+                "text/plain; version=0.0.4",
+            )
+            return
+
+        match = self.JOB_PATH.match(url.path)
+        job = self.server.job_server.get(match.group("id")) if match else None
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found.")
+            return
+
+        if not url.path.endswith("/gcode") and match.group("file") is None:
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                wait = float(query.get("wait", ["0"])[0])
+            except ValueError:
+                self.send_error_json(HTTPStatus.BAD_REQUEST, "Invalid wait.")
+                return
+            job.done.wait(min(max(wait, 0), 300))
+            self.send_json(HTTPStatus.OK, job.to_dict())
+            return
+
+        if job.status != JobStatus.SUCCEEDED:
+            self.send_error_json(
+                HTTPStatus.CONFLICT, f"Job is {job.status.value}; no g-code yet."
+            )
+            return
+
+        filename = match.group("file")
+        if filename is not None:
+            if filename not in job.gcode_files:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "Not found.")
+                return
+            with open(os.path.join(job.output_path, filename), "rb") as inf:
+                self.send_body(HTTPStatus.OK, inf.read(), "text/plain")
+            return
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipped:
+            for filename in job.gcode_files:
+                zipped.write(os.path.join(job.output_path, filename), filename)
+        self.send_body(HTTPStatus.OK, buffer.getvalue(), "application/zip")
+
+
+class JobHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], job_server: JobServer):
+        self.job_server = job_server
+
+        super().__init__(address, JobRequestHandler)
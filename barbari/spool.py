@@ -0,0 +1,431 @@
+"""Queue builds through a directory shared between build hosts.
+
+A spool is a directory -- e.g. on a network share every build host
+mounts -- holding:
+
+- `queued/ID.json`: jobs waiting for a worker.
+- `running/ID.WORKER.json`: jobs claimed by the worker named `WORKER`.
+- `done/ID.json`: each finished job's status, step timings and the
+  g-code files it wrote.
+- `output/ID/`: the g-code written by each job, unless the job was
+  given an output path of its own.
+
+Any number of workers, on any number of hosts, may share a spool.  A
+worker claims a job by renaming it out of `queued/`; a rename is atomic,
+so exactly one worker gets each job.  While building, the worker touches
+its claim every `heartbeat` seconds.  A claim left untouched for
+`stale_after` seconds belonged to a worker that crashed (or lost the
+share), and whichever worker notices first moves it back to `queued/`;
+a job reclaimed `max_attempts` times is failed instead.  A worker whose
+claim is taken from it this way abandons the job without reporting it,
+so each job's status is written once -- though a job may be built more
+than once.
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+from . import api
+from .exceptions import BarbariError, BarbariFlatcamError, BarbariUserError
+from .metrics import Metrics
+from .server import JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+QUEUED_DIR = "queued"
+RUNNING_DIR = "running"
+DONE_DIR = "done"
+OUTPUT_DIR = "output"
+
+
+@dataclass
+class SpoolJob:
+    id: str
+    directory: str
+    configs: List[str]
+    output_path: str
+    submitted: float
+    attempts: int = 0
+
+
+def _write_json(path: str, data: Any) -> None:
+    """Write a file so that readers on any host see all of it or none of it."""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as outf:
+        json.dump(data, outf, indent=2)
+    os.replace(temp_path, path)
+
+
+def _read_json(path: str) -> Any:
+    with open(path, "r") as inf:
+        return json.load(inf)
+
+
+def get_worker_id() -> str:
+    # Claims are named `ID.WORKER.json`, so worker ids can't hold dots.
+    host = socket.gethostname().replace(".", "-")
+    return f"{host}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Spool(object):
+    def __init__(self, path: str):
+        self._path = os.path.abspath(os.path.expanduser(path))
+        for name in (QUEUED_DIR, RUNNING_DIR, DONE_DIR, OUTPUT_DIR):
+            os.makedirs(os.path.join(self._path, name), exist_ok=True)
+
+        super().__init__()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _get_path(self, directory: str, *names: str) -> str:
+        return os.path.join(self._path, directory, ".".join(names) + ".json")
+
+    def _list(self, directory: str) -> List[str]:
+        return sorted(
+            filename
+            for filename in os.listdir(os.path.join(self._path, directory))
+            if filename.endswith(".json")
+        )
+
+    def submit(
+        self, directory: str, configs: List[str], output_path: Optional[str] = None
+    ) -> SpoolJob:
+        if not configs:
+            raise BarbariUserError("At least one config is required.")
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.isdir(directory):
+            raise BarbariUserError(f"{directory} is not a directory.")
+
+        # Ids sort in the order jobs were submitted, so jobs are claimed
+        # oldest first.
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        job = SpoolJob(
+            id=job_id,
+            directory=directory,
+            configs=configs,
+            output_path=os.path.abspath(
+                os.path.expanduser(
+                    output_path or os.path.join(self._path, OUTPUT_DIR, job_id)
+                )
+            ),
+            submitted=time.time(),
+        )
+        _write_json(self._get_path(QUEUED_DIR, job.id), asdict(job))
+
+        return job
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status, or `None` if there's no such job."""
+        try:
+            return _read_json(self._get_path(DONE_DIR, job_id))
+        except FileNotFoundError:
+            pass
+
+        for filename in self._list(RUNNING_DIR):
+            claimed_id, _, worker = filename[: -len(".json")].partition(".")
+            if claimed_id == job_id:
+                return {
+                    "id": job_id,
+                    "status": JobStatus.RUNNING.value,
+                    "worker": worker,
+                }
+
+        if os.path.exists(self._get_path(QUEUED_DIR, job_id)):
+            return {"id": job_id, "status": JobStatus.QUEUED.value}
+
+        return None
+
+    def wait(
+        self, job_id: str, timeout: float, poll_interval: float = 1.0
+    ) -> Optional[Dict[str, Any]]:
+        """Wait up to `timeout` seconds for a job to finish; returns its status."""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.get_status(job_id)
+            if status is None or status["status"] in (
+                JobStatus.SUCCEEDED.value,
+                JobStatus.FAILED.value,
+            ):
+                return status
+            if time.monotonic() >= deadline:
+                return status
+            time.sleep(poll_interval)
+
+    def claim(self, worker_id: str) -> Optional[Tuple[SpoolJob, str]]:
+        """Claim the oldest queued job; returns it and the path of its claim."""
+        for filename in self._list(QUEUED_DIR):
+            job_id = filename[: -len(".json")]
+            queued_path = self._get_path(QUEUED_DIR, job_id)
+            claim_path = self._get_path(RUNNING_DIR, job_id, worker_id)
+            try:
+                # A rename keeps the file's modification time, which for
+                # a job that waited in the queue could already look
+                # stale; touch it first, so the claim starts out fresh.
+                os.utime(queued_path)
+                os.rename(queued_path, claim_path)
+            except FileNotFoundError:
+                # Another worker got to it first.
+                continue
+
+            try:
+                return SpoolJob(**_read_json(claim_path)), claim_path
+            except (OSError, ValueError, TypeError) as e:
+                logger.error("Unable to read job %s: %s", job_id, e)
+                self._write_status(
+                    job_id,
+                    {
+                        "id": job_id,
+                        "status": JobStatus.FAILED.value,
+                        "error": f"Unable to read job: {e}",
+                    },
+                )
+                self.release(claim_path)
+
+        return None
+
+    def heartbeat(self, claim_path: str) -> bool:
+        """Mark a claim as still being worked on; false if it has been lost."""
+        try:
+            os.utime(claim_path)
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def release(self, claim_path: str) -> None:
+        try:
+            os.unlink(claim_path)
+        except FileNotFoundError:
+            pass
+
+    def requeue(self, job: SpoolJob, claim_path: str) -> None:
+        """Give up a claimed job, queueing it for another worker."""
+        if self.heartbeat(claim_path):
+            _write_json(self._get_path(QUEUED_DIR, job.id), asdict(job))
+            self.release(claim_path)
+
+    def _write_status(self, job_id: str, status: Dict[str, Any]) -> None:
+        _write_json(self._get_path(DONE_DIR, job_id), status)
+
+    def finish(self, claim_path: str, status: Dict[str, Any]) -> bool:
+        """Record a claimed job's status; false if the claim had been lost."""
+        if not self.heartbeat(claim_path):
+            return False
+
+        self._write_status(status["id"], status)
+        self.release(claim_path)
+
+        return True
+
+    def reclaim_stale(
+        self, worker_id: str, stale_after: float, max_attempts: int = 3
+    ) -> List[str]:
+        """Requeue jobs whose claims haven't been touched in `stale_after` seconds.
+
+        Returns the ids of the jobs requeued (or failed, once they have
+        been reclaimed `max_attempts` times).
+        """
+        reclaimed: List[str] = []
+        now = time.time()
+        for filename in self._list(RUNNING_DIR):
+            path = os.path.join(self._path, RUNNING_DIR, filename)
+            try:
+                if now - os.stat(path).st_mtime < stale_after:
+                    continue
+                # Take the claim over before touching it, so that only
+                # one worker requeues each stale job.
+                job_id = filename.partition(".")[0]
+                taken_path = self._get_path(RUNNING_DIR, job_id, worker_id)
+                os.rename(path, taken_path)
+            except FileNotFoundError:
+                continue
+
+            try:
+                job = SpoolJob(**_read_json(taken_path))
+            except (OSError, ValueError, TypeError) as e:
+                logger.error("Unable to read job %s: %s", job_id, e)
+                self.release(taken_path)
+                continue
+
+            job.attempts += 1
+            reclaimed.append(job.id)
+            if job.attempts >= max_attempts:
+                logger.warning(
+                    "Job %s was abandoned %d times; failing it.", job.id, job.attempts
+                )
+                self._write_status(
+                    job.id,
+                    {
+                        **asdict(job),
+                        "status": JobStatus.FAILED.value,
+                        "error": (
+                            f"Abandoned by {job.attempts} workers; they may have "
+                            "crashed while building it."
+                        ),
+                    },
+                )
+            else:
+                logger.warning(
+                    "Requeueing job %s; its worker stopped responding.", job.id
+                )
+                _write_json(self._get_path(QUEUED_DIR, job.id), asdict(job))
+            self.release(taken_path)
+
+        return reclaimed
+
+
+class SpoolWorker(object):
+    """Claims jobs from a `Spool` one at a time, and builds them.
+
+    `build_options` are passed to `api.build` for every job.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        worker_id: Optional[str] = None,
+        heartbeat: float = 30,
+        stale_after: float = 300,
+        poll_interval: float = 5,
+        max_attempts: int = 3,
+        **build_options: Any,
+    ):
+        if stale_after <= heartbeat:
+            raise BarbariUserError(
+                "Claims must be allowed to go stale for longer than the "
+                "heartbeat interval."
+            )
+
+        self._spool = spool
+        self._worker_id = worker_id or get_worker_id()
+        self._heartbeat = heartbeat
+        self._stale_after = stale_after
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._build_options = build_options
+        self._stopping = threading.Event()
+
+        super().__init__()
+
+    @property
+    def worker_id(self) -> str:
+        return self._worker_id
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def run(self, drain: bool = False) -> int:
+        """Build jobs until stopped (or, if `drain`, until none are queued).
+
+        Returns the number of jobs finished.
+        """
+        finished = 0
+        while not self._stopping.is_set():
+            self._spool.reclaim_stale(
+                self._worker_id, self._stale_after, self._max_attempts
+            )
+
+            claimed = self._spool.claim(self._worker_id)
+            if claimed is None:
+                if drain:
+                    break
+                self._stopping.wait(self._poll_interval)
+                continue
+
+            job, claim_path = claimed
+            if self.run_job(job, claim_path) is not None:
+                finished += 1
+
+        return finished
+
+    def _keep_alive(
+        self, claim_path: str, done: threading.Event, lost: threading.Event
+    ) -> None:
+        while not done.wait(self._heartbeat):
+            if not self._spool.heartbeat(claim_path):
+                lost.set()
+                return
+
+    def run_job(self, job: SpoolJob, claim_path: str) -> Optional[Dict[str, Any]]:
+        """Build a claimed job; returns its status, or `None` if the claim was lost."""
+        started = time.time()
+        logger.info("Starting job %s (%s)", job.id, ", ".join(job.configs))
+
+        done, lost = threading.Event(), threading.Event()
+        keep_alive = threading.Thread(
+            target=self._keep_alive,
+            args=(claim_path, done, lost),
+            name=f"barbari-heartbeat-{job.id}",
+            daemon=True,
+        )
+        keep_alive.start()
+
+        status: Dict[str, Any] = {
+            **asdict(job),
+            "worker": self._worker_id,
+            "started": started,
+            "queued_seconds": started - job.submitted,
+            "error": None,
+            "files": [],
+        }
+        try:
+            result = api.build(
+                job.directory,
+                job.configs,
+                output_path=job.output_path,
+                metrics=Metrics(job=job.id),
+                **self._build_options,
+            )
+            status["status"] = JobStatus.SUCCEEDED.value
+            status["files"] = [os.path.basename(path) for path in result.gcode_files]
+            status["steps"] = [asdict(timing) for timing in result.timings]
+            status["tool_assignments"] = [
+                asdict(assignment) for assignment in result.plan.tool_assignments
+            ]
+            status["unassigned_tools"] = [
+                asdict(tool) for tool in result.plan.unassigned_tools
+            ]
+        except (BarbariError, BarbariFlatcamError) as e:
+            status["status"] = JobStatus.FAILED.value
+            status["error"] = str(e)
+        except KeyboardInterrupt:
+            self._spool.requeue(job, claim_path)
+            raise
+        except Exception:
+            logger.exception("Unexpected error running job %s", job.id)
+            status["status"] = JobStatus.FAILED.value
+            status["error"] = "Unexpected error; see the worker's log."
+        finally:
+            done.set()
+            keep_alive.join()
+
+        status["finished"] = time.time()
+        status["build_seconds"] = status["finished"] - started
+
+        if lost.is_set() or not self._spool.finish(claim_path, status):
+            logger.warning(
+                "Lost the claim on job %s (it was thought to be stale); "
+                "leaving it to whichever worker took it over.",
+                job.id,
+            )
+            return None
+
+        logger.info(
+            "Finished job %s: %s in %.1fs",
+            job.id,
+            status["status"],
+            status["build_seconds"],
+        )
+        return status
@@ -0,0 +1,307 @@
+"""Check generated g-code against the configuration that produced it.
+
+Every file is read into arrays at once (see `gcode.WordArrays`) so that
+even isolation routing programs having millions of lines are checked in
+about a second.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import Config
+from .constants import LayerType
+from .exceptions import BarbariUserError, InvalidGcode
+from .flatcam import FlatcamProcess, FlatcamWriteGcode
+from .gcode import fill_forward, MM_PER_INCH, NON_MODAL_CODES, WordArrays
+from .gerbers import GerberProject
+
+
+class VerificationError(BarbariUserError):
+    def __init__(self, violations: List[Violation]):
+        self.violations = violations
+
+        count = len(violations)
+        super().__init__(
+            f"Found {count} problem{'s' if count != 1 else ''} in the generated "
+            "g-code; it is not safe to run as-is."
+        )
+
+
+@dataclass
+class Limits:
+    """What one file's moves must stay within (in mm)."""
+
+    bounds: Tuple[Tuple[float, float], Tuple[float, float]]
+    cut_z: float
+    travel_z: float
+
+
+@dataclass
+class Violation:
+    filename: str
+    kind: str
+    message: str
+    # Line numbers (one-based) of every move breaking the same rule.
+    lines: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.intp))
+
+
+class Moves(NamedTuple):
+    """Every move in a program, in mm; `lines` are one-based."""
+
+    lines: np.ndarray
+    rapid: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+
+
+def read_moves(data: bytes) -> Moves:
+    words = WordArrays(data)
+
+    g_mask = words.letters == ord("G")
+    g_lines, g_values = words.lines[g_mask], words.values[g_mask]
+    if (g_values == 91.0).any():
+        line = g_lines[np.argmax(g_values == 91.0)] + 1
+        raise InvalidGcode(
+            f"Relative positioning (G91, on line {line}) cannot be verified."
+        )
+
+    motion = np.full(words.line_count, np.nan)
+    motion_mask = np.isin(g_values, (0.0, 1.0, 2.0, 3.0, 80.0)) | (
+        np.floor(g_values) == 38.0
+    )
+    motion[g_lines[motion_mask]] = g_values[motion_mask]
+    motion = fill_forward(motion, ~np.isnan(motion))
+
+    scale: np.ndarray | float = 1.0
+    units_mask = np.isin(g_values, (20.0, 21.0))
+    if (g_values[units_mask] == 20.0).any():
+        scale = np.full(words.line_count, np.nan)
+        scale[g_lines[units_mask]] = np.where(
+            g_values[units_mask] == 20.0, MM_PER_INCH, 1.0
+        )
+        scale = fill_forward(scale, ~np.isnan(scale))
+        scale[np.isnan(scale)] = 1.0
+
+    # Position is unknown after homing, setting offsets, etc.
+    resets = np.zeros(words.line_count, dtype=bool)
+    resets[g_lines[np.isin(g_values, list(NON_MODAL_CODES))]] = True
+    has_resets = resets.any()
+
+    has_axis = np.zeros(words.line_count, dtype=bool)
+    positions = []
+    for letter in "XYZ":
+        axis = words.get_line_values(letter) * scale
+        known = ~np.isnan(axis)
+        has_axis |= known
+        if has_resets:
+            axis[resets] = np.nan
+            known |= resets
+        positions.append(fill_forward(axis, known))
+
+    moves = np.flatnonzero(has_axis & ~resets & np.isin(motion, (0.0, 1.0, 2.0, 3.0)))
+    return Moves(
+        lines=moves + 1,
+        rapid=motion[moves] == 0.0,
+        x=positions[0][moves],
+        y=positions[1][moves],
+        z=positions[2][moves],
+    )
+
+
+def get_limits(
+    project: GerberProject,
+    config: Config,
+    processes: Iterable[FlatcamProcess],
+    margin: float = 1.0,
+) -> Dict[str, Limits]:
+    """Find the limits for each file written by `processes`.
+
+    Files may stray past the board's edges by the tool's diameter, by
+    however far outside the board the configuration mills (the cutout's
+    margin, alignment holes), and by `margin`.
+    """
+    edge_cuts = project.get_bounds(LayerType.EDGE_CUTS)
+    scale = MM_PER_INCH if edge_cuts.units == "inch" else 1.0
+    (min_x, max_x), (min_y, max_y) = [
+        (low * scale, high * scale) for low, high in edge_cuts.bounds
+    ]
+
+    outside = margin
+    if config.edge_cuts:
+        outside += config.edge_cuts.margin
+    if config.alignment_holes:
+        outside = max(
+            outside,
+            margin
+            + config.alignment_holes.hole_offset
+            + config.alignment_holes.hole_size,
+        )
+
+    processes = list(processes)
+    cnc_jobs = {
+        process.params["outname"]: process
+        for process in processes
+        if process.cmd in ("cncjob", "drillcncjob")
+    }
+
+    limits: Dict[str, Limits] = {}
+    for process in processes:
+        if not isinstance(process, FlatcamWriteGcode):
+            continue
+        job = cnc_jobs.get(process.layer)
+        if job is None:
+            continue
+
+        allowance = outside + float(process.tool_size)
+        if job.cmd == "drillcncjob":
+            cut_z, travel_z = job.params["drillz"], job.params["travelz"]
+        else:
+            cut_z, travel_z = job.params["z_cut"], job.params["z_move"]
+
+        limits[os.path.basename(process.filename)] = Limits(
+            bounds=(
+                (min_x - allowance, max_x + allowance),
+                (min_y - allowance, max_y + allowance),
+            ),
+            cut_z=float(cut_z),
+            travel_z=float(travel_z),
+        )
+
+    return limits
+
+
+def check_moves(
+    filename: str, moves: Moves, limits: Limits, tolerance: float = 0.01
+) -> List[Violation]:
+    (min_x, max_x), (min_y, max_y) = limits.bounds
+    checks: List[Tuple[str, np.ndarray, Callable[[int], str]]] = [
+        (
+            "depth",
+            moves.z < limits.cut_z - tolerance,
+            lambda index: (
+                f"cuts to Z{moves.z[index]:.3f}, deeper than the configured "
+                f"Z{limits.cut_z:.3f}."
+            ),
+        ),
+        (
+            "rapid",
+            moves.rapid & (moves.z < limits.travel_z - tolerance),
+            lambda index: (
+                f"rapid move at Z{moves.z[index]:.3f}, below the configured "
+                f"travel height of Z{limits.travel_z:.3f}."
+            ),
+        ),
+        (
+            "bounds",
+            (moves.x < min_x - tolerance)
+            | (moves.x > max_x + tolerance)
+            | (moves.y < min_y - tolerance)
+            | (moves.y > max_y + tolerance),
+            lambda index: (
+                f"moves to ({moves.x[index]:.3f}, {moves.y[index]:.3f}), outside "
+                f"of ({min_x:.3f}, {min_y:.3f}) - ({max_x:.3f}, {max_y:.3f})."
+            ),
+        ),
+    ]
+
+    violations: List[Violation] = []
+    for kind, mask, describe in checks:
+        if not mask.any():
+            continue
+
+        first = int(np.argmax(mask))
+        violations.append(
+            Violation(
+                filename,
+                kind,
+                f"Line {moves.lines[first]}: {describe(first)}",
+                moves.lines[mask],
+            )
+        )
+
+    return violations
+
+
+def check_envelope(
+    files: Sequence[Tuple[str, Moves]],
+    machine_size: Sequence[float],
+    tolerance: float = 0.01,
+) -> List[Violation]:
+    """Check that the job as a whole fits within the machine's travel.
+
+    Where the work is zeroed isn't known, so only the job's extent along
+    each axis is compared to the machine's; the first line at which the
+    job outgrows the machine is reported.
+    """
+    violations: List[Violation] = []
+    for axis, size in zip("xyz", machine_size):
+        values = np.concatenate([getattr(moves, axis) for _, moves in files])
+        known = ~np.isnan(values)
+        if not known.any():
+            continue
+        values = np.where(known, values, values[known][0])
+
+        extent = np.maximum.accumulate(values) - np.minimum.accumulate(values)
+        too_large = extent > size + tolerance
+        if not too_large.any():
+            continue
+
+        index = int(np.argmax(too_large))
+        for filename, moves in files:
+            if index < len(moves.lines):
+                break
+            index -= len(moves.lines)
+        violations.append(
+            Violation(
+                filename,
+                "envelope",
+                f"Line {moves.lines[index]}: the job spans more than the "
+                f"machine's {size:.1f}mm of {axis.upper()} travel.",
+                moves.lines[index : index + 1],
+            )
+        )
+
+    return violations
+
+
+def verify_directory(
+    directory: str,
+    filenames: Iterable[str],
+    limits: Dict[str, Limits],
+    machine_size: Optional[Sequence[float]] = None,
+    tolerance: float = 0.01,
+) -> List[Violation]:
+    violations: List[Violation] = []
+    files: List[Tuple[str, Moves]] = []
+    for filename in filenames:
+        if filename not in limits:
+            violations.append(
+                Violation(
+                    filename,
+                    "unknown",
+                    "Not written by this configuration; was it built with a different one?",
+                )
+            )
+            continue
+
+        with open(os.path.join(directory, filename), "rb") as inf:
+            data = inf.read()
+        try:
+            moves = read_moves(data)
+        except InvalidGcode as e:
+            violations.append(Violation(filename, "unreadable", str(e)))
+            continue
+
+        files.append((filename, moves))
+        violations.extend(check_moves(filename, moves, limits[filename], tolerance))
+
+    if machine_size and files:
+        violations.extend(check_envelope(files, machine_size, tolerance))
+
+    return violations
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .flatcam import FlatcamProcess, FlatcamWriteGcode
+from .optimizer import OPEN_COMMANDS, get_layer_usage
+
+logger = logging.getLogger(__name__)
+
+
+Snapshot = Dict[str, Tuple[float, int]]
+
+
+def take_snapshot(paths: Iterable[str]) -> Snapshot:
+    snapshot: Snapshot = {}
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (stat.st_mtime, stat.st_size)
+
+    return snapshot
+
+
+def get_changed_paths(before: Snapshot, after: Snapshot) -> Set[str]:
+    return {
+        path for path in set(before) | set(after) if before.get(path) != after.get(path)
+    }
+
+
+class PollingWatcher(object):
+    """Polls a set of files for changes, waiting for writes to settle.
+
+    Exports from KiCad arrive as a burst of writes to several files; a
+    change is only reported once no file has changed for `debounce`
+    seconds.
+    """
+
+    def __init__(
+        self,
+        get_paths: Callable[[], Iterable[str]],
+        interval: float = 0.5,
+        debounce: float = 1.0,
+    ):
+        self._get_paths = get_paths
+        self._interval = interval
+        self._debounce = debounce
+        self._snapshot = take_snapshot(get_paths())
+
+        super().__init__()
+
+    def wait(self) -> Set[str]:
+        """Block until files have changed, and return their paths."""
+        changed: Set[str] = set()
+        last_change: Optional[float] = None
+
+        while True:
+            time.sleep(self._interval)
+            snapshot = take_snapshot(self._get_paths())
+            newly_changed = get_changed_paths(self._snapshot, snapshot)
+            self._snapshot = snapshot
+
+            if newly_changed:
+                logger.debug("Changed: %s", newly_changed)
+                changed |= newly_changed
+                last_change = time.monotonic()
+            elif last_change is not None:
+                if time.monotonic() - last_change >= self._debounce:
+                    return changed
+
+
+def get_dependencies(processes: Sequence[FlatcamProcess], index: int) -> List[int]:
+    """Return the indexes of every process needed to run `processes[index]`."""
+    needed, _, _ = get_layer_usage(processes[index])
+    dependencies = [index]
+
+    for idx in range(index - 1, -1, -1):
+        inputs, outputs, _ = get_layer_usage(processes[idx])
+        if not outputs & needed:
+            continue
+
+        needed = (needed - outputs) | inputs
+        dependencies.append(idx)
+
+    dependencies.reverse()
+    return dependencies
+
+
+def get_stale_processes(
+    processes: Sequence[FlatcamProcess],
+    previous: Sequence[FlatcamProcess],
+    changed_paths: Set[str],
+) -> List[FlatcamProcess]:
+    """Return only the processes needed to rebuild out-of-date g-code.
+
+    A g-code file is out of date if it does not exist, if any of the
+    layer files it was generated from has changed, or if any step used to
+    generate it differs from the previous build (e.g. because the
+    configuration changed).  Steps touching no layer at all (e.g.
+    `quit_flatcam`) are kept whenever anything is rebuilt.
+    """
+    previous_steps = {str(process) for process in previous}
+    selected: Set[int] = set()
+    unconditional: Set[int] = set()
+
+    for idx, process in enumerate(processes):
+        if not isinstance(process, FlatcamWriteGcode):
+            inputs, outputs, keep = get_layer_usage(process)
+            if keep and not inputs and not outputs:
+                unconditional.add(idx)
+            continue
+
+        dependencies = get_dependencies(processes, idx)
+        stale = not os.path.exists(process.filename)
+        for dependency in dependencies:
+            step = processes[dependency]
+            if str(step) not in previous_steps:
+                stale = True
+            elif step.cmd in OPEN_COMMANDS and step.args[0] in changed_paths:
+                stale = True
+
+        if stale:
+            selected.update(dependencies)
+
+    if selected:
+        selected |= unconditional
+
+    return [process for idx, process in enumerate(processes) if idx in selected]
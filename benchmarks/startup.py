@@ -0,0 +1,84 @@
+"""Measure how long `barbari` takes to start for cheap subcommands.
+
+Run with ``python benchmarks/startup.py``; exits non-zero if the median
+startup time of any command exceeds ``--max-seconds`` or if a command
+imports a module it should not need.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Commands that should never need the gerber parser or the flatcam
+# generator, mapped to modules they must not import.
+COMMANDS = {
+    ("--help",): ["gerber", "pkg_resources", "rich", "barbari.commands.build"],
+    ("list-configs",): ["gerber", "pkg_resources", "barbari.commands.build"],
+    ("display-config", "simple"): ["gerber", "pkg_resources"],
+}
+
+PROBE = """
+import json, sys
+from barbari.main import main
+try:
+    main(*{argv!r})
+except SystemExit:
+    pass
+sys.stdout.flush()
+sys.stderr.write("\\n" + json.dumps(sorted(sys.modules)) + "\\n")
+"""
+
+
+def run_once(argv):
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE.format(argv=list(argv))],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    modules = json.loads(proc.stderr.strip().splitlines()[-1])
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Make sure the command index is warm; the first run after
+    # installing barbari is expected to be slower.
+    run_once(("--help",))
+
+    failed = False
+    for argv, forbidden in COMMANDS.items():
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, modules = run_once(argv)
+            timings.append(elapsed)
+
+        median = statistics.median(timings)
+        imported = [name for name in forbidden if name in modules]
+        status = "ok"
+        if median > args.max_seconds or imported:
+            status = "FAIL"
+            failed = True
+
+        print(
+            f"{' '.join(argv):<24} median {median * 1000:7.1f}ms "
+            f"min {min(timings) * 1000:7.1f}ms {status}"
+        )
+        if imported:
+            print(f"  unexpectedly imported: {', '.join(imported)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
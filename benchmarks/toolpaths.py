@@ -0,0 +1,176 @@
+"""Check that generated toolpaths haven't gotten slower to machine.
+
+Run with ``python benchmarks/toolpaths.py``.  Each reference project in
+``benchmarks/projects`` is built with each of the config stacks listed
+in ``CASES`` through the same pipeline as ``barbari build`` (planning
+and optimizing the flatcam steps, writing the script, running flatcam
+and compacting its g-code), and the result is compared against the
+baseline stored in ``benchmarks/toolpaths.json``.  Exits non-zero if any
+metric got worse than its baseline by more than ``--tolerance``.
+
+Script metrics (tool changes, board flips, files and steps) come from
+the plan; toolpath metrics (cut and rapid travel, plunges, estimated
+machining time) are measured from the g-code written.  By default the
+g-code is written by the stand-in for flatcam in ``tests/``, which
+writes the same short program for every ``write_gcode`` step, so its
+toolpath metrics follow the steps barbari plans rather than flatcam's
+own path planning.  To track real flatcam output, pass ``--flatcam``
+along with a ``--baseline`` file of its own.
+
+After an intentional change, record new baselines with ``--update``.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, List
+
+from barbari import api, optimizer, program
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTS_DIR = os.path.join(HERE, "projects")
+BASELINE_PATH = os.path.join(HERE, "toolpaths.json")
+FAKE_FLATCAM = os.path.join(os.path.dirname(HERE), "tests", "fake_flatcam.py")
+
+BASE_CONFIGS = [
+    "default_isolation_routing",
+    "default_alignment_holes",
+    "default_edge_cuts",
+]
+
+# Case name mapped to the reference project and config stack to use.
+CASES = {
+    "mixed_holes/simple": ("mixed_holes", ["simple"]),
+    "mixed_holes/drilled": (
+        "mixed_holes",
+        BASE_CONFIGS + ["drilled_04_10", "slots_10"],
+    ),
+    "mixed_holes/milled": ("mixed_holes", BASE_CONFIGS + ["milled_10", "slots_10"]),
+    "mixed_holes/wire_vias": (
+        "mixed_holes",
+        BASE_CONFIGS + ["copper_wire_vias", "drilled_04_10", "milled_10"],
+    ),
+}
+
+# Every metric is one where lower is better.
+SCRIPT_METRICS = ["tool_changes", "flips", "files", "steps", "unassigned_hits"]
+TOOLPATH_METRICS = ["cut_length", "rapid_length", "plunges", "duration"]
+
+
+def measure(
+    args: argparse.Namespace, project_name: str, configs: List[str]
+) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        # Work on a copy so that flatcam's output doesn't end up
+        # alongside the reference project.
+        for filename in os.listdir(os.path.join(PROJECTS_DIR, project_name)):
+            shutil.copy(os.path.join(PROJECTS_DIR, project_name, filename), directory)
+
+        result = api.build(
+            directory,
+            configs,
+            flatcam_path=args.flatcam or FAKE_FLATCAM,
+            python_bin=args.python_bin or sys.executable,
+        )
+
+        writes = result.plan.gcode_writes
+        tool_changes, flips = optimizer.count_setup_changes(writes)
+        stats = program.ToolpathStats()
+        for filename in result.gcode_files:
+            stats += program.Program.read(filename).get_toolpath_stats(args.rapid_rate)
+
+        return {
+            "tool_changes": tool_changes,
+            "flips": flips,
+            "files": len(result.gcode_files),
+            "steps": len(result.plan.processes),
+            "unassigned_hits": sum(tool.hits for tool in result.plan.unassigned_tools),
+            "cut_length": stats.cut_length,
+            "rapid_length": stats.rapid_length,
+            "plunges": stats.plunges,
+            "duration": stats.duration,
+        }
+
+
+def is_worse(current: float, baseline: float, tolerance: float) -> bool:
+    return current > baseline * (1 + tolerance) and current - baseline > 1e-6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--flatcam",
+        help="Path to flatcam executable (FlatCAM.py); defaults to a stand-in.",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_PATH,
+        help="Path to the baseline file to compare against or update.",
+    )
+    parser.add_argument("--python-bin", help="Python binary to run flatcam with.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="Fraction by which a metric may exceed its baseline.",
+    )
+    parser.add_argument(
+        "--rapid-rate",
+        type=float,
+        default=1000,
+        help="Speed (in mm/min) of rapid moves when estimating machining time.",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Record the measured metrics as the new baseline.",
+    )
+    parser.add_argument("cases", nargs="*", help="Cases to run; defaults to all.")
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, "r") as inf:
+            baselines = json.load(inf)
+    except FileNotFoundError:
+        baselines = {}
+
+    failed = False
+    for case in args.cases or CASES:
+        project_name, configs = CASES[case]
+        results = measure(args, project_name, configs)
+        baseline = baselines.get(case, {})
+
+        print(case)
+        for metric in SCRIPT_METRICS + TOOLPATH_METRICS:
+            status = "ok"
+            if metric not in baseline:
+                status = "new"
+            elif is_worse(results[metric], baseline[metric], args.tolerance):
+                status = "WORSE"
+                failed = True
+            elif results[metric] < baseline[metric]:
+                status = "better"
+
+            print(
+                f"  {metric:<16} {results[metric]:12.2f} "
+                f"baseline {baseline.get(metric, float('nan')):12.2f} {status}"
+            )
+
+        if args.update:
+            baselines[case] = results
+
+    if args.update:
+        with open(args.baseline, "w") as outf:
+            json.dump(baselines, outf, indent=2, sort_keys=True)
+            outf.write("\n")
+        print(f"Updated {args.baseline}.")
+        sys.exit(0)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -49,8 +49,21 @@ setup(
             "generate-config = barbari.commands.generate_config:Command",
             "build = barbari.commands.build:Command",
             "build-script = barbari.commands.build_script:Command",
+            "build-panel = barbari.commands.build_panel:Command",
+            "build-nest = barbari.commands.build_nest:Command",
+            "send = barbari.commands.send:Command",
+            "watch = barbari.commands.watch:Command",
+            "info = barbari.commands.info:Command",
+            "matrix = barbari.commands.matrix:Command",
+            "serve = barbari.commands.serve:Command",
+            "enqueue = barbari.commands.enqueue:Command",
+            "worker = barbari.commands.worker:Command",
+            "probe-grid = barbari.commands.probe_grid:Command",
+            "level = barbari.commands.level:Command",
+            "verify = barbari.commands.verify:Command",
             "list-configs = barbari.commands.list_configs:Command",
             "display-config = barbari.commands.display_config:Command",
+            "compile-config = barbari.commands.compile_config:Command",
             "setup-flatcam = barbari.commands.setup_flatcam:Command",
         ],
     },
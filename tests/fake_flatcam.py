@@ -0,0 +1,53 @@
+"""Stand-in for FlatCAM.py that runs barbari's FlatScripts instantly.
+
+Only the commands whose effects barbari can see are emulated: step
+markers are echoed, `write_gcode` writes a small program, and
+`quit_flatcam` exits.  Like FlatCAM, it keeps running once the script
+ends without quitting.
+"""
+
+import shlex
+import sys
+import time
+
+GCODE = """(fake flatcam output)
+G21
+G90
+G94
+G00 Z2.0000
+G00 X1.0000 Y1.0000
+G01 F100.00
+G01 Z-0.1000
+G01 X2.0000 Y1.0000
+G01 X2.0000 Y2.0000
+G00 Z2.0000
+M05
+"""
+
+
+def main(argv):
+    shellfile = None
+    for arg in argv:
+        if arg.startswith("--shellfile="):
+            shellfile = arg.split("=", 1)[1]
+
+    with open(shellfile, "r") as inf:
+        for line in inf:
+            for command in line.split(";"):
+                words = shlex.split(command)
+                if not words:
+                    continue
+                elif words[0] == "puts":
+                    print(words[-1], flush=True)
+                elif words[0] == "write_gcode":
+                    with open(words[2], "w") as outf:
+                        outf.write(GCODE)
+                elif words[0] == "quit_flatcam":
+                    return 0
+
+    while True:
+        time.sleep(60)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,95 @@
+import os
+import shutil
+
+import gerber
+import pytest
+
+from barbari import api, clearance, config, gerbers
+from barbari.constants import LayerType
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    return tmp_path
+
+
+def replace_line(path, old, new):
+    with open(path) as inf:
+        lines = inf.read().splitlines()
+    lines[lines.index(old)] = new
+    with open(path, "w") as outf:
+        outf.write("\n".join(lines) + "\n")
+
+
+def check(directory, tool_size=None):
+    return clearance.check_project(
+        gerbers.GerberProject(str(directory)),
+        config.get_merged_config(["simple"]),
+        tool_size=tool_size,
+    )
+
+
+def test_accepts_valid_project(project_dir):
+    assert check(project_dir) == []
+    api.plan(str(project_dir), ["simple"])
+
+
+def test_rejects_drill_too_close_to_copper(project_dir):
+    # Moves a via off the end of its back-side track, next to a pad.
+    replace_line(project_dir / "board.drl", "X7.0Y5.0", "X6.0Y5.0")
+
+    problems = check(project_dir)
+
+    assert [(problem.layer, problem.kind) for problem in problems] == [
+        (LayerType.B_CU, "drill")
+    ]
+    assert problems[0].position == pytest.approx((5.875, 5.0))
+    assert problems[0].clearance == pytest.approx(0.05)
+    with pytest.raises(
+        clearance.ClearanceError, match=r"0\.050mm on b_cu at \(5\.875, 5\.000\)"
+    ):
+        api.plan(str(project_dir), ["simple"])
+    api.plan(str(project_dir), ["simple"], preflight=False)
+
+
+def test_rejects_copper_too_close_together(project_dir):
+    # A track 0.05mm from the front-side track along Y=5.
+    replace_line(
+        project_dir / "board-F_Cu.gtl",
+        "M02*",
+        "D10*\nX8000000Y5300000D02*\nX15000000Y5300000D01*\nM02*",
+    )
+
+    problems = check(project_dir)
+
+    assert problems
+    assert {(problem.layer, problem.kind) for problem in problems} == {
+        (LayerType.F_CU, "copper")
+    }
+    assert min(problem.clearance for problem in problems) == pytest.approx(0.05)
+    # A narrow enough tool still fits.
+    assert check(project_dir, tool_size=0.04) == []
+
+
+def test_aperture_macros_are_outlined(tmp_path):
+    # A square pad turned 45°, and a track beside it; the track is within
+    # the pad's bounding box's corner, but well clear of the pad itself.
+    path = tmp_path / "board-F_Cu.gtl"
+    path.write_text(
+        "%FSLAX46Y46*%\n%MOMM*%\n"
+        "%AMDIAMOND*\n21,1,2.0,2.0,0,0,45*%\n"
+        "%ADD10C,0.200000*%\n%ADD11DIAMOND*%\n"
+        "D11*\nX0Y0D03*\n"
+        "D10*\nX1600000Y1000000D02*\nX1600000Y2000000D01*\n"
+        "M02*\n"
+    )
+    copper = clearance.CopperLayer(LayerType.F_CU, gerber.read(str(path)))
+
+    assert clearance.ClearanceChecker(copper, 0.2).check_copper() == []
+    (problem,) = clearance.ClearanceChecker(copper, 0.8).check_copper()
+    assert problem.clearance == pytest.approx((2.6 - 2**0.5) / 2**0.5 - 0.1)
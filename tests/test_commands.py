@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from barbari import commands, main
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "commands.json"
+    monkeypatch.setattr(commands, "get_command_cache_path", lambda: str(path))
+    return path
+
+
+def test_index_is_cached(cache_path):
+    found = commands.get_installed_commands()
+
+    assert "build" in found
+    assert json.loads(cache_path.read_text())["commands"].keys() == found.keys()
+
+
+def test_command_missing_from_cache_is_found(cache_path, capsys):
+    commands.get_installed_commands()
+    # As if `list-configs` had been added after the index was cached,
+    # without changing anything the cache key covers.
+    cached = json.loads(cache_path.read_text())
+    del cached["commands"]["list-configs"]
+    cache_path.write_text(json.dumps(cached))
+    assert "list-configs" not in commands.get_installed_commands()
+
+    main.main("list-configs")
+
+    assert "list-configs" in commands.get_installed_commands()
+
+
+def test_unknown_command_is_rejected(cache_path):
+    with pytest.raises(SystemExit):
+        main.main("no-such-command")
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from barbari import config, exceptions
+
+
+def test_isolation_routing_tools():
+    merged = config.get_merged_config(["simple"])
+    small = merged._data["isolation_routing"]
+    large = dict(small, tool_size=0.8)
+    merged._data["isolation_routing"] = [small, large]
+
+    assert [tool.tool_size for tool in merged.isolation_routing_tools] == [0.8, 0.18]
+    assert merged.isolation_routing.tool_size == 0.18
+
+    del large["passes"]
+    with pytest.raises(exceptions.InvalidConfiguration, match="passes"):
+        merged.validate()
+
+
+def test_merged_config_is_validated_on_load(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    os.makedirs(config.get_user_config_dir())
+    with open(os.path.join(config.get_user_config_dir(), "broken.yaml"), "w") as outf:
+        outf.write("tool_clustering:\n  tolerance: -1\n")
+
+    with pytest.raises(exceptions.InvalidConfiguration, match="tolerance"):
+        config.get_merged_config(["simple", "broken"])
@@ -0,0 +1,111 @@
+import logging
+import os
+import re
+
+import gerber
+import numpy as np
+import pytest
+
+from barbari import excellon
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__),
+    os.pardir,
+    "benchmarks",
+    "projects",
+    "mixed_holes",
+    "board.drl",
+)
+
+
+def write_suppressed(path, zeros):
+    """Rewrite the fixture's coordinates as 3:3 integers, zeros suppressed."""
+
+    def format_number(match):
+        value = float(match.group(2))
+        digits = f"{round(abs(value) * 1000):06d}"
+        # LZ keeps leading zeros, dropping trailing ones; TZ the reverse.
+        digits = digits.rstrip("0") if zeros == "LZ" else digits.lstrip("0")
+        return match.group(1) + ("-" if value < 0 else "") + (digits or "0")
+
+    lines = []
+    body = False
+    with open(FIXTURE) as inf:
+        for line in inf.read().splitlines():
+            if line.startswith(("; FORMAT", "FMAT")):
+                # pcb-tools only understands Altium's format comment.
+                continue
+            elif line == "METRIC":
+                lines.extend([";FILE_FORMAT=3:3", f"METRIC,{zeros}"])
+                continue
+            elif line == "%":
+                body = True
+            elif body and not line.startswith("T"):
+                line = re.sub(r"([XY])([-\d.]+)", format_number, line)
+            lines.append(line)
+
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def assert_same_layer(actual, expected):
+    assert actual.units == expected.units
+    assert {number: tool.diameter for number, tool in actual.tools.items()} == {
+        number: tool.diameter for number, tool in expected.tools.items()
+    }
+    for name in ("hits", "slots"):
+        actual_coordinates = getattr(actual, name)
+        expected_coordinates = getattr(expected, name)
+        assert actual_coordinates.keys() == expected_coordinates.keys()
+        for number, coordinates in actual_coordinates.items():
+            np.testing.assert_allclose(coordinates, expected_coordinates[number])
+
+
+@pytest.mark.parametrize("zeros", [None, "LZ", "TZ"])
+def test_matches_pcb_tools(tmp_path, zeros):
+    path = write_suppressed(tmp_path / "board.drl", zeros) if zeros else FIXTURE
+
+    with open(path) as inf:
+        layer = excellon.ExcellonReader(path).read(inf)
+
+    assert layer.hit_count == 9
+    assert_same_layer(layer, excellon.ExcellonLayer.from_pcb_tools(gerber.read(path)))
+
+
+def test_unsupported_statement_falls_back_to_pcb_tools(tmp_path, caplog):
+    path = tmp_path / "board.drl"
+    # Three more holes, each 1mm to the right of the last.
+    path.write_text(
+        "M48\nMETRIC\nT1C0.800\n%\nG90\nG05\nT1\nX5.0Y5.0\nR3X1.0\nT0\nM30\n"
+    )
+
+    with pytest.raises(excellon.UnsupportedExcellon, match="R3X1.0"):
+        with open(path) as inf:
+            excellon.ExcellonReader(str(path)).read(inf)
+
+    with caplog.at_level(logging.DEBUG, logger="barbari.excellon"):
+        layer = excellon.read(str(path))
+
+    assert "using pcb-tools" in caplog.text
+    assert layer.hits[1].tolist() == [[5.0, 5.0], [6.0, 5.0], [7.0, 5.0], [8.0, 5.0]]
+
+
+def test_cluster_diameters():
+    diameters = {1: 0.80, 2: 0.82, 3: 0.85, 4: 1.00, 5: 1.02, 6: 3.00}
+    hit_counts = {1: 2, 2: 10, 3: 1, 4: 5, 5: 1, 6: 4}
+
+    # Diameters within the tolerance of a group's smallest share the
+    # diameter of its most-hit member; the rest are left alone.
+    assert excellon.cluster_diameters(diameters, hit_counts, tolerance=0.05) == {
+        1: 0.82,
+        2: 0.82,
+        3: 0.82,
+        4: 1.00,
+        5: 1.00,
+        6: 3.00,
+    }
+    assert excellon.cluster_diameters(diameters, hit_counts) == diameters
+    # Stock sizes take precedence over grouping.
+    assert excellon.cluster_diameters(
+        diameters, hit_counts, tolerance=0.05, stock_sizes=[0.78]
+    ) == {1: 0.78, 2: 0.78, 3: 0.85, 4: 1.00, 5: 1.00, 6: 3.00}
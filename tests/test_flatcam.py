@@ -0,0 +1,98 @@
+import os
+import shutil
+
+import pytest
+
+from barbari import api, config
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    return tmp_path
+
+
+def get_copper_script(directory, isolation_routing):
+    conf = config.get_merged_config(["simple"])
+    conf._data["isolation_routing"] = isolation_routing
+    conf.validate()
+
+    script = api.plan(str(directory), conf, preflight=False).get_script()
+    return [
+        line.replace(f"{directory}{os.sep}", "")
+        for line in script.splitlines()
+        if line.split(" ")[0] in ("isolate", "cncjob", "write_gcode")
+        and line.split(" ")[1].startswith(("b_cu", "f_cu"))
+    ]
+
+
+def get_tool(**params):
+    return {
+        "tool_size": 0.18,
+        "passes": 5,
+        "pass_overlap": 0.5,
+        "cut_z": -0.2,
+        "travel_z": 2,
+        "feed_rate": 200,
+        "spindle_speed": 12000,
+        **params,
+    }
+
+
+def test_single_isolation_tool(project_dir):
+    assert get_copper_script(project_dir, get_tool()) == [
+        "isolate b_cu -dia 0.18 -passes 5 -overlap 0.5 -combine 1 "
+        "-outname b_cu_path",
+        "cncjob b_cu_path -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.18 "
+        "-spindlespeed 12000 -outname b_cu_cnc",
+        "write_gcode b_cu_cnc 02.b_cu.0.18.engraving_bit.gcode",
+        "isolate f_cu -dia 0.18 -passes 5 -overlap 0.5 -combine 1 "
+        "-outname f_cu_path",
+        "cncjob f_cu_path -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.18 "
+        "-spindlespeed 12000 -outname f_cu_cnc",
+        "write_gcode f_cu_cnc 03.f_cu.0.18.engraving_bit.gcode",
+    ]
+
+
+def test_isolation_tools_run_largest_first(project_dir):
+    script = get_copper_script(
+        project_dir, [get_tool(), get_tool(tool_size=0.8, passes=2)]
+    )
+
+    assert [line for line in script if line.startswith("isolate")] == [
+        "isolate b_cu -dia 0.8 -passes 2 -overlap 0.5 -combine 1 "
+        "-outname b_cu_path_1",
+        "isolate b_cu -dia 0.18 -passes 5 -overlap 0.5 -combine 1 "
+        "-outname b_cu_path_2",
+        "isolate f_cu -dia 0.8 -passes 2 -overlap 0.5 -combine 1 "
+        "-outname f_cu_path_1",
+        "isolate f_cu -dia 0.18 -passes 5 -overlap 0.5 -combine 1 "
+        "-outname f_cu_path_2",
+    ]
+    assert [line for line in script if line.startswith("cncjob")] == [
+        "cncjob b_cu_path_1 -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.8 "
+        "-spindlespeed 12000 -outname b_cu_cnc_1",
+        "cncjob b_cu_path_2 -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.18 "
+        "-spindlespeed 12000 -outname b_cu_cnc_2",
+        "cncjob f_cu_path_1 -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.8 "
+        "-spindlespeed 12000 -outname f_cu_cnc_1",
+        "cncjob f_cu_path_2 -z_cut -0.2 -z_move 2 -feedrate 200 -dia 0.18 "
+        "-spindlespeed 12000 -outname f_cu_cnc_2",
+    ]
+    # Each tool gets its own file, and on each side the larger tool's
+    # file runs first.
+    writes = sorted(
+        line.split(" ")[2] for line in script if line.startswith("write_gcode")
+    )
+    assert [write.split(".", 1)[1] for write in writes if ".b_cu." in write] == [
+        "b_cu.0.8.engraving_bit.gcode",
+        "b_cu.0.18.engraving_bit.gcode",
+    ]
+    assert [write.split(".", 1)[1] for write in writes if ".f_cu." in write] == [
+        "f_cu.0.8.engraving_bit.gcode",
+        "f_cu.0.18.engraving_bit.gcode",
+    ]
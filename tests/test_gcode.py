@@ -0,0 +1,66 @@
+import pytest
+
+from barbari import gcode
+from barbari.exceptions import InvalidGcode
+
+
+def transform(lines, quarter_turns, dx=0.0, dy=0.0):
+    return [
+        line.strip()
+        for line in gcode.transform_lines(
+            [f"{line}\n" for line in lines],
+            gcode.Transform(dx, dy, quarter_turns),
+        )
+    ]
+
+
+def test_transform_rotates_moves_naming_one_axis():
+    assert transform(["G00 X1.0 Y2.0", "G01 X3.0", "G01 Y4.0"], 1, dx=10.0) == [
+        "G00 X8.0 Y1.0",
+        "G01 X8.0 Y3.0",
+        "G01 X6.0 Y3.0",
+    ]
+
+
+def test_transform_rejects_move_from_unknown_position():
+    with pytest.raises(InvalidGcode, match="line 2"):
+        transform(["G21 G90", "G00 X1.0", "G00 Y2.0"], 1)
+
+
+def test_transform_incremental_move_from_unknown_position():
+    _, moved = transform(["G91", "G01 X1.0"], 1)
+
+    assert gcode.get_words(moved) == [("G", 1.0), ("X", 0.0), ("Y", 1.0)]
+
+
+def test_compact_file(tmp_path):
+    path = tmp_path / "board.gcode"
+    path.write_text(
+        "G21 G90 (metric)\n"
+        "G00 Z2.0000\n"
+        "G00 X1.0000 Y1.0000\n"
+        "G01 Z-0.1000 F100.00\n"
+        "G01 X2.0000 Y1.0000 F100.00\n"
+        "G01 X2.0000 Y2.0004 F100.00\n"
+    )
+
+    before, after = gcode.compact_file(str(path))
+
+    assert path.read_text().splitlines() == [
+        "G21 G90",
+        "G0 Z2",
+        "X1 Y1",
+        "G1 Z-0.1 F100",
+        "X2",
+        "Y2",
+    ]
+    assert (before, after) == (126, 40)
+
+
+def test_compact_file_relative(tmp_path):
+    path = tmp_path / "board.gcode"
+    path.write_text("G91\nG01 X1.0000 F100.00\nG01 X1.0000 F100.00\n")
+
+    gcode.compact_file(str(path))
+
+    assert path.read_text().splitlines() == ["G91", "G1 X1 F100", "X1"]
@@ -0,0 +1,143 @@
+import math
+
+import numpy as np
+import pytest
+
+from barbari import geometry, gerbers
+from barbari.constants import LayerType
+
+# A trace, three flashes of a rectangular aperture and two of an
+# aperture macro (a rectangle with round ends and a hole), a trace
+# drawn as an arc, a region and a clear flash on top of it.
+COPPER = """\
+%FSLAX46Y46*%
+%MOMM*%
+%AMROUNDRECT*
+21,1,2.0,1.0,0,0,0*
+1,1,1.0,1.0,0*
+1,1,1.0,-1.0,0*
+1,0,0.5,0,0*%
+%ADD10C,0.500000*%
+%ADD11R,2.000000X1.000000*%
+%ADD12ROUNDRECT*%
+%ADD13C,1.000000*%
+%LPD*%
+G01*
+D10*
+X0Y0D02*
+X10000000Y0D01*
+D11*
+X20000000Y0D03*
+X25000000Y0D03*
+X30000000Y0D03*
+D12*
+X40000000Y0D03*
+X45000000Y0D03*
+G75*
+D10*
+X50000000Y0D02*
+G03*
+X60000000Y0I5000000J0D01*
+G01*
+G36*
+X0Y10000000D02*
+X10000000Y10000000D01*
+X10000000Y20000000D01*
+X0Y20000000D01*
+X0Y10000000D01*
+G37*
+%LPC*%
+D13*
+X5000000Y15000000D03*
+M02*
+"""
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / "board-F_Cu.gtl").write_text(COPPER)
+    (tmp_path / "board-B_Cu.gbl").write_text(COPPER)
+    return gerbers.GerberProject(str(tmp_path))
+
+
+def get_bounds(points):
+    return np.concatenate([points.min(axis=0), points.max(axis=0)]).tolist()
+
+
+def get_polygons(layer_geometry):
+    return [
+        (layer_geometry.get_polygon(index), bool(layer_geometry.dark[index]))
+        for index in range(len(layer_geometry))
+    ]
+
+
+def test_flashes_share_an_outline(project):
+    flattener = geometry.Flattener()
+    polygons = get_polygons(flattener.flatten(project.get_layer(LayerType.F_CU)))
+
+    rectangles = [points for points, _ in polygons[1:4]]
+    for points, x in zip(rectangles, (20, 25, 30)):
+        assert get_bounds(points) == pytest.approx([x - 1, -0.5, x + 1, 0.5])
+        np.testing.assert_allclose(points, rectangles[0] + (x - 20, 0))
+    # The trace's round aperture, the rectangle and the macro.
+    assert flattener.template_count == 3
+
+
+def test_aperture_macro(project):
+    polygons = get_polygons(
+        geometry.Flattener().flatten(project.get_layer(LayerType.F_CU))
+    )
+
+    for offset, start in ((0, 4), (5, 8)):
+        (rectangle, dark), *ends, (hole, hole_dark) = polygons[start : start + 4]
+        assert dark and not hole_dark
+        assert sorted(map(tuple, rectangle.round(6).tolist())) == [
+            (39.0 + offset, -0.5),
+            (39.0 + offset, 0.5),
+            (41.0 + offset, -0.5),
+            (41.0 + offset, 0.5),
+        ]
+        right, left = (get_bounds(points) for points, _ in ends)
+        assert right == pytest.approx([40.5 + offset, -0.5, 41.5 + offset, 0.5])
+        assert left == pytest.approx([38.5 + offset, -0.5, 39.5 + offset, 0.5])
+        assert get_bounds(hole) == pytest.approx(
+            [39.75 + offset, -0.25, 40.25 + offset, 0.25]
+        )
+
+
+def test_clear_polarity(project):
+    polygons = get_polygons(
+        geometry.Flattener().flatten(project.get_layer(LayerType.F_CU))
+    )
+
+    # The clear flash comes after the region it clears part of.
+    (region, region_dark), (hole, hole_dark) = polygons[-2:]
+    assert region_dark and not hole_dark
+    assert get_bounds(region) == pytest.approx([0, 10, 10, 20])
+    assert get_bounds(hole) == pytest.approx([4.5, 14.5, 5.5, 15.5])
+
+
+def test_arc(project):
+    polygons = get_polygons(
+        geometry.Flattener().flatten(project.get_layer(LayerType.F_CU))
+    )
+
+    # Counterclockwise from (50, 0) to (60, 0) around (55, 0) passes
+    # beneath the center.
+    arc = np.concatenate([points for points, _ in polygons[12:-2]])
+    assert get_bounds(arc) == pytest.approx([49.75, -5.25, 60.25, 0.25], abs=0.01)
+    radii = np.hypot(arc[:, 0] - 55, arc[:, 1])
+    assert radii.min() >= 4.75 - 1e-6 and radii.max() <= 5.25 + 1e-6
+    assert (radii < 4.76).any() and (radii > 5.24).any()
+    # Chords are no longer than `CHORD_LENGTH` along the trace's center.
+    assert len(polygons) - 14 >= math.ceil(math.pi * 5 / geometry.CHORD_LENGTH)
+
+
+def test_project_geometry_shares_outlines_between_layers(project):
+    front = project.get_geometry(LayerType.F_CU)
+    count = project.flattener.template_count
+    back = project.get_geometry(LayerType.B_CU)
+
+    assert project.flattener.template_count == count
+    np.testing.assert_allclose(front.points, back.points)
+    assert project.get_geometry(LayerType.F_CU) is front
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+from barbari.constants import LayerType
+from barbari.gerbers import GerberProject
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+
+
+def test_layers_found_by_name(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+
+    paths = GerberProject(str(tmp_path)).get_layer_paths()
+
+    assert set(paths) == {
+        LayerType.B_CU,
+        LayerType.F_CU,
+        LayerType.EDGE_CUTS,
+        LayerType.DRILL,
+    }
+
+
+def test_files_named_like_layers_are_skipped(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    # Sorted after the real layers, so they'd replace them if accepted.
+    (tmp_path / "board-F_Cu.gtl.txt").write_text("Notes about the front copper.\n")
+    (tmp_path / "board.drl.orig.drl").write_text("not a drill file\n")
+    (tmp_path / "board-Edge_Cuts.gm1.zip").write_bytes(b"PK\x03\x04\x00\x00")
+
+    paths = GerberProject(str(tmp_path)).get_layer_paths()
+
+    assert os.path.basename(paths[LayerType.F_CU]) == "board-F_Cu.gtl"
+    assert os.path.basename(paths[LayerType.DRILL]) == "board.drl"
+    assert os.path.basename(paths[LayerType.EDGE_CUTS]) == "board-Edge_Cuts.gm1"
+
+
+def test_misnamed_file_is_not_a_layer(tmp_path):
+    (tmp_path / "board-B_Cu.gbl").write_text("This file was emptied.\n")
+
+    assert GerberProject(str(tmp_path)).get_layer_paths() == {}
@@ -0,0 +1,37 @@
+import numpy as np
+
+from barbari import leveling
+
+
+def test_bilinear_heights():
+    # 0.1mm high at x=10, 0.2mm at y=20 and 0.4mm at the far corner.
+    height_map = leveling.HeightMap([0, 10], [0, 20], [[0.0, 0.1], [0.2, 0.4]])
+
+    x = np.array([0, 10, 0, 10, 5, 5, 2.5])
+    y = np.array([0, 0, 20, 20, 10, 0, 15])
+    np.testing.assert_allclose(
+        height_map.get_heights(x, y),
+        [
+            # Corners
+            0.0,
+            0.1,
+            0.2,
+            0.4,
+            # Centre
+            0.175,
+            # Midway along an edge, and in between.
+            0.05,
+            0.75 * (0.75 * 0.2 + 0.25 * 0.4) + 0.25 * (0.75 * 0.0 + 0.25 * 0.1),
+        ],
+    )
+
+
+def test_heights_off_the_grid_use_its_edge():
+    height_map = leveling.HeightMap([0, 10], [0, 20], [[0.0, 0.1], [0.2, 0.4]])
+
+    x = np.array([-5, 15, 5, 5, -5, 100])
+    y = np.array([0, 20, -10, 30, -10, 100])
+    np.testing.assert_allclose(
+        height_map.get_heights(x, y),
+        [0.0, 0.4, 0.05, 0.3, 0.0, 0.4],
+    )
@@ -0,0 +1,129 @@
+import os
+import shutil
+
+import pytest
+
+from barbari import api, config, optimizer
+from barbari.flatcam import FlatcamWriteGcode
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    return tmp_path
+
+
+def get_script(directory, conf):
+    plan = api.plan(str(directory), conf, preflight=False)
+    return [str(process).split(" ")[0] for process in plan.processes], [
+        os.path.basename(write.filename) for write in plan.gcode_writes
+    ]
+
+
+def get_config(**alignment_holes):
+    conf = config.get_merged_config(["simple"])
+    # Cut the alignment holes just as the `milled` drill profile cuts
+    # its holes.
+    conf._data["alignment_holes"].update(
+        conf._data["drill"]["milled"]["specs"][0]["params"], **alignment_holes
+    )
+    return conf
+
+
+def test_alignment_holes_merge_with_matching_drill_chain(project_dir):
+    commands, files = get_script(project_dir, get_config())
+
+    assert files[0] == "01.alignment_holes+drill_milled+slot_large.1.end_mill.gcode"
+    assert not any("drill_milled" in filename for filename in files[1:])
+    assert commands.count("join_geometries") == 1
+    assert commands.count("cncjob") == 4
+
+
+def test_alignment_holes_kept_apart_when_parameters_differ(project_dir):
+    _, files = get_script(project_dir, get_config(cut_z=-10))
+
+    assert files[0] == "01.alignment_holes.1.end_mill.gcode"
+    assert "drill_milled+slot_large" in files[1]
+
+
+def test_unused_layers_are_not_loaded(project_dir):
+    conf = get_config()
+    del conf._data["isolation_routing"]
+
+    plan = api.plan(str(project_dir), conf, preflight=False)
+    script = plan.get_script()
+
+    # Nothing mills the copper, so neither side is opened (or mirrored).
+    assert "-outname b_cu" not in script
+    assert "-outname f_cu" not in script
+    assert "mirror" not in script
+    assert "-outname edge_cuts" in script
+    assert "-outname drill" in script
+
+
+def get_writes(*files):
+    return [
+        FlatcamWriteGcode(f"{name}_cnc", "/tmp", idx, name, tool_name, tool_size)
+        for idx, (name, tool_name, tool_size) in enumerate(files, start=1)
+    ]
+
+
+def get_order(writes, order):
+    return [writes[idx].name for idx in order]
+
+
+def test_sequence_minimizes_tool_changes_and_flips():
+    writes = get_writes(
+        ("f_cu", "engraving_bit", 0.8),
+        ("f_cu", "engraving_bit", 0.18),
+        ("b_cu", "engraving_bit", 0.8),
+        ("b_cu", "engraving_bit", 0.18),
+    )
+
+    order = optimizer.get_sequence(writes)
+
+    # Each side's tools stay largest first, but rather than changing
+    # tools twice, the board is flipped and flipped back.
+    assert order == [0, 2, 3, 1]
+    assert optimizer.count_setup_changes(writes) == (3, 1)
+    assert optimizer.count_setup_changes([writes[idx] for idx in order]) == (1, 2)
+
+
+def test_sequence_keeps_first_and_last_files_in_place():
+    writes = get_writes(
+        ("edge_cuts", "end_mill", 1.5),
+        ("drill_via", "drill", 0.4),
+        ("b_cu", "engraving_bit", 0.18),
+        ("alignment_holes+drill_milled", "end_mill", 1.5),
+        ("f_cu", "engraving_bit", 0.18),
+    )
+
+    order = get_order(writes, optimizer.get_sequence(writes))
+
+    # Running the alignment holes and cutout together would save a tool
+    # change, but the board can't be flipped without the former, nor
+    # milled after the latter.
+    assert order[0] == "alignment_holes+drill_milled"
+    assert order[-1] == "edge_cuts"
+
+
+def test_sequence_falls_back_to_greedy_for_many_files():
+    writes = get_writes(
+        ("f_cu", "engraving_bit", 0.8),
+        ("f_cu", "engraving_bit", 0.18),
+        ("b_cu", "engraving_bit", 0.8),
+        ("b_cu", "engraving_bit", 0.18),
+        *[(f"drill_{idx}", "drill", 1.0) for idx in range(11)],
+    )
+    assert len(writes) > optimizer.MAX_EXHAUSTIVE_SEQUENCE
+
+    order = optimizer.get_sequence(writes)
+
+    # Each step takes the cheapest file available; searching exhaustively
+    # would instead trade two of these tool changes for one more flip.
+    assert order == [0, 1, *range(4, 15), 2, 3]
+    assert optimizer.count_setup_changes([writes[idx] for idx in order]) == (4, 1)
@@ -0,0 +1,109 @@
+import io
+import math
+
+import numpy as np
+import pytest
+
+from barbari import gcode
+from barbari.program import Program
+
+
+def parse(lines):
+    return Program.parse("".join(f"{line}\n" for line in lines).encode())
+
+
+def write(program):
+    outf = io.BytesIO()
+    program.write(outf)
+    return outf.getvalue().decode().splitlines()
+
+
+MOTION_PROGRAMS = [
+    ["G21", "G90", "G00 X1.0 Y1.0", "G01 F100.00", "X2.0 Y2.0", "Y3.0"],
+    ["G00 Z2.0", "G01", "G00 X1.0", "X2.0"],
+    ["G01 X1.0 F100", "G00", "G01 Y1.0", "G00 Z1.0", "X3.0"],
+    ["G00 X0.0 Y0.0", "G02 X2.0 Y0.0 I1.0 J0.0 F50", "G00 X2.0 Y0.0", "G01 X3.0"],
+]
+
+
+def get_moves(lines):
+    blocks = parse(lines).blocks
+    moves = []
+    for block in blocks[blocks["move"]]:
+        move = tuple(
+            None if np.isnan(block[column]) else float(block[column])
+            for column in ("motion", "x", "y", "z", "i", "j", "feed")
+        )
+        # Moves to where the tool already is are dropped when compacting.
+        if not moves or move[1:4] != moves[-1][1:4]:
+            moves.append(move)
+    return moves
+
+
+@pytest.mark.parametrize("lines", MOTION_PROGRAMS)
+def test_compact_keeps_motion_mode(lines):
+    compacted = list(gcode.compact_lines(f"{line}\n" for line in lines))
+
+    assert get_moves(compacted) == get_moves(lines)
+
+
+@pytest.mark.parametrize("lines", MOTION_PROGRAMS)
+def test_write_keeps_motion_mode(lines):
+    assert get_moves(write(parse(lines))) == get_moves(lines)
+
+
+def test_compact_writes_motion_with_next_move():
+    source = ["G00 X1 Y1\n", "G01 F100.00\n", "X2.0 Y2.0\n"]
+
+    assert list(gcode.compact_lines(source)) == [
+        "G0 X1 Y1\n",
+        "F100\n",
+        "G1 X2 Y2\n",
+    ]
+
+
+# Each has coordinates, arc centers or feed rates exactly half way
+# between two values that can be written.
+TIE_PROGRAMS = [
+    ["G21 G90", "G00 Z2.0", "G00 X51.1275 Y0.0005", "G01 Z-0.1 F100.0005"],
+    ["G00 X0.0 Y0.0", "G02 X2.0025 Y0.0 I1.00125 J0.0 F50", "G02 X4.0 Y0.0 Z-0.0005"],
+    ["G20", "G00 X1.00005 Y0.12345", "G01 X2.00015 F3.93705", "G21", "G01 X50.8"],
+]
+
+
+@pytest.mark.parametrize("lines", TIE_PROGRAMS)
+def test_compact_matches_write(lines):
+    compacted = [
+        line.rstrip("\n") for line in gcode.compact_lines(f"{line}\n" for line in lines)
+    ]
+
+    assert compacted == write(parse(lines))
+
+
+def test_toolpath_stats():
+    stats = parse(
+        [
+            "G21 G90",
+            "G00 Z2.0",
+            "G00 X3.0 Y4.0",
+            "G01 Z-0.1 F60",
+            # Half a circle of radius 1, over the top.
+            "G02 X5.0 Y4.0 I1.0 J0.0",
+            "G04 P1.5",
+            "G00 Z2.0",
+            # Homing forgets the position; the tool is taken to be where
+            # it was.
+            "G28",
+            "G20",
+            "G01 X1.0 F10",
+        ]
+    ).get_toolpath_stats(rapid_rate=600.0)
+
+    cut = 2.1 + math.pi + 20.4
+    rapid = 2.0 + 5.0 + 2.1
+    assert stats.cut_length == pytest.approx(cut)
+    assert stats.rapid_length == pytest.approx(rapid)
+    assert stats.plunges == 1
+    assert stats.duration == pytest.approx(
+        rapid / 600.0 * 60 + (2.1 + math.pi) + 1.5 + 20.4 / 254.0 * 60
+    )
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+from barbari.exceptions import FlatcamTimeout
+from barbari.flatcam import FlatcamStepMarker
+from barbari.runner import FlatcamRunner
+
+FAKE_FLATCAM = os.path.join(os.path.dirname(__file__), "fake_flatcam.py")
+
+
+def get_runner(tmp_path, processes, **kwargs):
+    path = tmp_path / "script.FlatScript"
+    path.write_text("".join(f"{process}\n" for process in processes))
+    return FlatcamRunner(
+        [sys.executable, FAKE_FLATCAM, f"--shellfile={path}"], processes, **kwargs
+    )
+
+
+def test_startup_timeout(tmp_path):
+    # Never reaches a step marker, as though FlatCAM hung while starting.
+    runner = get_runner(tmp_path, [], step_timeout=0.5)
+
+    with pytest.raises(FlatcamTimeout, match="did not start"):
+        runner.run()
+
+
+def test_separate_startup_timeout(tmp_path):
+    runner = get_runner(tmp_path, [], step_timeout=60, startup_timeout=0.5)
+
+    with pytest.raises(FlatcamTimeout, match="within 0.5 seconds"):
+        runner.run()
+
+
+def test_step_timeout(tmp_path):
+    # Starts the first step, then never finishes the script.
+    runner = get_runner(tmp_path, [FlatcamStepMarker(0)], step_timeout=0.5)
+
+    with pytest.raises(FlatcamTimeout, match="step 0 did not finish"):
+        runner.run()
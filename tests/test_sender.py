@@ -0,0 +1,81 @@
+import pytest
+
+from barbari import sender
+
+serial = pytest.importorskip("serial")
+
+
+PROGRAM = ["G21", "G90", "G00 Z2.0 (retract)"] + [
+    f"G01 X{idx}.000 Y{idx % 7}.000 F100" for idx in range(200)
+]
+
+
+@pytest.fixture
+def grbl(request):
+    simulator = sender.SimulatedGrbl(**getattr(request, "param", {})).start()
+    connection = serial.Serial(simulator.port, 115200, timeout=1)
+    yield simulator, connection
+    connection.close()
+    simulator.stop()
+
+
+def get_sender(connection, **kwargs):
+    grbl = sender.GrblSender(connection, **kwargs)
+    grbl.wake(delay=0.1)
+    return grbl
+
+
+@pytest.mark.parametrize(
+    "grbl", [{"rx_buffer_size": 64, "line_delay": 0.002}], indirect=True
+)
+def test_stream_keeps_buffer_full_without_overflowing(grbl):
+    simulator, connection = grbl
+
+    stats = get_sender(connection, rx_buffer_size=64).stream(PROGRAM)
+
+    assert simulator.received == [sender.clean_line(line) for line in PROGRAM]
+    assert stats.lines == len(PROGRAM)
+    assert not simulator.overflowed
+    # More than one line was kept waiting at a time.
+    assert 32 < simulator.max_buffered <= 64
+
+
+def test_stream_line_too_long(grbl):
+    _, connection = grbl
+
+    with pytest.raises(sender.GrblError, match="too long"):
+        get_sender(connection).stream(["G01 X" + "1" * 200])
+
+
+@pytest.mark.parametrize(
+    "grbl", [{"responses": {"G01X5.000Y5.000F100": "error:20"}}], indirect=True
+)
+def test_stream_error(grbl):
+    simulator, connection = grbl
+
+    with pytest.raises(sender.GrblError, match="Line 9: .*error:20") as raised:
+        get_sender(connection).stream(PROGRAM)
+
+    assert not isinstance(raised.value, sender.GrblAlarm)
+    assert "G01X5.000Y5.000F100" in simulator.received
+
+
+@pytest.mark.parametrize("grbl", [{"responses": {"G00Z2.0": "ALARM:2"}}], indirect=True)
+def test_stream_alarm(grbl):
+    _, connection = grbl
+
+    with pytest.raises(sender.GrblAlarm, match="Line 3: .*ALARM:2"):
+        get_sender(connection).stream(PROGRAM)
+
+
+def test_stream_pauses_for_tool_change(grbl):
+    simulator, connection = grbl
+    tool_changes = []
+
+    stats = get_sender(connection, on_tool_change=tool_changes.append).stream(
+        ["G00 X1 Y1", "T2 M06", "G00 X2 Y2"]
+    )
+
+    assert tool_changes == ["T2 M06"]
+    assert simulator.received == ["G00X1Y1", "G00X2Y2"]
+    assert stats.lines == 2
@@ -0,0 +1,154 @@
+import io
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+
+import pytest
+
+from barbari.exceptions import BarbariUserError
+from barbari.server import JobHTTPServer, JobServer, JobStatus
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+FAKE_FLATCAM = os.path.join(os.path.dirname(__file__), "fake_flatcam.py")
+
+
+def get_archive(directory=FIXTURE):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipped:
+        for filename in sorted(os.listdir(directory)):
+            zipped.write(os.path.join(directory, filename), f"exports/{filename}")
+    return buffer.getvalue()
+
+
+def get_job_server(work_dir, **kwargs):
+    return JobServer(
+        str(work_dir),
+        workers=1,
+        flatcam_path=FAKE_FLATCAM,
+        python_bin=sys.executable,
+        step_timeout=10,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def server(tmp_path):
+    job_server = get_job_server(tmp_path, max_upload_size=1024 * 1024)
+    http_server = JobHTTPServer(("127.0.0.1", 0), job_server)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    job_server.start()
+    thread.start()
+    yield job_server, f"http://127.0.0.1:{http_server.server_port}"
+    http_server.shutdown()
+    http_server.server_close()
+    job_server.stop()
+
+
+def request(url, data=None):
+    try:
+        with urllib.request.urlopen(url, data=data, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_build_job(server, tmp_path):
+    job_server, url = server
+
+    status, body = request(f"{url}/jobs?config=simple", get_archive())
+    assert status == 202
+    job_id = json.loads(body)["id"]
+
+    status, body = request(f"{url}/jobs/{job_id}?wait=30")
+    job = json.loads(body)
+    assert job["status"] == "succeeded", job["error"]
+    assert job["files"]
+    assert job["steps"]
+
+    status, body = request(f"{url}/jobs/{job_id}/gcode")
+    assert status == 200
+    assert sorted(zipfile.ZipFile(io.BytesIO(body)).namelist()) == sorted(job["files"])
+
+    status, body = request(f"{url}/jobs/{job_id}/gcode/{job['files'][0]}")
+    assert status == 200
+    assert body.startswith(b"G21")
+
+    assert os.listdir(tmp_path / "uploads") == []
+
+
+def test_resubmitted_board_reuses_project(server, tmp_path):
+    job_server, url = server
+    archive = get_archive()
+
+    for _ in range(2):
+        _, body = request(f"{url}/jobs?config=simple", archive)
+        job = job_server.get(json.loads(body)["id"])
+        assert job.done.wait(30)
+        assert job.status == JobStatus.SUCCEEDED, job.error
+
+    assert len(os.listdir(tmp_path / "projects")) == 1
+
+
+@pytest.mark.parametrize(
+    "path, data, expected",
+    [
+        ("/jobs?config=simple", b"not a zip", 400),
+        ("/jobs?config=no_such_config", get_archive(), 400),
+        ("/jobs", get_archive(), 400),
+        ("/jobs?config=simple", b"\0" * (2 * 1024 * 1024), 413),
+        ("/elsewhere", get_archive(), 404),
+    ],
+)
+def test_rejected_upload(server, tmp_path, path, data, expected):
+    _, url = server
+
+    status, body = request(f"{url}{path}", data)
+
+    assert status == expected
+    assert json.loads(body)["error"]
+    uploads = tmp_path / "uploads"
+    assert not uploads.exists() or not os.listdir(uploads)
+
+
+def test_queued_upload_waits_on_disk(tmp_path):
+    job_server = get_job_server(tmp_path)
+    archive = get_archive()
+
+    job = job_server.submit(io.BytesIO(archive), ["simple"])
+
+    assert job.status == JobStatus.QUEUED
+    with open(job.upload_path, "rb") as inf:
+        assert inf.read() == archive
+
+    job_server.start()
+    try:
+        assert job.done.wait(30)
+    finally:
+        job_server.stop()
+    assert job.status == JobStatus.SUCCEEDED, job.error
+    assert not os.path.exists(job.upload_path)
+
+
+def test_upload_larger_than_limit_is_removed(tmp_path):
+    job_server = get_job_server(tmp_path, max_upload_size=1024)
+
+    with pytest.raises(BarbariUserError, match="too large"):
+        job_server.submit(io.BytesIO(get_archive()), ["simple"])
+
+    assert os.listdir(tmp_path / "uploads") == []
+
+
+def test_full_queue_refuses_jobs(tmp_path):
+    job_server = get_job_server(tmp_path, queue_size=1)
+    job_server.submit(io.BytesIO(get_archive()), ["simple"])
+
+    with pytest.raises(BarbariUserError, match="Too many jobs"):
+        job_server.submit(io.BytesIO(get_archive()), ["simple"])
+
+    assert len(os.listdir(tmp_path / "uploads")) == 1
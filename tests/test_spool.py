@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import signal
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from barbari import api, spool
+from barbari.server import JobStatus
+
+# Workers are forked, so each inherits the stand-in for `api.build`.
+context = multiprocessing.get_context("fork")
+
+
+def fake_build(directory, configs, output_path=None, metrics=None, **kwargs):
+    if "crash" in configs:
+        # Dies holding its claim, as though its host went down.
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    with open(os.path.join(directory, "builds.log"), "a") as outf:
+        outf.write(f"{os.path.basename(output_path)}\n")
+    time.sleep(0.05)
+
+    return SimpleNamespace(
+        gcode_files=[],
+        timings=[],
+        plan=SimpleNamespace(tool_assignments=[], unassigned_tools=[]),
+    )
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "build", fake_build)
+    directory = tmp_path / "project"
+    directory.mkdir()
+    return directory
+
+
+def run_worker(path, worker_id, stale_after):
+    spool.SpoolWorker(
+        spool.Spool(path),
+        worker_id=worker_id,
+        heartbeat=stale_after / 5,
+        stale_after=stale_after,
+        poll_interval=0.05,
+        max_attempts=2,
+    ).run(drain=True)
+
+
+def start_workers(jobs, worker_ids, stale_after):
+    workers = [
+        context.Process(target=run_worker, args=(jobs.path, worker_id, stale_after))
+        for worker_id in worker_ids
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    return workers
+
+
+def test_each_job_is_claimed_once(tmp_path, project):
+    jobs = spool.Spool(str(tmp_path / "spool"))
+    submitted = [jobs.submit(str(project), ["simple"]) for _ in range(20)]
+
+    worker_ids = [f"worker{idx}" for idx in range(4)]
+    workers = start_workers(jobs, worker_ids, stale_after=10)
+
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    with open(project / "builds.log") as inf:
+        assert sorted(inf.read().split()) == sorted(job.id for job in submitted)
+    for job in submitted:
+        status = jobs.get_status(job.id)
+        assert status["status"] == JobStatus.SUCCEEDED.value
+        assert status["attempts"] == 0
+        assert status["worker"] in worker_ids
+    assert os.listdir(tmp_path / "spool" / "queued") == []
+    assert os.listdir(tmp_path / "spool" / "running") == []
+
+
+def test_crashed_workers_job_is_requeued_then_failed(tmp_path, project):
+    jobs = spool.Spool(str(tmp_path / "spool"))
+    job = jobs.submit(str(project), ["crash"])
+
+    # The first worker claims the job and dies; the next finds its claim
+    # stale, requeues the job and dies building it in turn.
+    for attempt in range(2):
+        (worker,) = start_workers(jobs, [f"crashed{attempt}"], stale_after=0.5)
+        assert worker.exitcode == -signal.SIGKILL
+        status = jobs.get_status(job.id)
+        assert status["status"] == JobStatus.RUNNING.value
+        assert status["worker"] == f"crashed{attempt}"
+        time.sleep(0.6)
+
+    # The job has now been abandoned `max_attempts` times.
+    (worker,) = start_workers(jobs, ["survivor"], stale_after=0.5)
+
+    assert worker.exitcode == 0
+    status = jobs.get_status(job.id)
+    assert status["status"] == JobStatus.FAILED.value
+    assert status["attempts"] == 2
+    assert "Abandoned by 2 workers" in status["error"]
+    assert os.listdir(tmp_path / "spool" / "queued") == []
+    assert os.listdir(tmp_path / "spool" / "running") == []
+    assert not (project / "builds.log").exists()
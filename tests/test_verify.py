@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import pytest
+
+from barbari import api, config, gerbers, main, verify
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+
+
+@pytest.fixture
+def project_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    directory = tmp_path / "project"
+    shutil.copytree(FIXTURE, directory)
+    return directory
+
+
+def write_programs(directory, x=None):
+    """Write a short cut at the centre of the board to each file."""
+    conf = config.get_merged_config(["simple"])
+    plan = api.plan(str(directory), conf, preflight=False)
+    limits = verify.get_limits(
+        gerbers.GerberProject(str(directory)), conf, plan.processes
+    )
+
+    for filename, limit in limits.items():
+        (min_x, max_x), (min_y, max_y) = limit.bounds
+        start_x = (min_x + max_x) / 2 if x is None else x
+        center_y = (min_y + max_y) / 2
+        (directory / filename).write_text(
+            "G21\nG90\n"
+            f"G0 Z{limit.travel_z}\n"
+            f"G0 X{start_x} Y{center_y}\n"
+            f"G1 Z{limit.cut_z} F100\n"
+            f"G1 X{start_x + 1}\n"
+            f"G0 Z{limit.travel_z}\n"
+        )
+
+    return sorted(limits)
+
+
+def test_good_program_is_accepted(project_dir, capsys):
+    filenames = write_programs(project_dir)
+
+    main.main("verify", str(project_dir), "simple")
+
+    assert f"Verified {len(filenames)} files" in capsys.readouterr().out
+
+
+def test_out_of_bounds_program_is_flagged(project_dir, capsys):
+    filenames = write_programs(project_dir, x=500)
+
+    main.main("verify", str(project_dir), "simple")
+
+    output = capsys.readouterr().out
+    # One problem in each file.
+    assert f"Found {len(filenames)} problems" in output
+    assert "moves to (500.000" in output
@@ -0,0 +1,98 @@
+import argparse
+import os
+import shutil
+import sys
+
+from barbari import watch
+from barbari.commands.watch import Command
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "benchmarks", "projects", "mixed_holes"
+)
+FAKE_FLATCAM = os.path.join(os.path.dirname(__file__), "fake_flatcam.py")
+
+
+def get_command(directory):
+    parser = argparse.ArgumentParser()
+    Command._add_arguments(parser)
+    options = parser.parse_args(
+        [
+            str(directory),
+            "simple",
+            "--flatcam",
+            FAKE_FLATCAM,
+            "--python-bin",
+            sys.executable,
+            "--step-timeout",
+            "5",
+        ]
+    )
+    return Command(options)
+
+
+def get_gcode_files(directory):
+    return sorted(
+        filename for filename in os.listdir(directory) if filename.endswith(".gcode")
+    )
+
+
+def write_outputs(processes):
+    for process in processes:
+        if hasattr(process, "filename"):
+            open(process.filename, "w").close()
+
+
+def test_partial_script_quits(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    processes = get_command(tmp_path).get_processes()
+    write_outputs(processes)
+
+    stale = watch.get_stale_processes(
+        processes, processes, {str(tmp_path / "board-B_Cu.gbl")}
+    )
+
+    assert 0 < len(stale) < len(processes)
+    assert stale[-1].cmd == "quit_flatcam"
+
+
+def test_nothing_stale_runs_nothing(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    processes = get_command(tmp_path).get_processes()
+    write_outputs(processes)
+
+    assert watch.get_stale_processes(processes, processes, set()) == []
+
+
+def test_rebuild(tmp_path):
+    shutil.copytree(FIXTURE, tmp_path, dirs_exist_ok=True)
+    command = get_command(tmp_path)
+
+    processes = command.rebuild([], set())
+    assert processes is not None
+    built = get_gcode_files(tmp_path)
+    assert built
+
+    changed_path = str(tmp_path / "board-B_Cu.gbl")
+    with open(changed_path, "a") as outf:
+        outf.write("\n")
+    removed = os.path.join(tmp_path, built[0])
+    os.unlink(removed)
+    before = {
+        filename: os.stat(os.path.join(tmp_path, filename)).st_mtime_ns
+        for filename in get_gcode_files(tmp_path)
+    }
+
+    rebuilt = command.rebuild(processes, {changed_path})
+
+    assert rebuilt is not None
+    assert get_gcode_files(tmp_path) == built
+    with open(tmp_path / "generate_gcode.FlatScript") as inf:
+        script = inf.read()
+    assert script.rstrip().endswith("quit_flatcam")
+    # Only some of the files were generated again.
+    unchanged = [
+        filename
+        for filename, mtime in before.items()
+        if os.stat(os.path.join(tmp_path, filename)).st_mtime_ns == mtime
+    ]
+    assert unchanged